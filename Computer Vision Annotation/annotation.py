@@ -1,6 +1,20 @@
 """ESP Custom window code to annotate the output of Computer Vision models."""
 
+import atexit
+import collections
+import concurrent.futures
+import itertools
+import math
+import multiprocessing
+import multiprocessing.shared_memory
+import operator
+import os
+import queue
+import re
+import threading
+import time
 import cv2
+import numpy as np
 
 # Import ESP specific packages, when available. This allows to test the Python code outside of ESP
 try:
@@ -9,25 +23,224 @@ try:
 except ModuleNotFoundError:
     print("Running without ESP packages")
 
+# Import a faster JPEG encoder, when available. OpenCV is used otherwise
+try:
+    import simplejpeg  # type: ignore
+except ModuleNotFoundError:
+    simplejpeg = None  # pylint: disable=invalid-name
+
 # Constants for creating the annotated image
 FONT_FACE = cv2.FONT_HERSHEY_SIMPLEX
 FONT_SCALE = 0.3
 THICKNESS = 1
 SAS_BLUE = (5, 74, 153)[::-1]  # SAS Blue (b,g,r)
 MARGIN = 2
+KEYPOINT_FONT_SCALE = 0.5
+KEYPOINT_RADIUS = 4
+
+# Drawing options per `render_profile`, from the best looking to the fastest
+RENDER_PROFILES = {
+    "quality": {
+        "line_type": cv2.LINE_AA,  # Boxes, trails and skeletons
+        "text_line_type": cv2.LINE_AA,
+        "label_background": True,  # Filled rectangle behind the box labels
+        "keypoint_markers": "shapes",  # Squares for right and circles for left body parts
+        "min_text_box_size": 0,  # Boxes smaller than this in pixels get no text
+    },
+    "balanced": {
+        "line_type": cv2.LINE_8,
+        "text_line_type": cv2.LINE_AA,
+        "label_background": True,
+        "keypoint_markers": "shapes",
+        "min_text_box_size": 0,
+    },
+    "fast": {
+        "line_type": cv2.LINE_8,
+        "text_line_type": cv2.LINE_8,
+        "label_background": False,
+        "keypoint_markers": "dots",  # Dots drawn with one call per object
+        "min_text_box_size": 24,
+    },
+}
+
+# Number of color bands to fade track trails with, from dim (oldest) to full color (newest)
+TRAIL_FADE_BANDS = 4
+
+# Heatmaps are colored with this OpenCV color map, which is black for no activity
+HEATMAP_COLORMAP = cv2.COLORMAP_INFERNO
+HEATMAP_OPACITY = 0.6  # Weight of the heatmap when it is added to the annotated image
+# Heatmap grids are divided by the weight of new detections when it exceeds this, see `add_to_heatmap`
+HEATMAP_MAX_WEIGHT = 1e6
+
+# Video segments are MJPEG in AVI containers, which OpenCV can write without extra codecs
+SEGMENT_FOURCC = cv2.VideoWriter_fourcc(*"MJPG")
+
+# Stages of `process_event` that are timed by the instrumentation, see `record_timings`
+TIMING_STAGES = ["decode", "pseudonymize", "trails", "boxes", "keypoints", "encode"]
+
+# Latency histograms have logarithmic buckets, from 1 microsecond to 2^28 microseconds (4.5 minutes)
+TIMING_BUCKETS_PER_OCTAVE = 4
+TIMING_BUCKETS = 28 * TIMING_BUCKETS_PER_OCTAVE
+
+# Sizes for pseudonymization, relative to the size of the bounding box
+PIXELATE_BLOCKS = 8  # Blocks along the longest side of the box
+BLUR_KERNEL_DIVISOR = 4  # Blur kernel size is the shortest side of the box divided by this
+
+# Smallest overlays for downscaled output images, so the overlays stay legible
+MIN_FONT_SCALE = 0.2
+MIN_THICKNESS = 1
+MIN_KEYPOINT_FONT_SCALE = 0.35
+MIN_KEYPOINT_RADIUS = 2
+
+# OpenCV flags to decode images at a reduced size, per reduction factor
+REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+# Wide images have a header of three little-endian 64-bit integers: width, height and OpenCV type
+WIDE_HEADER_SIZE = 24
+WIDE_BGR_TYPE = 16  # CV_8UC3 of OpenCV 4, OpenCV 5 changed the type numbers
+
+# Input variables with one value per keypoint, see `decode_keypoints`
+KEYPOINT_FIELDS = [
+    "object_track_kpts_x",
+    "object_track_kpts_y",
+    "object_track_kpts_score",
+    "object_track_kpts_label_id",
+]
+
+# Input variables with coordinates, which are scaled for downscaled output images
+COORDINATE_FIELDS = [
+    "x",
+    "y",
+    "w",
+    "h",
+    "object_track_x",
+    "object_track_y",
+    "object_track_kpts_x",
+    "object_track_kpts_y",
+]
 
 # Logging context name
 LOGGING_CONTEXT = "DF.ESP.CUSTOM.CV_ANNOTATION"
 
 # Supported values
-SUPPORTED_PSEUDONYMIZATION = ["none", "black_bbox"]
+SUPPORTED_PSEUDONYMIZATION = ["none", "black_bbox", "gaussian_blur", "pixelate"]
 SUPPORTED_IMAGE_ENCODING = ["wide", "jpg", "png"]
+SUPPORTED_JPEG_BACKENDS = ["opencv", "simplejpeg"]
+SUPPORTED_CHROMA_SUBSAMPLING = ["444", "422", "420"]
+SUPPORTED_SKIP_MODES = ["drop", "passthrough"]
+SUPPORTED_HEATMAPS = ["none", "centers", "areas"]
+SUPPORTED_HEATMAP_OUTPUTS = ["blend", "field"]
+
+# Encoder options per `encoder_preset`, the `default` preset uses the OpenCV defaults
+ENCODER_PRESETS = {
+    "default": {
+        "jpeg_quality": 95,
+        "jpeg_chroma_subsampling": "420",
+        "jpeg_progressive": False,
+        "jpeg_optimize": False,
+        "png_compression": 1,
+    },
+    "speed": {
+        "jpeg_quality": 80,
+        "jpeg_chroma_subsampling": "420",
+        "jpeg_progressive": False,
+        "jpeg_optimize": False,
+        "png_compression": 1,
+    },
+    "balanced": {
+        "jpeg_quality": 85,
+        "jpeg_chroma_subsampling": "420",
+        "jpeg_progressive": False,
+        "jpeg_optimize": True,
+        "png_compression": 3,
+    },
+    "size": {
+        "jpeg_quality": 70,
+        "jpeg_chroma_subsampling": "420",
+        "jpeg_progressive": True,
+        "jpeg_optimize": True,
+        "png_compression": 6,
+    },
+    "quality": {
+        "jpeg_quality": 95,
+        "jpeg_chroma_subsampling": "444",
+        "jpeg_progressive": False,
+        "jpeg_optimize": True,
+        "png_compression": 3,
+    },
+}
 
 # Keep track of errors
 error = False  # pylint: disable=invalid-name
 
 SETTINGS = {}
 
+# Settings compiled into the structures used while annotating, see `compile_render_plan`
+RENDER_PLAN = {}
+
+# Settings compiled into the options used while encoding, see `compile_encoder`
+ENCODER = {}
+
+# Least recently used cache of pre-rendered label sprites, see `get_label_sprite`
+LABEL_CACHE = collections.OrderedDict()
+LABEL_CACHE_LOCK = threading.Lock()
+
+# Free image buffers by shape and dtype, see `take_buffer`
+BUFFER_POOL = {}
+BUFFER_POOL_LOCK = threading.Lock()
+
+# Thread pool to process event blocks, see `start_thread_pool`
+THREAD_POOL = None
+
+# Whether `esp_utils` uses the wide image layout read and written by this module, see `check_wide_layout`
+WIDE_LAYOUT = True
+
+# Process pool and shared memory ring of frame slots to annotate event blocks, see `start_process_pool`
+PROCESS_POOL = None
+PROCESS_MEMORY = None
+
+# Frame-rate limiting state per camera, see `skip_frame`
+CAMERA_STATE = {}
+CAMERA_STATE_LOCK = threading.Lock()
+
+# Queue and thread that write annotated frames to video segments, see `start_segment_sink`
+SEGMENT_QUEUE = None
+SEGMENT_THREAD = None
+
+# Current video segment per camera, see `queue_segment_frame`
+SEGMENT_STATE = {}
+SEGMENT_STATE_LOCK = threading.Lock()
+SEGMENT_COUNTER = itertools.count()
+
+# Detection heatmap per camera, see `add_to_heatmap`
+HEATMAPS = {}
+HEATMAPS_LOCK = threading.Lock()
+
+# Latency histograms per stage since the last summary, see `record_timings`
+TIMINGS = {"histograms": {}, "events": 0, "last_log": 0.0}
+TIMINGS_LOCK = threading.Lock()
+
+# Counters that can be inspected to tune the custom window
+STATS = {
+    "label_cache_hits": 0,
+    "label_cache_misses": 0,
+    "buffer_pool_hits": 0,
+    "buffer_pool_misses": 0,
+    "passthrough_frames": 0,
+    "skipped_frames": {},  # Per camera ID
+    "wide_in_place_frames": 0,
+    "wide_copied_frames": 0,
+    "invalid_frames": 0,
+    "segment_frames": 0,
+    "segment_dropped_frames": 0,
+    "process_oversized_frames": 0,
+}
+STATS_LOCK = threading.Lock()
+
 # Colors are in RGB format, note that OpenCV uses BGR
 # Colors taken from https://brand.sas.com/en/home/brand-assets/design-elements/color.html
 COLORS = [
@@ -42,6 +255,7 @@ COLORS = [
     [255, 255, 255],  # White
     [3, 41, 84],  # Midnight Blue
 ]
+COLORS_BGR = [tuple(color[::-1]) for color in COLORS]
 
 
 def init(settings):
@@ -49,15 +263,58 @@ def init(settings):
 
     Args:
         settings (dict): A dictionary containing configuration options.
-            - `pseudonymization` (str): Pseudonymization setting. Must be one of `none` or `black_bbox`.
+            - `pseudonymization` (str): Pseudonymization setting. Must be in `SUPPORTED_PSEUDONYMIZATION`.
             - `input_image_encoding` (str): Specifies the input image encoding format. Must be in `SUPPORTED_IMAGE_ENCODING`.
             - `output_image_encoding` (str): Specifies the output image encoding format. Must be in `SUPPORTED_IMAGE_ENCODING`.
             - `object_label_separator` (str): Separator used for object labels. Cannot be an empty string.
             - `skeleton` (str, optional): Skeleton definition for keypoints. Only required when using keypoints.
             - `kpts_labels` (str, optional): Keypoint labels. Only required when using keypoints.
             - `show_keypoint_labels` (str, optional): Whether to show keypoint labels or not. Only required when using keypoints.
+            - `render_profile` (str): Line types, label backgrounds, keypoint markers and text to draw with. Must be in `RENDER_PROFILES`.
+            - `label_cache_size` (str): Maximum number of pre-rendered labels to keep. Must be a non-negative integer.
+            - `buffer_pool_size` (str): Maximum number of free image buffers to keep per image size. Must be a non-negative integer.
+            - `worker_threads` (str): Number of threads to process an event block with. Must be a positive integer.
+            - `worker_processes` (str): Number of processes to annotate an event block with. Must be a non-negative integer, `0` for no processes.
+            - `process_slots` (str): Number of frames in the shared memory of the processes. Must be a positive integer.
+            - `process_slot_mb` (str): Maximum size of a decoded frame for the processes in MiB. Must be a positive number.
+            - `encoder_preset` (str): Encoder options for `jpg` and `png` output. Must be in `ENCODER_PRESETS`.
+            - `jpeg_quality` (str): JPEG quality from 1 to 100. Empty to use the preset.
+            - `jpeg_chroma_subsampling` (str): JPEG chroma subsampling. Must be in `SUPPORTED_CHROMA_SUBSAMPLING` or `preset`.
+            - `jpeg_progressive` (str): Whether to write progressive JPEG. Must be `yes`, `no` or `preset`.
+            - `jpeg_optimize` (str): Whether to optimize the JPEG Huffman tables. Must be `yes`, `no` or `preset`.
+            - `png_compression` (str): PNG compression level from 0 to 9. Empty to use the preset.
+            - `jpeg_backend` (str): JPEG encoder. Must be in `SUPPORTED_JPEG_BACKENDS`.
+            - `output_scale` (str): Scale of the output image. Must be a number above 0, up to 1.
+            - `output_max_width` (str): Maximum width of the output image. Must be a non-negative integer, `0` for no maximum.
+            - `max_output_fps` (str): Maximum annotated frames per second per camera. Must be a non-negative number, `0` for no maximum.
+            - `annotate_every_n` (str): Annotate every n-th frame per camera. Must be a positive integer.
+            - `skip_mode` (str): What to do with skipped frames. Must be in `SUPPORTED_SKIP_MODES`.
+            - `min_score` (str): Minimum confidence score of the boxes to draw. Must be a number from 0 to 1.
+            - `max_objects` (str): Maximum number of boxes to draw, the highest scores first. Must be a non-negative integer, `0` for no maximum.
+            - `min_box_area` (str): Minimum area of the boxes to draw in output image pixels. Must be a non-negative number.
+            - `trail_length` (str): Number of track points to draw per object. Must be a non-negative integer, `0` for no trails.
+            - `trail_fade` (str): Whether to fade track trails from old to new. Must be `yes` or `no`.
+            - `heatmap` (str): What to accumulate in the detection heatmap per camera. Must be in `SUPPORTED_HEATMAPS`.
+            - `heatmap_output` (str): How to output the heatmap. Must be in `SUPPORTED_HEATMAP_OUTPUTS`.
+            - `heatmap_cell_size` (str): Size of the heatmap cells in input image pixels. Must be a positive integer.
+            - `heatmap_half_life` (str): Frames after which detections count half in the heatmap. Must be a number of at least 1.
+            - `segment_directory` (str): Directory to write video segments of the annotated frames to. Empty to not write segments.
+            - `segment_seconds` (str): Maximum duration of a video segment in seconds. Must be a positive number.
+            - `segment_max_mb` (str): Maximum size of a video segment in MiB. Must be a non-negative number, `0` for no maximum.
+            - `segment_fps` (str): Frame rate of the video segments. Must be a positive number.
+            - `segment_queue_size` (str): Maximum number of frames waiting to be written. Must be a positive integer.
+            - `instrumentation` (str): Whether to keep latency histograms per stage and log summaries. Must be `yes` or `no`.
+            - `instrumentation_log_events` (str): Events between summaries. Must be a non-negative integer, `0` to not log by events.
+            - `instrumentation_log_seconds` (str): Seconds between summaries. Must be a non-negative number, `0` to not log by time.
+            - `timing_fields` (str): Whether to add the latencies to the output event. Must be `yes` or `no`.
+            - `warm_up` (str): Whether to annotate a synthetic frame in `init()`, see `warm_up`. Must be `yes` or `no`.
+            - `warm_up_width` (str): Width of the synthetic frame. Must be a positive integer.
+            - `warm_up_height` (str): Height of the synthetic frame. Must be a positive integer.
+            - `warm_up_labels` (str): Object labels to draw on the synthetic frame, separated by commas.
     """
     global SETTINGS
+    global RENDER_PLAN
+    global ENCODER
     global error
 
     if settings["pseudonymization"] not in SUPPORTED_PSEUDONYMIZATION:
@@ -92,6 +349,224 @@ def init(settings):
         )
         error = True
 
+    validate_setting(
+        settings,
+        "render_profile",
+        settings["render_profile"] in RENDER_PROFILES,
+        f"Must be either {','.join(RENDER_PROFILES)}",
+    )
+    validate_setting(
+        settings,
+        "label_cache_size",
+        is_number(settings["label_cache_size"], 0),
+        "Must be a non-negative integer",
+    )
+    validate_setting(
+        settings,
+        "buffer_pool_size",
+        is_number(settings["buffer_pool_size"], 0),
+        "Must be a non-negative integer",
+    )
+    validate_setting(
+        settings,
+        "worker_threads",
+        is_number(settings["worker_threads"], 1),
+        "Must be a positive integer",
+    )
+    validate_setting(
+        settings,
+        "worker_processes",
+        is_number(settings["worker_processes"], 0),
+        "Must be a non-negative integer",
+    )
+    validate_setting(
+        settings,
+        "process_slots",
+        is_number(settings["process_slots"], 1),
+        "Must be a positive integer",
+    )
+    validate_setting(
+        settings,
+        "process_slot_mb",
+        is_number(settings["process_slot_mb"], 0.001, number_type=float),
+        "Must be a positive number",
+    )
+    validate_setting(
+        settings,
+        "encoder_preset",
+        settings["encoder_preset"] in ENCODER_PRESETS,
+        f"Must be either {','.join(ENCODER_PRESETS)}",
+    )
+    validate_setting(
+        settings,
+        "jpeg_quality",
+        settings["jpeg_quality"] == "" or is_number(settings["jpeg_quality"], 1, 100),
+        "Must be empty or an integer from 1 to 100",
+    )
+    validate_setting(
+        settings,
+        "jpeg_chroma_subsampling",
+        settings["jpeg_chroma_subsampling"]
+        in ["preset"] + SUPPORTED_CHROMA_SUBSAMPLING,
+        f"Must be either preset,{','.join(SUPPORTED_CHROMA_SUBSAMPLING)}",
+    )
+    for name in ["jpeg_progressive", "jpeg_optimize"]:
+        validate_setting(
+            settings,
+            name,
+            settings[name] in ["preset", "yes", "no"],
+            "Must be either preset,yes,no",
+        )
+    validate_setting(
+        settings,
+        "png_compression",
+        settings["png_compression"] == "" or is_number(settings["png_compression"], 0, 9),
+        "Must be empty or an integer from 0 to 9",
+    )
+    validate_setting(
+        settings,
+        "output_scale",
+        is_number(settings["output_scale"], 0.01, 1, float),
+        "Must be a number above 0, up to 1",
+    )
+    validate_setting(
+        settings,
+        "output_max_width",
+        is_number(settings["output_max_width"], 0),
+        "Must be a non-negative integer",
+    )
+    validate_setting(
+        settings,
+        "max_output_fps",
+        is_number(settings["max_output_fps"], 0, number_type=float),
+        "Must be a non-negative number",
+    )
+    validate_setting(
+        settings,
+        "annotate_every_n",
+        is_number(settings["annotate_every_n"], 1),
+        "Must be a positive integer",
+    )
+    validate_setting(
+        settings,
+        "skip_mode",
+        settings["skip_mode"] in SUPPORTED_SKIP_MODES,
+        f"Must be either {','.join(SUPPORTED_SKIP_MODES)}",
+    )
+    validate_setting(
+        settings,
+        "min_score",
+        is_number(settings["min_score"], 0, 1, number_type=float),
+        "Must be a number from 0 to 1",
+    )
+    validate_setting(
+        settings,
+        "max_objects",
+        is_number(settings["max_objects"], 0),
+        "Must be a non-negative integer",
+    )
+    validate_setting(
+        settings,
+        "min_box_area",
+        is_number(settings["min_box_area"], 0, number_type=float),
+        "Must be a non-negative number",
+    )
+    validate_setting(
+        settings,
+        "trail_length",
+        is_number(settings["trail_length"], 0),
+        "Must be a non-negative integer",
+    )
+    validate_setting(
+        settings,
+        "trail_fade",
+        settings["trail_fade"] in ["yes", "no"],
+        "Must be either yes,no",
+    )
+    validate_setting(
+        settings,
+        "heatmap",
+        settings["heatmap"] in SUPPORTED_HEATMAPS,
+        f"Must be either {','.join(SUPPORTED_HEATMAPS)}",
+    )
+    validate_setting(
+        settings,
+        "heatmap_output",
+        settings["heatmap_output"] in SUPPORTED_HEATMAP_OUTPUTS,
+        f"Must be either {','.join(SUPPORTED_HEATMAP_OUTPUTS)}",
+    )
+    validate_setting(
+        settings,
+        "heatmap_cell_size",
+        is_number(settings["heatmap_cell_size"], 1),
+        "Must be a positive integer",
+    )
+    validate_setting(
+        settings,
+        "heatmap_half_life",
+        is_number(settings["heatmap_half_life"], 1, number_type=float),
+        "Must be a number of at least 1",
+    )
+    if settings["segment_directory"] != "":
+        try:
+            os.makedirs(settings["segment_directory"], exist_ok=True)
+            writable = os.access(settings["segment_directory"], os.W_OK)
+        except OSError:
+            writable = False
+        validate_setting(
+            settings, "segment_directory", writable, "Must be a writable directory"
+        )
+    validate_setting(
+        settings,
+        "segment_seconds",
+        is_number(settings["segment_seconds"], 0.001, number_type=float),
+        "Must be a positive number",
+    )
+    validate_setting(
+        settings,
+        "segment_max_mb",
+        is_number(settings["segment_max_mb"], 0, number_type=float),
+        "Must be a non-negative number",
+    )
+    validate_setting(
+        settings,
+        "segment_fps",
+        is_number(settings["segment_fps"], 0.001, number_type=float),
+        "Must be a positive number",
+    )
+    validate_setting(
+        settings,
+        "segment_queue_size",
+        is_number(settings["segment_queue_size"], 1),
+        "Must be a positive integer",
+    )
+    for name in ["instrumentation", "timing_fields", "warm_up"]:
+        validate_setting(
+            settings, name, settings[name] in ["yes", "no"], "Must be either yes,no"
+        )
+    validate_setting(
+        settings,
+        "instrumentation_log_events",
+        is_number(settings["instrumentation_log_events"], 0),
+        "Must be a non-negative integer",
+    )
+    validate_setting(
+        settings,
+        "instrumentation_log_seconds",
+        is_number(settings["instrumentation_log_seconds"], 0, number_type=float),
+        "Must be a non-negative number",
+    )
+    for name in ["warm_up_width", "warm_up_height"]:
+        validate_setting(
+            settings, name, is_number(settings[name], 1), "Must be a positive integer"
+        )
+    validate_setting(
+        settings,
+        "jpeg_backend",
+        settings["jpeg_backend"] in SUPPORTED_JPEG_BACKENDS,
+        f"Must be either {','.join(SUPPORTED_JPEG_BACKENDS)}",
+    )
+
     if settings["kpts_labels"] == "":
         esp.logMessage(
             logcontext=LOGGING_CONTEXT,
@@ -116,54 +591,1434 @@ def init(settings):
                 message=f"Using `{settings['kpts_labels']}` as keypoint labels",
                 level="info",
             )
+        esp.logMessage(
+            logcontext=LOGGING_CONTEXT,
+            message=f"Using `{settings['render_profile']}` render profile",
+            level="info",
+        )
+        esp.logMessage(
+            logcontext=LOGGING_CONTEXT,
+            message=f"Using {settings['worker_threads']} worker thread(s) to process event blocks",
+            level="info",
+        )
+        if int(settings["worker_processes"]) > 0:
+            esp.logMessage(
+                logcontext=LOGGING_CONTEXT,
+                message=f"Using {settings['worker_processes']} worker process(es) with {settings['process_slots']} shared frame slots of {settings['process_slot_mb']} MiB to annotate event blocks",
+                level="info",
+            )
         SETTINGS = settings
+        RENDER_PLAN = compile_render_plan(settings)
+        ENCODER = compile_encoder(settings)
+        if "wide" in (settings["input_image_encoding"], settings["output_image_encoding"]):
+            if not check_wide_layout():
+                esp.logMessage(
+                    logcontext=LOGGING_CONTEXT,
+                    message="The wide image layout of esp_utils is not the expected layout, wide images are converted with esp_utils",
+                    level="warn",
+                )
+        if settings["output_image_encoding"] != "wide":
+            esp.logMessage(
+                logcontext=LOGGING_CONTEXT,
+                message=f"Using `{settings['encoder_preset']}` encoder preset with options {ENCODER['options']} and the `{ENCODER['backend']}` encoder",
+                level="info",
+            )
+            if (
+                settings["jpeg_backend"] != ENCODER["backend"]
+                and settings["output_image_encoding"] == "jpg"
+            ):
+                esp.logMessage(
+                    logcontext=LOGGING_CONTEXT,
+                    message=f"JPEG backend `{settings['jpeg_backend']}` is not installed or does not support progressive or optimized JPEG, using `{ENCODER['backend']}`",
+                    level="warn",
+                )
+        if float(settings["max_output_fps"]) > 0 or int(settings["annotate_every_n"]) > 1:
+            esp.logMessage(
+                logcontext=LOGGING_CONTEXT,
+                message=f"Annotating every {settings['annotate_every_n']} frame(s) at up to {settings['max_output_fps']} frames per second per camera (0 for no maximum), skipped frames are handled with `{settings['skip_mode']}`",
+                level="info",
+            )
+        if settings["heatmap"] != "none":
+            esp.logMessage(
+                logcontext=LOGGING_CONTEXT,
+                message=f"Accumulating box {settings['heatmap']} in a heatmap per camera with {settings['heatmap_cell_size']} pixel cells and a half-life of {settings['heatmap_half_life']} frames, output with `{settings['heatmap_output']}`",
+                level="info",
+            )
+        if settings["segment_directory"] != "":
+            esp.logMessage(
+                logcontext=LOGGING_CONTEXT,
+                message=f"Writing annotated frames to video segments of {settings['segment_seconds']} seconds or {settings['segment_max_mb']} MiB (0 for no maximum) in `{settings['segment_directory']}`",
+                level="info",
+            )
+        if settings["instrumentation"] == "yes":
+            esp.logMessage(
+                logcontext=LOGGING_CONTEXT,
+                message=f"Logging a latency summary every {settings['instrumentation_log_events']} events or {settings['instrumentation_log_seconds']} seconds (0 for never)",
+                level="info",
+            )
+        LABEL_CACHE.clear()
+        with BUFFER_POOL_LOCK:
+            BUFFER_POOL.clear()
+        reset_timings()
+        with CAMERA_STATE_LOCK:
+            CAMERA_STATE.clear()
+        with HEATMAPS_LOCK:
+            HEATMAPS.clear()
+        # Stop the segment writer and the pools of the previous settings before anything is started
+        stop_segment_sink()
+        start_thread_pool(0)
+        start_process_pool(0)
+        if settings["warm_up"] == "yes":
+            warm_up(
+                int(settings["warm_up_width"]),
+                int(settings["warm_up_height"]),
+                [label for label in settings["warm_up_labels"].split(",") if label != ""],
+            )
+        start_process_pool(int(settings["worker_processes"]))
+        start_thread_pool(int(settings["worker_threads"]))
+        start_segment_sink(
+            settings["segment_directory"],
+            float(settings["segment_fps"]),
+            int(settings["segment_queue_size"]),
+        )
+
+
+def validate_setting(settings, name, valid, requirement):
+    """Logs a fatal error and sets `error` when a setting is not valid.
+
+    Args:
+        settings (dict): A dictionary containing configuration options.
+        name (str): Name of the setting.
+        valid (bool): Whether the setting is valid.
+        requirement (str): Description of the valid values, used in the error message.
+    """
+    global error
+
+    if not valid:
+        esp.logMessage(
+            logcontext=LOGGING_CONTEXT,
+            message=f"Setting `{name}` value `{settings[name]}` is not supported. {requirement}",
+            level="fatal",
+        )
+        error = True
+
+
+def is_number(value, minimum, maximum=None, number_type=int):
+    """Helper function to check if a setting is a number within the given bounds."""
+    try:
+        value = number_type(value)
+    except ValueError:
+        return False
+    return value >= minimum and (maximum is None or value <= maximum)
+
+
+def compile_render_plan(settings):
+    """Compiles the settings into a render plan, so no string parsing is needed for every event.
+
+    Args:
+        settings (dict): A dictionary containing the configuration options, see `init`.
+
+    Returns:
+        dict: The render plan.
+            - `pseudonymization` (str): Pseudonymization setting.
+            - `object_label_separator` (str): Separator used for object labels and attributes.
+            - `kpts_labels` (list[str]): Keypoint names, indexed by label ID.
+            - `kpts_is_right` (list[bool]): Whether a keypoint is a right body part, indexed by label ID.
+            - `skeleton_edges` (list[tuple[int, int]]): Skeleton lines as pairs of label IDs.
+              Pairs that refer to unknown keypoint labels are left out.
+            - `show_keypoint_labels` (bool): Whether to show keypoint labels or not.
+            - `line_type`, `text_line_type`, `label_background`, `keypoint_markers`,
+              `min_text_box_size`: Drawing options of the `render_profile`, see `RENDER_PROFILES`.
+            - `label_cache_size` (int): Maximum number of pre-rendered labels to keep.
+            - `buffer_pool_size` (int): Maximum number of free image buffers to keep per image size.
+            - `output_scale` (float): Scale of the output image.
+            - `output_max_width` (int): Maximum width of the output image, `0` for no maximum.
+            - `frame_interval` (float): Minimum seconds between annotated frames per camera, `0` for no minimum.
+            - `annotate_every_n` (int): Annotate every n-th frame per camera.
+            - `skip_mode` (str): What to do with skipped frames, `drop` or `passthrough`.
+            - `min_score` (float): Minimum confidence score of the boxes to draw.
+            - `max_objects` (int): Maximum number of boxes to draw, `0` for no maximum.
+            - `min_box_area` (float): Minimum area of the boxes to draw in output image pixels.
+            - `trail_length` (int): Number of track points to draw per object, `0` for no trails.
+            - `trail_fade` (bool): Whether to fade track trails from old to new.
+            - `heatmap` (str): What to accumulate in the heatmap, `none`, `centers` or `areas`.
+            - `heatmap_output` (str): How to output the heatmap, `blend` or `field`.
+            - `heatmap_cell_size` (int): Size of the heatmap cells in input image pixels.
+            - `heatmap_growth` (float): Growth of the weight of new detections per frame,
+              which makes older detections decay with the `heatmap_half_life`.
+            - `segment_seconds` (float): Maximum duration of a video segment in seconds.
+            - `segment_max_bytes` (int): Maximum size of a video segment, `0` for no maximum.
+            - `timing` (bool): Whether to time the stages, for `instrumentation` or `timing_fields`.
+            - `instrumentation` (bool): Whether to keep latency histograms and log summaries.
+            - `instrumentation_log_events` (int): Events between summaries, `0` to not log by events.
+            - `instrumentation_log_seconds` (float): Seconds between summaries, `0` to not log by time.
+            - `timing_fields` (bool): Whether to add the latencies to the output event.
+            - `wide_in_place` (bool): Whether to draw on `wide` input images in place, see `wrap_wide_image`.
+            - `process_slots` (int): Number of frame slots in the shared memory of the process pool.
+            - `process_slot_bytes` (int): Size of a frame slot in bytes.
+    """
+    if settings["kpts_labels"] != "":
+        kpts_labels = settings["kpts_labels"].split(",")
+    else:
+        kpts_labels = []
+
+    skeleton_edges = []
+    if settings["skeleton"] != "":
+        for skeleton_pair in settings["skeleton"].split(","):
+            try:
+                sk_from, sk_to = skeleton_pair.split("-")[:2]
+                skeleton_edges.append(
+                    (kpts_labels.index(sk_from), kpts_labels.index(sk_to))
+                )
+            except ValueError:
+                pass
+
+    return {
+        "pseudonymization": settings["pseudonymization"],
+        "object_label_separator": settings["object_label_separator"],
+        "kpts_labels": kpts_labels,
+        # Use rectangle for right body parts and circle for left body parts
+        "kpts_is_right": [
+            name.startswith("r_") or name.startswith("right_") for name in kpts_labels
+        ],
+        "skeleton_edges": skeleton_edges,
+        "show_keypoint_labels": settings["show_keypoint_labels"] == "yes",
+        **RENDER_PROFILES[settings["render_profile"]],
+        "label_cache_size": int(settings["label_cache_size"]),
+        "buffer_pool_size": int(settings["buffer_pool_size"]),
+        "output_scale": float(settings["output_scale"]),
+        "output_max_width": int(settings["output_max_width"]),
+        "frame_interval": (
+            1 / float(settings["max_output_fps"])
+            if float(settings["max_output_fps"]) > 0
+            else 0.0
+        ),
+        "annotate_every_n": int(settings["annotate_every_n"]),
+        "skip_mode": settings["skip_mode"],
+        "min_score": float(settings["min_score"]),
+        "max_objects": int(settings["max_objects"]),
+        "min_box_area": float(settings["min_box_area"]),
+        "trail_length": int(settings["trail_length"]),
+        "trail_fade": settings["trail_fade"] == "yes",
+        "heatmap": settings["heatmap"],
+        "heatmap_output": settings["heatmap_output"],
+        "heatmap_cell_size": int(settings["heatmap_cell_size"]),
+        "heatmap_growth": 2 ** (1 / float(settings["heatmap_half_life"])),
+        "segment_seconds": float(settings["segment_seconds"]),
+        "segment_max_bytes": int(float(settings["segment_max_mb"]) * 1024 * 1024),
+        "timing": "yes" in (settings["instrumentation"], settings["timing_fields"]),
+        "instrumentation": settings["instrumentation"] == "yes",
+        "instrumentation_log_events": int(settings["instrumentation_log_events"]),
+        "instrumentation_log_seconds": float(settings["instrumentation_log_seconds"]),
+        "timing_fields": settings["timing_fields"] == "yes",
+        "wide_in_place": settings["input_image_encoding"]
+        == settings["output_image_encoding"]
+        == "wide",
+        "process_slots": int(settings["process_slots"]),
+        "process_slot_bytes": int(float(settings["process_slot_mb"]) * 1024 * 1024),
+    }
+
+
+def compile_encoder(settings):
+    """Compiles the encoder settings into the options used to encode `jpg` and `png` output images.
+
+    The options of the `encoder_preset` are used, unless a setting overrides them.
+    The `simplejpeg` JPEG backend is only used when it is installed and neither
+    progressive nor optimized JPEG is requested, OpenCV is used otherwise.
+
+    Args:
+        settings (dict): A dictionary containing the configuration options, see `init`.
+
+    Returns:
+        dict: The encoder.
+            - `options` (dict): The encoder options, see `ENCODER_PRESETS`.
+            - `backend` (str): The encoder, either `opencv` or `simplejpeg`.
+            - `extension` (str): The file extension that is passed to OpenCV.
+            - `params` (list[int] | None): The parameters that are passed to OpenCV.
+              `None` when the OpenCV defaults are used.
+    """
+    options = dict(ENCODER_PRESETS[settings["encoder_preset"]])
+    if settings["jpeg_quality"] != "":
+        options["jpeg_quality"] = int(settings["jpeg_quality"])
+    if settings["jpeg_chroma_subsampling"] != "preset":
+        options["jpeg_chroma_subsampling"] = settings["jpeg_chroma_subsampling"]
+    if settings["jpeg_progressive"] != "preset":
+        options["jpeg_progressive"] = settings["jpeg_progressive"] == "yes"
+    if settings["jpeg_optimize"] != "preset":
+        options["jpeg_optimize"] = settings["jpeg_optimize"] == "yes"
+    if settings["png_compression"] != "":
+        options["png_compression"] = int(settings["png_compression"])
+
+    backend = "opencv"
+    if (
+        settings["output_image_encoding"] == "jpg"
+        and settings["jpeg_backend"] == "simplejpeg"
+        and simplejpeg is not None
+        and not options["jpeg_progressive"]
+        and not options["jpeg_optimize"]
+    ):
+        backend = "simplejpeg"
+
+    if settings["output_image_encoding"] == "png":
+        extension = ".png"
+        params = [cv2.IMWRITE_PNG_COMPRESSION, options["png_compression"]]
+    else:
+        extension = ".jpeg"
+        params = [
+            cv2.IMWRITE_JPEG_QUALITY,
+            options["jpeg_quality"],
+            cv2.IMWRITE_JPEG_PROGRESSIVE,
+            int(options["jpeg_progressive"]),
+            cv2.IMWRITE_JPEG_OPTIMIZE,
+            int(options["jpeg_optimize"]),
+        ]
+        # Chroma subsampling is supported as of OpenCV 4.5.5
+        if hasattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR"):
+            params += [
+                cv2.IMWRITE_JPEG_SAMPLING_FACTOR,
+                getattr(
+                    cv2,
+                    f"IMWRITE_JPEG_SAMPLING_FACTOR_{options['jpeg_chroma_subsampling']}",
+                ),
+            ]
+    if options == ENCODER_PRESETS["default"]:
+        params = None
+
+    return {
+        "options": options,
+        "backend": backend,
+        "extension": extension,
+        "params": params,
+    }
 
 
 def create(data, _):
     """Processes image data and generates an event with the annotated image.
 
-    This function is called for every event.
+    This function is called for every event block, as `process_blocks` is enabled.
+
+    Every event in the block is processed by `process_event`. With more than one
+    `worker_threads`, the events are processed in parallel. Decoding, drawing and
+    encoding with OpenCV release the GIL, so the threads can use multiple cores.
+    With `worker_processes`, the frames are annotated by a process pool instead, which
+    also runs the Python code of `annotate` in parallel, see `process_block_in_pool`.
+    Frames to skip are selected and detections are added to the heatmaps in event order
+    first, see `skip_frame` and `add_to_heatmap`.
+
+    Args:
+        data (list[dict] | dict): The input data of the events in the block, or of a single event.
+        context (any): Not used in this function.
+
+    Returns:
+        list[dict] | dict: The output events, in the same order as the input events.
+            See `process_event`.
+        None: If a fatal error is detected (`error` is set globally).
+    """
+    if error:
+        return None
+
+    if not isinstance(data, list):
+        skipped = skip_frame(data)
+        if RENDER_PLAN["heatmap"] != "none":
+            add_to_heatmap(data)
+        return process_event(data, skipped)
+
+    skipped = [skip_frame(event_data) for event_data in data]
+    if RENDER_PLAN["heatmap"] != "none":
+        for event_data in data:
+            add_to_heatmap(event_data)
+    if PROCESS_POOL is not None:
+        events = process_block_in_pool(data, skipped)
+    elif THREAD_POOL is None or len(data) < 2:
+        events = [
+            process_event(event_data, skip) for event_data, skip in zip(data, skipped)
+        ]
+    else:
+        events = list(THREAD_POOL.map(process_event, data, skipped))
+    return [event for event in events if event is not None]
+
+
+def process_event(data, skipped=False):
+    """Processes the image data of one event and generates an event with the annotated image.
 
     This function processes an input image based on the global `SETTINGS` configuration
     and annotates it using the `annotate` function. It converts the image to and from
     OpenCV format as needed and returns an event containing the annotated image.
+    Frames without detections are passed through, see `passthrough_image`, unless a heatmap
+    is drawn, which also covers the frames without detections. With `wide`
+    input and output, the input image is annotated in place when possible, see `wrap_wide_image`.
+    Frames with invalid detections are dropped and counted in `STATS`, see `DetectionBatch`.
+    Decoded images are given back to the buffer pool once encoded, see `take_buffer`.
+    The heatmap of the camera is drawn under the annotations or output separately, see
+    `render_heatmap`. Annotated frames and frames without detections are also written to
+    video segments when a `segment_directory` is set, see `queue_segment_frame`. Skipped
+    frames are not written, so the segments keep the frame rate of `max_output_fps`.
+
+    When `instrumentation` or `timing_fields` is enabled, the stages are timed,
+    see `record_timings`. Otherwise, no time is spent on timing.
 
     Args:
         data (dict): A dictionary containing the input data.
-        context (any): Not used in this function.
+        skipped (bool, optional): Whether the frame is over the frame-rate budget of its camera.
+            Skipped frames are dropped or passed through, depending on the `skip_mode` setting.
 
     Returns:
         dict: A dictionary representing the event containing the annotated image.
             - `annotated_image`: The annotated image in blob format.
-        None: If a fatal error is detected (`error` is set globally).
+            - `heatmap_image`: The heatmap in blob format, when `heatmap_output` is `field`
+              and the frame is not skipped.
+            - `segment_file`: The file name of the video segment of the frame, when it is
+              written to a segment. Skipped frames are not written.
+            - `processing_us`, `decode_us`, ...: The latencies, when `timing_fields` is enabled.
+        None: If the frame is skipped and dropped, or its detections are invalid.
     """
-    if error:
+    if skipped and RENDER_PLAN["skip_mode"] == "drop":
+        return None
+
+    timings = dict.fromkeys(TIMING_STAGES, 0.0) if RENDER_PLAN["timing"] else None
+    start = time.perf_counter() if timings is not None else 0.0
+
+    if skipped or (
+        # Nothing to draw, unless the heatmap is drawn on frames without detections as well
+        (data["x"] is None or len(data["x"]) == 0)
+        and RENDER_PLAN["heatmap"] == "none"
+    ):
+        event = {}
+        image = None
+        if not skipped and SEGMENT_QUEUE is not None:
+            # Frames without detections are recorded too, so the segments have no gaps
+            image = decode_image(data["image"])[0]
+            segment_file = queue_segment_frame(data, image)
+            if segment_file is not None:
+                event["segment_file"] = segment_file
+        event["annotated_image"] = passthrough_image(data["image"], image)
+        if timings is not None:
+            timings["processing"] = time.perf_counter() - start
+            record_timings(event, timings)
+        return event
+
+    image = wrap_wide_image(data["image"]) if RENDER_PLAN["wide_in_place"] else None
+    in_place = image is not None
+    scale = 1.0
+    if not in_place:
+        image, scale = decode_image(data["image"])
+    if timings is not None:
+        timings["decode"] = time.perf_counter() - start
+    return annotate_decoded(data, image, scale, timings, start, in_place)
+
+
+def annotate_decoded(data, image, scale, timings, start, in_place=False):
+    """Annotates the decoded image of an event and generates the output event, see `process_event`.
+
+    Args:
+        data (dict): The input data of the event.
+        image (numpy.ndarray): The decoded input image, see `decode_image`.
+        scale (float): The scale of the image relative to the coordinates in the data.
+        timings (dict | None): The latencies of the stages, when timing is enabled.
+        start (float): The `time.perf_counter()` when the processing of the event started.
+        in_place (bool): Whether the image is a view of the wide input image, see `wrap_wide_image`.
+
+    Returns:
+        dict | None: The output event, or `None` when the detections are invalid.
+    """
+    event = {}
+    try:
+        batch = DetectionBatch(data, scale)
+    except ValueError as e:
+        drop_invalid_frame(e)
+        release_buffer(image)
+        return None
+    draw_heatmap(data, image, scale, event)
+    annotated = annotate(batch, image, scale, timings)
+    if not in_place:
+        output_frame(data, event, annotated, timings)
+        if SEGMENT_QUEUE is None:  # Otherwise the segment writer can still hold the image
+            release_buffer(annotated)
+    else:
+        if annotated is not image:
+            image[...] = annotated
+        # The input image holds the annotations, so it is the output image
+        output_frame(data, event, image, timings, shared=True, output=data["image"])
+
+    if timings is not None:
+        timings["processing"] = time.perf_counter() - start
+        record_timings(event, timings)
+    return event
+
+
+def drop_invalid_frame(e):
+    """Helper function to log and count a frame that is dropped for invalid detections."""
+    esp.logMessage(
+        logcontext=LOGGING_CONTEXT,
+        message=f"Dropping frame with invalid detections: {e}",
+        level="warn",
+    )
+    with STATS_LOCK:
+        STATS["invalid_frames"] += 1
+
+
+def draw_heatmap(data, opencv_image, scale, event):
+    """Draws the heatmap of the camera under the annotations in place, or adds it to the output event, see `render_heatmap`."""
+    if RENDER_PLAN["heatmap"] == "none":
+        return
+    heatmap = render_heatmap(data, opencv_image.shape, scale)
+    if heatmap is not None and RENDER_PLAN["heatmap_output"] == "blend":
+        cv2.addWeighted(opencv_image, 1.0, heatmap, HEATMAP_OPACITY, 0.0, dst=opencv_image)
+    elif heatmap is not None:
+        event["heatmap_image"] = encode_image(heatmap)
+
+
+def output_frame(data, event, opencv_image, timings, shared=False, output=None):
+    """Writes an annotated image to its video segment and encodes it into the output event.
+
+    Args:
+        data (dict): A dictionary containing the input data.
+        event (dict): The output event.
+        opencv_image (numpy.ndarray): The annotated image.
+        timings (dict | None): The latencies, the encoding is timed when given.
+        shared (bool, optional): Whether the image is reused after this call, such as the
+            input image of a wide image annotated in place, so the video segment gets a copy.
+        output (bytes, optional): The output image, when it does not have to be encoded.
+    """
+    if SEGMENT_QUEUE is not None:
+        segment_file = queue_segment_frame(
+            data, opencv_image.copy() if shared else opencv_image
+        )
+        if segment_file is not None:
+            event["segment_file"] = segment_file
+    if timings is not None:
+        lap_start = time.perf_counter()
+    event["annotated_image"] = encode_image(opencv_image) if output is None else output
+    if timings is not None:
+        lap(timings, "encode", lap_start)
+
+
+def lap(timings, stage, start):
+    """Helper function to store the time since `start` for a stage, and return the current time."""
+    now = time.perf_counter()
+    timings[stage] = now - start
+    return now
+
+
+def record_timings(event, timings):
+    """Records the latencies of one event, for the instrumentation and the output fields.
+
+    With `instrumentation`, every latency is counted in a histogram with logarithmic
+    buckets, so the memory use is fixed. A summary with the percentiles of every stage is
+    logged every `instrumentation_log_events` events or `instrumentation_log_seconds`
+    seconds, and the histograms are reset. With `timing_fields`, the latencies are added
+    to the output event.
+
+    Args:
+        event (dict): The output event.
+        timings (dict): The latency of every stage in `TIMING_STAGES` and the `processing`
+            latency of the whole event, in seconds.
+    """
+    if RENDER_PLAN["timing_fields"]:
+        event.update(
+            {
+                "processing_us": round(timings["processing"] * 1e6),
+                "decode_us": round(timings["decode"] * 1e6),
+                "pseudonymize_us": round(timings["pseudonymize"] * 1e6),
+                "trails_us": round(timings["trails"] * 1e6),
+                "boxes_us": round(timings["boxes"] * 1e6),
+                "keypoints_us": round(timings["keypoints"] * 1e6),
+                "encode_us": round(timings["encode"] * 1e6),
+            }
+        )
+    if not RENDER_PLAN["instrumentation"]:
+        return
+
+    summary = None
+    with TIMINGS_LOCK:
+        for stage, seconds in timings.items():
+            bucket = int(math.log2(max(seconds * 1e6, 1)) * TIMING_BUCKETS_PER_OCTAVE)
+            TIMINGS["histograms"][stage][min(bucket, TIMING_BUCKETS - 1)] += 1
+        TIMINGS["events"] += 1
+        now = time.monotonic()
+        log_events = RENDER_PLAN["instrumentation_log_events"]
+        log_seconds = RENDER_PLAN["instrumentation_log_seconds"]
+        if (log_events > 0 and TIMINGS["events"] >= log_events) or (
+            log_seconds > 0 and now - TIMINGS["last_log"] >= log_seconds
+        ):
+            summary = summarize_timings()
+            reset_timings()
+    if summary is not None:
+        esp.logMessage(logcontext=LOGGING_CONTEXT, message=summary, level="info")
+
+
+def summarize_timings():
+    """Summarizes the latency histograms as the 50th, 95th and 99th percentile of every stage.
+
+    The percentiles are the upper bounds of the histogram buckets, so they overestimate
+    the latency by up to 19%.
+
+    Returns:
+        str: The summary.
+    """
+    parts = []
+    for stage, histogram in TIMINGS["histograms"].items():
+        cumulative = np.cumsum(histogram)
+        buckets = np.searchsorted(cumulative, [0.5, 0.95, 0.99] * cumulative[-1])
+        percentiles = 2 ** ((buckets + 1) / TIMING_BUCKETS_PER_OCTAVE)
+        parts.append(
+            f"{stage} p50={percentiles[0]:.0f} p95={percentiles[1]:.0f} p99={percentiles[2]:.0f}"
+        )
+    return f"Latency of the last {TIMINGS['events']} event(s) in microseconds: {', '.join(parts)}"
+
+
+def reset_timings():
+    """Resets the latency histograms, see `record_timings`."""
+    TIMINGS["histograms"] = {
+        stage: np.zeros(TIMING_BUCKETS, dtype=np.int64)
+        for stage in ["processing"] + TIMING_STAGES
+    }
+    TIMINGS["events"] = 0
+    TIMINGS["last_log"] = time.monotonic()
+
+
+def skip_frame(data):
+    """Decides whether to skip a frame, to limit the annotated frames per camera.
+
+    A frame is skipped when it is not the n-th frame of its camera (`annotate_every_n`),
+    or when it arrives before the minimum interval since the previous annotated frame
+    of its camera (`max_output_fps`). Skipped frames are counted per camera in `STATS`.
+
+    Args:
+        data (dict): A dictionary containing the input data.
+            - `camera_id` (str, optional): ID of the camera. Frames without ID share one budget.
+
+    Returns:
+        bool: Whether to skip the frame.
+    """
+    if RENDER_PLAN["frame_interval"] == 0 and RENDER_PLAN["annotate_every_n"] == 1:
+        return False
+
+    camera_id = data["camera_id"] if "camera_id" in data else None
+    now = time.monotonic()
+    with CAMERA_STATE_LOCK:
+        state = CAMERA_STATE.setdefault(camera_id, {"frames": 0, "next_output": now})
+        skip = state["frames"] % RENDER_PLAN["annotate_every_n"] != 0
+        state["frames"] += 1
+        if not skip and RENDER_PLAN["frame_interval"] > 0:
+            skip = now < state["next_output"]
+            if not skip:
+                # Allow to catch up with at most one interval after a slow frame
+                state["next_output"] = (
+                    max(state["next_output"], now - RENDER_PLAN["frame_interval"])
+                    + RENDER_PLAN["frame_interval"]
+                )
+    if skip:
+        with STATS_LOCK:
+            skipped_frames = STATS["skipped_frames"]
+            skipped_frames[camera_id] = skipped_frames.get(camera_id, 0) + 1
+    return skip
+
+
+def add_to_heatmap(data):
+    """Adds the detections of a frame to the heatmap of its camera.
+
+    The heatmap is a float32 grid with a cell per `heatmap_cell_size` input image pixels. With
+    `centers`, the cells of the box centers are incremented with one `np.add.at` call, with
+    `areas`, the cells under every box are incremented through a slice. The cost per frame
+    therefore depends on the detections, not on the frame size.
+
+    The grid is not decayed for every frame. Instead, the weight of new detections grows by
+    `heatmap_growth` per frame, and the grid is divided by the weight when the heatmap is
+    rendered, see `render_heatmap`, or when the weight exceeds `HEATMAP_MAX_WEIGHT`. Skipped
+    frames are added as well, so the heatmap covers all frames of the camera.
+
+    Args:
+        data (dict): A dictionary containing the input data.
+            - `camera_id` (str, optional): ID of the camera. Frames without ID share one heatmap.
+    """
+    camera_id = data["camera_id"] if "camera_id" in data else None
+    boxes = None
+    if data["x"] is not None and len(data["x"]) > 0:
+        boxes = [np.asarray(data[name], dtype=np.float64) for name in ["x", "y", "w", "h"]]
+        if any(len(values) != len(boxes[0]) for values in boxes):
+            boxes = None  # Invalid detections, the frame is dropped by `process_event`
+
+    with HEATMAPS_LOCK:
+        heatmap = HEATMAPS.get(camera_id)
+        if heatmap is None:
+            size = get_input_image_size(data["image"]) if boxes is not None else None
+            if size is None:
+                return
+            cell = RENDER_PLAN["heatmap_cell_size"]
+            grid = np.zeros((-(-size[1] // cell), -(-size[0] // cell)), dtype=np.float32)
+            heatmap = HEATMAPS[camera_id] = {"grid": grid, "weight": 1.0}
+        else:
+            heatmap["weight"] *= RENDER_PLAN["heatmap_growth"]
+            if heatmap["weight"] > HEATMAP_MAX_WEIGHT:
+                heatmap["grid"] /= heatmap["weight"]
+                heatmap["weight"] = 1.0
+        if boxes is None:
+            return
+
+        grid = heatmap["grid"]
+        x, y, w, h = (values / RENDER_PLAN["heatmap_cell_size"] for values in boxes)
+        if RENDER_PLAN["heatmap"] == "centers":
+            cx = np.floor(x + w / 2).astype(np.int64)
+            cy = np.floor(y + h / 2).astype(np.int64)
+            inside = (cx >= 0) & (cx < grid.shape[1]) & (cy >= 0) & (cy < grid.shape[0])
+            np.add.at(grid, (cy[inside], cx[inside]), heatmap["weight"])
+        else:
+            x0 = np.clip(np.floor(x), 0, grid.shape[1]).astype(np.int64).tolist()
+            y0 = np.clip(np.floor(y), 0, grid.shape[0]).astype(np.int64).tolist()
+            x1 = np.clip(np.ceil(x + w), 0, grid.shape[1]).astype(np.int64).tolist()
+            y1 = np.clip(np.ceil(y + h), 0, grid.shape[0]).astype(np.int64).tolist()
+            for i in range(len(x0)):  # pylint: disable=consider-using-enumerate
+                grid[y0[i] : y1[i], x0[i] : x1[i]] += heatmap["weight"]
+
+
+def render_heatmap(data, shape, scale=1.0):
+    """Renders the heatmap of the camera of a frame as a colored image.
+
+    The decay since the last render is applied to the grid first, see `add_to_heatmap`. The
+    heatmap is scaled so the most active cell has the brightest color of `HEATMAP_COLORMAP`.
+
+    Args:
+        data (dict): A dictionary containing the input data, with the optional `camera_id`.
+        shape (tuple): Shape of the image to render the heatmap for.
+        scale (float, optional): The scale of the image relative to the input image.
+
+    Returns:
+        numpy.ndarray | None: The heatmap as OpenCV image of the given shape, or `None` if the
+            camera has no heatmap yet.
+    """
+    camera_id = data["camera_id"] if "camera_id" in data else None
+    with HEATMAPS_LOCK:
+        heatmap = HEATMAPS.get(camera_id)
+        if heatmap is None:
+            return None
+        if heatmap["weight"] != 1.0:
+            heatmap["grid"] /= heatmap["weight"]
+            heatmap["weight"] = 1.0
+        peak = float(heatmap["grid"].max())
+        levels = heatmap["grid"] * (255 / peak if peak > 0 else 0.0)
+
+    levels = levels.astype(np.uint8)
+    colored = cv2.applyColorMap(levels, HEATMAP_COLORMAP)
+    colored[levels == 0] = 0  # Leave the image unchanged where there is no activity
+    # The cells can extend past the image, so resize the cells and crop to the image
+    cell = RENDER_PLAN["heatmap_cell_size"] * scale
+    size = (
+        max(shape[1], round(levels.shape[1] * cell)),
+        max(shape[0], round(levels.shape[0] * cell)),
+    )
+    colored = cv2.resize(colored, size, interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(colored[: shape[0], : shape[1]])
+
+
+def get_input_image_size(blob):
+    """Helper function to get the width and height of an input image without decoding it, `None` if unknown."""
+    if SETTINGS["input_image_encoding"] == "wide":
+        if not WIDE_LAYOUT:
+            image = esp_utils.image_conversion.sas_wide_image_to_opencv_image(blob)
+            return image.shape[1], image.shape[0]
+        return tuple(np.frombuffer(blob, dtype="<i8", count=2).tolist())
+    return get_blob_image_size(blob)
+
+
+def start_thread_pool(worker_threads):
+    """Starts the thread pool that processes event blocks, replacing any running thread pool.
+
+    Args:
+        worker_threads (int): Number of threads. With one thread, events are processed
+            on the calling thread and no thread pool is started.
+    """
+    global THREAD_POOL
+
+    if THREAD_POOL is not None:
+        THREAD_POOL.shutdown(wait=True)
+        THREAD_POOL = None
+    if worker_threads > 1:
+        THREAD_POOL = concurrent.futures.ThreadPoolExecutor(
+            max_workers=worker_threads, thread_name_prefix="cv_annotation"
+        )
+
+
+def start_segment_sink(segment_directory, segment_fps, segment_queue_size):
+    """Starts the thread that writes video segments, replacing any running thread.
+
+    The running thread is stopped first, see `stop_segment_sink`.
+
+    Args:
+        segment_directory (str): Directory of the segments. Empty to not write segments.
+        segment_fps (float): Frame rate of the segments.
+        segment_queue_size (int): Maximum number of frames waiting to be written.
+    """
+    global SEGMENT_QUEUE
+    global SEGMENT_THREAD
+
+    stop_segment_sink()
+    if segment_directory != "":
+        SEGMENT_QUEUE = queue.Queue(maxsize=segment_queue_size)
+        SEGMENT_THREAD = threading.Thread(
+            target=write_segments,
+            args=(SEGMENT_QUEUE, segment_directory, segment_fps),
+            name="cv_annotation_segments",
+            daemon=True,
+        )
+        SEGMENT_THREAD.start()
+
+
+@atexit.register
+def stop_segment_sink():
+    """Stops the thread that writes video segments, after it wrote the frames in its queue.
+
+    The thread releases its video writers, which writes the index of every open segment, so
+    the last segments can be played. Runs when the process exits, as the thread is a daemon.
+    """
+    global SEGMENT_QUEUE
+    global SEGMENT_THREAD
+
+    if SEGMENT_THREAD is not None:
+        SEGMENT_QUEUE.put(None)
+        SEGMENT_THREAD.join()
+        SEGMENT_QUEUE = None
+        SEGMENT_THREAD = None
+    with SEGMENT_STATE_LOCK:
+        SEGMENT_STATE.clear()
+
+
+def queue_segment_frame(data, opencv_image):
+    """Queues an annotated frame to be written to the video segment of its camera.
+
+    A new segment is started when the segment of the camera is `segment_seconds` old, has
+    reached `segment_max_mb`, or has another frame size. The frames are written by a
+    background thread, see `write_segments`. When the queue is full, because the disk does
+    not keep up, the frame is dropped and counted in `STATS`, so events never wait for the disk.
+
+    Args:
+        data (dict): A dictionary containing the input data.
+            - `camera_id` (str, optional): ID of the camera. Frames without ID share one segment.
+        opencv_image (numpy.ndarray): The annotated image. It must not be changed afterwards.
+
+    Returns:
+        str | None: The file name of the segment, or `None` if the frame is dropped.
+    """
+    camera_id = data["camera_id"] if "camera_id" in data else None
+    size = (opencv_image.shape[1], opencv_image.shape[0])
+    now = time.monotonic()
+    with SEGMENT_STATE_LOCK:
+        segment = SEGMENT_STATE.get(camera_id)
+        if (
+            segment is None
+            or segment["size"] != size
+            or now - segment["start"] >= RENDER_PLAN["segment_seconds"]
+            or 0 < RENDER_PLAN["segment_max_bytes"] <= segment["bytes"]
+        ):
+            segment = SEGMENT_STATE[camera_id] = {
+                "name": get_segment_name(camera_id),
+                "start": now,
+                "size": size,
+                "bytes": 0,
+            }
+        name = segment["name"]
+    try:
+        SEGMENT_QUEUE.put_nowait((camera_id, name, opencv_image))
+    except queue.Full:
+        with STATS_LOCK:
+            STATS["segment_dropped_frames"] += 1
         return None
+    return name
+
+
+def get_segment_name(camera_id):
+    """Helper function to make a unique segment file name from the camera ID and the local time."""
+    camera = "camera" if camera_id is None else re.sub(r"[^\w.-]", "_", str(camera_id))
+    now = time.time()
+    return (
+        f"{camera}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(now))}"
+        f"{int(now % 1 * 1000):03d}_{next(SEGMENT_COUNTER)}.avi"
+    )
+
+
+def write_segments(frames, segment_directory, segment_fps):
+    """Writes queued frames to the video segments of their cameras, until `None` is queued.
+
+    Runs on the thread started by `start_segment_sink`. A segment is closed when the next frame
+    of its camera is for another segment. The size of the segment files is reported back to
+    `SEGMENT_STATE` for `segment_max_mb`. The writer buffers the file, so the reported size
+    lags the written frames a little. Written frames are counted in `STATS`.
 
+    Args:
+        frames (queue.Queue): The queued frames, as camera ID, segment file name and image.
+        segment_directory (str): Directory of the segments.
+        segment_fps (float): Frame rate of the segments.
+    """
+    writers = {}  # Segment file name and writer per camera
+    while True:
+        item = frames.get()
+        if item is None:
+            break
+        camera_id, name, opencv_image = item
+        path = os.path.join(segment_directory, name)
+        try:
+            if camera_id not in writers or writers[camera_id][0] != name:
+                if camera_id in writers:
+                    writers[camera_id][1].release()
+                size = (opencv_image.shape[1], opencv_image.shape[0])
+                writers[camera_id] = (
+                    name,
+                    cv2.VideoWriter(path, SEGMENT_FOURCC, segment_fps, size),
+                )
+            writers[camera_id][1].write(opencv_image)
+            segment_bytes = os.path.getsize(path)
+        except (cv2.error, OSError) as e:
+            esp.logMessage(
+                logcontext=LOGGING_CONTEXT,
+                message=f"Could not write video segment `{path}`: {e}",
+                level="error",
+            )
+            continue
+        with SEGMENT_STATE_LOCK:
+            segment = SEGMENT_STATE.get(camera_id)
+            if segment is not None and segment["name"] == name:
+                segment["bytes"] = segment_bytes
+        with STATS_LOCK:
+            STATS["segment_frames"] += 1
+    for _, writer in writers.values():
+        writer.release()
+
+
+def warm_up(width, height, labels):
+    """Annotates a synthetic frame, so the first events do not pay one-time costs.
+
+    The first frames through `create()` initialize the codecs of OpenCV, set up the glyphs
+    of `cv2.putText` and grow the allocator, which adds hundreds of milliseconds to the
+    first events of a new replica. The synthetic frame is decoded, annotated and encoded
+    with the current settings. It has a box in every palette color, with every label and
+    with every keypoint name, which also fills the label cache and the buffer pool.
+    The duration is logged and `STATS` is left as it was.
+
+    Args:
+        width (int): Width of the synthetic frame, the expected input image width.
+        height (int): Height of the synthetic frame, the expected input image height.
+        labels (list[str]): The object labels to draw. Without labels, `object` is drawn.
+    """
+    start = time.perf_counter()
+    with STATS_LOCK:
+        stats = dict(STATS)
+    labels = labels or ["object"]
+    n = max(len(COLORS), len(labels))
+    columns = math.ceil(math.sqrt(n * width / height))
+    rows = math.ceil(n / columns)
+    box_w, box_h = width / columns, height / rows
+    kpts_labels = RENDER_PLAN["kpts_labels"]
+    data = {
+        "label": RENDER_PLAN["object_label_separator"].join(
+            labels[i % len(labels)] for i in range(n)
+        ),
+        "x": [(i % columns) * box_w for i in range(n)],
+        "y": [(i // columns) * box_h for i in range(n)],
+        "w": [box_w] * n,
+        "h": [box_h] * n,
+        "score": [1.0] * n,
+        "object_id": list(range(1, n + 1)),
+        "object_track_count": [1] * n,
+        "object_track_x": [(i % columns + 0.5) * box_w for i in range(n)],
+        "object_track_y": [(i // columns + 0.5) * box_h for i in range(n)],
+    }
+    if kpts_labels:
+        # The keypoints of every object on a diagonal of its box
+        offsets = np.linspace(0.1, 0.9, len(kpts_labels)).tolist()
+        data["object_track_kpts_count"] = [len(kpts_labels)] * n
+        data["object_track_kpts_x"] = [x + o * box_w for x in data["x"] for o in offsets]
+        data["object_track_kpts_y"] = [y + o * box_h for y in data["y"] for o in offsets]
+        data["object_track_kpts_score"] = [1.0] * (n * len(kpts_labels))
+        data["object_track_kpts_label_id"] = list(range(len(kpts_labels))) * n
+
+    frame = np.full((height, width, 3), 128, dtype=np.uint8)
     if SETTINGS["input_image_encoding"] == "wide":
-        image = esp_utils.image_conversion.sas_wide_image_to_opencv_image(data["image"])
+        blob = esp_utils.image_conversion.opencv_image_to_sas_wide_image(frame)
     else:
-        image = esp_utils.image_conversion.blob_image_to_opencv_image(data["image"])
+        blob = cv2.imencode(f".{SETTINGS['input_image_encoding']}", frame)[1].tobytes()
+    image, scale = decode_image(blob)
+    annotated = annotate(data, image, scale)
+    encode_image(annotated)
+    if RENDER_PLAN["heatmap"] != "none":
+        cv2.applyColorMap(np.zeros((1, 1), dtype=np.uint8), HEATMAP_COLORMAP)
+    release_buffer(annotated)
+
+    with STATS_LOCK:
+        STATS.update(stats)
+    esp.logMessage(
+        logcontext=LOGGING_CONTEXT,
+        message=f"Warmed up in {(time.perf_counter() - start) * 1000:.0f} ms with a {width}x{height} frame and {n} objects",
+        level="info",
+    )
 
-    image = annotate(data, image)
 
-    if SETTINGS["output_image_encoding"] == "wide":
-        image = esp_utils.image_conversion.opencv_image_to_sas_wide_image(image)
-    elif SETTINGS["output_image_encoding"] == "png":
-        image = esp_utils.image_conversion.opencv_image_to_blob_image(
-            image, type=".png"
+def start_process_pool(worker_processes):
+    """Starts the process pool and the shared memory ring of frame slots, replacing any running pool.
+
+    The worker processes are spawned, not forked, because the threads of the server would
+    not exist in a forked copy while their locks could be held. Every worker imports this
+    module and attaches the shared memory by name, see `init_worker_process`. The settings
+    and the render plan are passed to the workers when they start, so the pool is restarted
+    when the settings change.
+
+    Args:
+        worker_processes (int): Number of processes. With `0`, no process pool is started.
+    """
+    global PROCESS_POOL
+    global PROCESS_MEMORY
+
+    if PROCESS_POOL is not None:
+        PROCESS_POOL.shutdown(wait=True)
+        PROCESS_POOL = None
+    if PROCESS_MEMORY is not None:
+        PROCESS_MEMORY.close()
+        PROCESS_MEMORY.unlink()
+        PROCESS_MEMORY = None
+    if worker_processes > 0:
+        PROCESS_MEMORY = multiprocessing.shared_memory.SharedMemory(
+            create=True,
+            size=RENDER_PLAN["process_slots"] * RENDER_PLAN["process_slot_bytes"],
+        )
+        PROCESS_POOL = concurrent.futures.ProcessPoolExecutor(
+            max_workers=worker_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker_process,
+            initargs=(PROCESS_MEMORY.name, SETTINGS, RENDER_PLAN),
+        )
+        # Start all workers now, not while processing
+        concurrent.futures.wait([PROCESS_POOL.submit(int) for _ in range(worker_processes)])
+
+
+def init_worker_process(memory_name, settings, render_plan):
+    """Initializes a worker process of the process pool with the settings of the pool.
+
+    Args:
+        memory_name (str): Name of the shared memory ring of frame slots.
+        settings (dict): The settings of the pool, see `init()`.
+        render_plan (dict): The render plan of the settings, see `compile_render_plan`.
+    """
+    global SETTINGS
+    global RENDER_PLAN
+    global PROCESS_MEMORY
+
+    SETTINGS = settings
+    RENDER_PLAN = render_plan
+    PROCESS_MEMORY = multiprocessing.shared_memory.SharedMemory(name=memory_name)
+
+
+def get_slot_image(slot, shape):
+    """Helper function to get the image in a frame slot of the shared memory as a view."""
+    return np.ndarray(
+        shape,
+        dtype=np.uint8,
+        buffer=PROCESS_MEMORY.buf,
+        offset=slot * RENDER_PLAN["process_slot_bytes"],
+    )
+
+
+def annotate_slot(slot, shape, batch, scale):
+    """Annotates the image in a frame slot of the shared memory in place, in a worker process.
+
+    Only the slot index and the detections are sent to the worker, not the image. The
+    detections are sent as a `DetectionBatch`, whose arrays are much faster to pickle than
+    the lists of the input data.
+
+    Args:
+        slot (int): Index of the frame slot.
+        shape (tuple): Shape of the image in the slot.
+        batch (DetectionBatch): The detections of the event.
+        scale (float): The scale of the image relative to the coordinates in the data.
+
+    Returns:
+        dict | None: The latencies of the annotation stages, when timing is enabled.
+    """
+    image = get_slot_image(slot, shape)
+    timings = dict.fromkeys(TIMING_STAGES, 0.0) if RENDER_PLAN["timing"] else None
+    annotated = annotate(batch, image, scale, timings)
+    if annotated is not image:
+        image[...] = annotated
+    return timings
+
+
+def process_block_in_pool(data, skipped):
+    """Processes the events of a block with the process pool, see `start_process_pool`.
+
+    Every frame to annotate is decoded on the calling thread into a free slot of the shared
+    memory ring and annotated in place by a worker process, see `annotate_slot`. Meanwhile,
+    the next frames are decoded. When no slot is free, the oldest frame is completed first:
+    it is encoded on the calling thread, which frees its slot. Frames that are skipped, have
+    no detections are processed on the calling thread, see `process_event`. Frames that do
+    not fit in a slot are annotated on the calling thread from the image decoded already,
+    see `annotate_decoded`, and counted in `STATS`. Frames with invalid
+    detections are dropped before they take a slot.
+
+    Args:
+        data (list[dict]): The input data of the events in the block.
+        skipped (list[bool]): Whether every frame is skipped, see `skip_frame`.
+
+    Returns:
+        list[dict | None]: The output events, in the same order as the input events.
+    """
+    events = [None] * len(data)
+    free_slots = list(range(RENDER_PLAN["process_slots"]))
+    pending = collections.deque()
+    for i, (event_data, skip) in enumerate(zip(data, skipped)):
+        if skip or event_data["x"] is None or len(event_data["x"]) == 0:
+            events[i] = process_event(event_data, skip)
+            continue
+        if not free_slots:
+            free_slots.append(complete_slot(events, pending.popleft()))
+
+        timings = dict.fromkeys(TIMING_STAGES, 0.0) if RENDER_PLAN["timing"] else None
+        start = time.perf_counter() if timings is not None else 0.0
+        image, scale = decode_image(event_data["image"])
+        if image.dtype != np.uint8 or image.nbytes > RENDER_PLAN["process_slot_bytes"]:
+            with STATS_LOCK:
+                STATS["process_oversized_frames"] += 1
+            if timings is not None:
+                timings["decode"] = time.perf_counter() - start
+            events[i] = annotate_decoded(event_data, image, scale, timings, start)
+            continue
+        try:
+            batch = DetectionBatch(event_data, scale)
+        except ValueError as e:
+            drop_invalid_frame(e)
+            release_buffer(image)
+            continue
+        slot = free_slots.pop()
+        slot_image = get_slot_image(slot, image.shape)
+        slot_image[...] = image
+        release_buffer(image)
+        if timings is not None:
+            timings["decode"] = time.perf_counter() - start
+
+        event = {}
+        draw_heatmap(event_data, slot_image, scale, event)
+        pending.append(
+            {
+                "index": i,
+                "data": event_data,
+                "event": event,
+                "slot": slot,
+                "shape": image.shape,
+                "future": PROCESS_POOL.submit(
+                    annotate_slot, slot, image.shape, batch, scale
+                ),
+                "timings": timings,
+                "start": start,
+            }
         )
+    while pending:
+        complete_slot(events, pending.popleft())
+    return events
+
+
+def complete_slot(events, frame):
+    """Waits for the worker of a frame of `process_block_in_pool`, and outputs the frame.
+
+    Args:
+        events (list[dict | None]): The output events of the block, the event of the frame is set.
+        frame (dict): The frame, with its slot, worker future and timings.
+
+    Returns:
+        int: The slot of the frame, which is free again.
+    """
+    worker_timings = frame["future"].result()
+    timings = frame["timings"]
+    if timings is not None:
+        for stage in ["pseudonymize", "trails", "boxes", "keypoints"]:
+            timings[stage] = worker_timings[stage]
+    image = get_slot_image(frame["slot"], frame["shape"])
+    # The slot is reused for the next frames
+    output_frame(frame["data"], frame["event"], image, timings, shared=True)
+    if timings is not None:
+        timings["processing"] = time.perf_counter() - frame["start"]
+        record_timings(frame["event"], timings)
+    events[frame["index"]] = frame["event"]
+    return frame["slot"]
+
+
+def decode_image(blob):
+    """Decodes an input image to an OpenCV image, using the `input_image_encoding` setting.
+
+    The image is downscaled to the output size, see `get_output_scale`. JPEG images are
+    decoded at a reduced size directly, which is much faster than decoding at full size.
+    Downscaled images and copies of 8-bit BGR `wide` images are written into buffers of
+    the buffer pool, see `take_buffer`. A `wide` image that is downscaled is read in place,
+    without copying it at full size first.
+
+    Args:
+        blob (bytes): The input image.
+
+    Returns:
+        tuple[numpy.ndarray, float]: The OpenCV image and the scale of the image. The image
+            does not share memory with `blob`, so it can be drawn on.
+    """
+    wide_view = None
+    if SETTINGS["input_image_encoding"] == "wide":
+        image = wide_view = view_wide_image(blob)
+        if image is None:
+            image = esp_utils.image_conversion.sas_wide_image_to_opencv_image(blob)
+        size = (image.shape[1], image.shape[0])
+        scale = get_output_scale(size[0])
     else:
-        image = esp_utils.image_conversion.opencv_image_to_blob_image(
-            image, type=".jpeg"
+        size = get_blob_image_size(blob)
+        scale = 1.0 if size is None else get_output_scale(size[0])
+        # Largest reduction that does not make the image smaller than the output. Only
+        # JPEG is decoded at a reduced size, OpenCV decodes PNG at full size and resizes it.
+        reduction = 1
+        if blob[:2] == b"\xff\xd8":
+            reduction = next((r for r in REDUCED_DECODE_FLAGS if scale * r <= 1), 1)
+        if reduction > 1:
+            image = cv2.imdecode(
+                np.frombuffer(blob, dtype=np.uint8), REDUCED_DECODE_FLAGS[reduction]
+            )
+        else:
+            image = esp_utils.image_conversion.blob_image_to_opencv_image(blob)
+        if size is None:  # Unknown image format, downscale after decoding
+            size = (image.shape[1], image.shape[0])
+            scale = get_output_scale(size[0])
+
+    if scale < 1:
+        output_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        if (image.shape[1], image.shape[0]) != output_size:
+            resized = take_buffer(
+                (output_size[1], output_size[0]) + image.shape[2:], image.dtype
+            )
+            image = cv2.resize(
+                image, output_size, dst=resized, interpolation=cv2.INTER_AREA
+            )
+    if image is wide_view:  # Still the pixels of the input image
+        image = take_buffer(wide_view.shape, wide_view.dtype)
+        np.copyto(image, wide_view)
+    return image, scale
+
+
+def view_wide_image(blob):
+    """Helper function to view the pixels of an 8-bit BGR `wide` image without copying, or get `None` for other images."""
+    if not WIDE_LAYOUT:
+        return None
+    width, height, cv_type = np.frombuffer(blob, dtype="<i8", count=3).tolist()
+    if cv_type != WIDE_BGR_TYPE or len(blob) != WIDE_HEADER_SIZE + width * height * 3:
+        return None
+    return np.frombuffer(blob, dtype=np.uint8, offset=WIDE_HEADER_SIZE).reshape(
+        height, width, 3
+    )
+
+
+def take_buffer(shape, dtype):
+    """Takes a free image buffer from the buffer pool, or allocates a new one.
+
+    Every decoded image is a new full-size array, which at 4K and 30 frames per second
+    churns hundreds of MB/s through the allocator. Decoded images are given back with
+    `release_buffer` once they are encoded, so the images of the next events reuse them.
+    Buffers taken from the pool and newly allocated are counted in `STATS`.
+
+    Args:
+        shape (tuple): The shape of the image.
+        dtype (numpy.dtype): The type of the pixels.
+
+    Returns:
+        numpy.ndarray: The buffer, with undefined pixels.
+    """
+    key = (tuple(shape), np.dtype(dtype).str)
+    with BUFFER_POOL_LOCK:
+        if RENDER_PLAN["buffer_pool_size"] > 0:
+            free = BUFFER_POOL.setdefault(key, [])
+            if free:
+                STATS["buffer_pool_hits"] += 1
+                return free.pop()
+        STATS["buffer_pool_misses"] += 1
+    return np.empty(shape, dtype=dtype)
+
+
+def release_buffer(opencv_image):
+    """Gives an image back to the buffer pool, see `take_buffer`. The image must not be used afterwards.
+
+    Only images of a shape that was taken from the pool are kept, up to `buffer_pool_size`
+    per shape. Views, such as `wide` images annotated in place, are never kept.
+    """
+    if not (opencv_image.flags.owndata and opencv_image.flags.c_contiguous):
+        return
+    key = (opencv_image.shape, opencv_image.dtype.str)
+    with BUFFER_POOL_LOCK:
+        free = BUFFER_POOL.get(key)
+        if free is not None and len(free) < RENDER_PLAN["buffer_pool_size"]:
+            free.append(opencv_image)
+
+
+def wrap_wide_image(blob):
+    """Wraps a `wide` image as an OpenCV image without copying, so it can be annotated in place.
+
+    The returned image is a view of the pixels in `blob`: drawing on it changes `blob`,
+    which is then the output image. This saves copying the image when decoding and when
+    encoding it. It is only possible for writable buffers (such as a `bytearray`) with an
+    8-bit BGR image that is not downscaled. Otherwise, the image is copied by `decode_image`.
+    How often each path is taken is counted in `STATS`.
+
+    Args:
+        blob (bytes | bytearray | memoryview): The wide image.
+
+    Returns:
+        numpy.ndarray | None: The OpenCV image, or `None` if the image has to be copied.
+    """
+    image = view_wide_image(blob)
+    if image is not None and (
+        get_output_scale(image.shape[1]) < 1
+        or not (image.flags.writeable and image.flags.aligned)
+    ):
+        image = None
+    with STATS_LOCK:
+        STATS["wide_in_place_frames" if image is not None else "wide_copied_frames"] += 1
+    return image
+
+
+def get_output_scale(width):
+    """Helper function to get the scale of the output image for an input image width."""
+    scale = RENDER_PLAN["output_scale"]
+    if RENDER_PLAN["output_max_width"] > 0:
+        scale = min(scale, RENDER_PLAN["output_max_width"] / width)
+    return scale
+
+
+def get_blob_image_size(blob):
+    """Reads the size of a JPEG or PNG image from its header, without decoding the image.
+
+    Args:
+        blob (bytes): The JPEG or PNG image.
+
+    Returns:
+        tuple[int, int] | None: The width and height of the image, or `None` for other formats.
+    """
+    if blob[:8] == b"\x89PNG\r\n\x1a\n":
+        return int.from_bytes(blob[16:20], "big"), int.from_bytes(blob[20:24], "big")
+
+    if blob[:2] != b"\xff\xd8":
+        return None
+    # Walk the JPEG segments until the start of frame segment, which holds the size
+    i = 2
+    while i + 9 <= len(blob):
+        if blob[i] != 0xFF:
+            return None
+        marker = blob[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+        elif 0xD0 <= marker <= 0xD9 or marker == 0x01:  # Markers without a segment
+            i += 2
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return (
+                int.from_bytes(blob[i + 7 : i + 9], "big"),
+                int.from_bytes(blob[i + 5 : i + 7], "big"),
+            )
+        else:
+            i += 2 + int.from_bytes(blob[i + 2 : i + 4], "big")
+    return None
+
+
+def encode_image(opencv_image):
+    """Encodes an OpenCV image to an output image, using the `output_image_encoding` setting.
+
+    Images are encoded to `jpg` and `png` with the compiled encoder options, see `compile_encoder`.
+    """
+    if SETTINGS["output_image_encoding"] == "wide":
+        return encode_wide_image(opencv_image)
+    if ENCODER["backend"] == "simplejpeg":
+        return simplejpeg.encode_jpeg(
+            np.ascontiguousarray(opencv_image),
+            quality=ENCODER["options"]["jpeg_quality"],
+            colorspace="BGR",
+            colorsubsampling=ENCODER["options"]["jpeg_chroma_subsampling"],
         )
+    if ENCODER["params"] is not None:
+        return cv2.imencode(ENCODER["extension"], opencv_image, ENCODER["params"])[
+            1
+        ].tobytes()
+    return esp_utils.image_conversion.opencv_image_to_blob_image(
+        opencv_image, type=ENCODER["extension"]
+    )
 
-    event = {}
-    event["annotated_image"] = image
-    return event
+
+def encode_wide_image(opencv_image):
+    """Encodes an OpenCV image to a `wide` image with a single allocation.
+
+    `opencv_image_to_sas_wide_image` copies the pixels to `bytes` and joins them to the
+    header, which allocates and copies the full image twice. 8-bit BGR images are copied
+    once into a `bytearray` instead, like the input images annotated in place. The output
+    image is owned by the output event, so it is not taken from the buffer pool.
+    """
+    if not WIDE_LAYOUT or opencv_image.dtype != np.uint8 or opencv_image.shape[2:] != (3,):
+        return esp_utils.image_conversion.opencv_image_to_sas_wide_image(opencv_image)
+    height, width = opencv_image.shape[:2]
+    blob = bytearray(WIDE_HEADER_SIZE + opencv_image.nbytes)
+    np.frombuffer(blob, dtype="<i8", count=3)[:] = (width, height, WIDE_BGR_TYPE)
+    pixels = np.frombuffer(blob, dtype=np.uint8, offset=WIDE_HEADER_SIZE)
+    np.copyto(pixels.reshape(opencv_image.shape), opencv_image)
+    return blob
 
 
-def annotate(data, opencv_image):
+def check_wide_layout():
+    """Checks whether `esp_utils` uses the `wide` image layout of this module, see `WIDE_HEADER_SIZE`.
+
+    `view_wide_image`, `encode_wide_image` and `get_input_image_size` read and write the
+    header of wide images directly, which is faster than `esp_utils`. A small image is
+    converted with `esp_utils` and with this module, and both are compared. When they do
+    not match, `WIDE_LAYOUT` is set to `False` and wide images are only converted with
+    `esp_utils`.
+
+    Returns:
+        bool: Whether the layout matches.
+    """
+    global WIDE_LAYOUT
+
+    WIDE_LAYOUT = True
+    image = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+    try:
+        blob = bytes(esp_utils.image_conversion.opencv_image_to_sas_wide_image(image))
+        view = view_wide_image(blob) if len(blob) >= WIDE_HEADER_SIZE else None
+        decoded = esp_utils.image_conversion.sas_wide_image_to_opencv_image(
+            bytes(encode_wide_image(image))
+        )
+        WIDE_LAYOUT = (
+            view is not None
+            and np.array_equal(view, image)
+            and np.array_equal(decoded, image)
+        )
+    except (ValueError, TypeError, IndexError):
+        WIDE_LAYOUT = False
+    return WIDE_LAYOUT
+
+
+def passthrough_image(blob, opencv_image=None):
+    """Passes an input image through to the output without annotating it.
+
+    When the input and output image encoding are the same, the input image is returned
+    untouched. This avoids decoding and encoding the image, and for `jpg` another
+    generation of quality loss. Otherwise, only the image encoding and size are converted.
+    Passed through frames are counted in `STATS`.
+
+    Args:
+        blob (bytes): The input image.
+        opencv_image (numpy.ndarray, optional): The input image decoded already, see
+            `decode_image`. It is only read, so it can be written to a video segment as well.
+
+    Returns:
+        bytes: The output image.
+    """
+    with STATS_LOCK:
+        STATS["passthrough_frames"] += 1
+    if SETTINGS["input_image_encoding"] == SETTINGS["output_image_encoding"] and (
+        RENDER_PLAN["output_scale"] == 1 and RENDER_PLAN["output_max_width"] == 0
+    ):
+        return blob
+    if opencv_image is not None:
+        return encode_image(opencv_image)
+    image = decode_image(blob)[0]
+    output = encode_image(image)
+    release_buffer(image)
+    return output
+
+
+def annotate(data, opencv_image, scale=1.0, timings=None):
     """Applies annotations to an OpenCV image for object detection and keypoint detection.
 
     This function annotates the given OpenCV image with bounding boxes, labels,
@@ -171,126 +2026,479 @@ def annotate(data, opencv_image):
     depend on the data provided.
 
     Args:
-        data (dict): A dictionary containing the annotation data. Expected keys include:
+        data (dict | DetectionBatch): A dictionary containing the annotation data, or the
+            detections built from it for this image. Expected keys include:
             - `label` (str): Labels for detected objects.
             - `x`, `y`, `w`, `h` (list[float]): Top-left coordinates and dimensions of bounding boxes.
             - `score` (list[float]): Confidence scores for the detected objects.
             - `object_id` (list[int], optional): Unique IDs for the detected objects.
+            - `attribute` (str, optional): Attributes for detected objects.
             - `object_track_kpts_x`, `object_track_kpts_y` (list[float], optional):
               Coordinates of keypoints for tracked objects.
             - `object_track_kpts_score` (list[float], optional): Confidence scores for keypoints.
             - `object_track_kpts_label_id` (list[int], optional): Label IDs for keypoints.
             - `object_track_count` (list[int], optional): Number of tracked objects.
             - `object_track_kpts_count` (list[int], optional): Number of keypoints per tracked object.
+            - `object_track_x` (list[float], optional): X-coordinates of the track points, oldest first.
+            - `object_track_y` (list[float], optional): Y-coordinates of the track points, oldest first.
         opencv_image (numpy.ndarray): The input image in OpenCV format.
+        scale (float, optional): The scale of the image relative to the coordinates in the data.
+        timings (dict, optional): When given, the latency of every annotation stage is stored in it.
 
     Returns:
         numpy.ndarray: The annotated OpenCV image.
 
+    Raises:
+        ValueError: If the number of labels or attributes does not match the number of boxes.
+
     Details:
+        - The data is converted to a `DetectionBatch` once, which all stages read from.
+        - Only the boxes that pass `min_score`, `min_box_area` and `max_objects` and are inside
+          the image are drawn, with their tracks and keypoints, see `DetectionBatch.cull`.
         - Calls `annotate_object_detection` to apply object detection annotations.
         - Optionally calls `annotate_keypoints` to add keypoint annotations if keypoint data is provided.
+        - Optionally calls `annotate_trails` to draw the track history, when `trail_length` is set.
+        - For a downscaled image, the coordinates are scaled and the overlays are sized with `get_overlay_style`.
     """
-
-    if SETTINGS["pseudonymization"] == "black_bbox":
-        if data["x"] is not None:
-            for i in range(len(data["x"])):
-                start_point = (int(data["x"][i]), int(data["y"][i]))
-                end_point = (
-                    int(data["x"][i] + data["w"][i]),
-                    int(data["y"][i] + data["h"][i]),
-                )
-                cv2.rectangle(
-                    opencv_image, start_point, end_point, (0, 0, 0), -1, cv2.LINE_AA
-                )
-
-    opencv_image = annotate_object_detection(
-        opencv_image,
-        data["label"],
-        data["x"],
-        data["y"],
-        data["w"],
-        data["h"],
-        data["score"],
-        None if "object_id" not in data else data["object_id"],
-        None if "attribute" not in data else data["attribute"],
-    )
-
-    if "object_track_kpts_x" in data and data["x"] is not None:
-        opencv_image = annotate_keypoints(
+    style = get_overlay_style(scale)
+    batch = data if isinstance(data, DetectionBatch) else DetectionBatch(data, scale)
+    drawn = batch.cull(opencv_image.shape[1], opencv_image.shape[0])
+    start = time.perf_counter() if timings is not None else 0.0
+
+    # All boxes are pseudonymized, also the boxes that are not drawn
+    if RENDER_PLAN["pseudonymization"] != "none":
+        opencv_image = pseudonymize(batch, opencv_image)
+    if timings is not None:
+        start = lap(timings, "pseudonymize", start)
+
+    if RENDER_PLAN["trail_length"] > 0 and drawn.track_x is not None:
+        opencv_image = annotate_trails(
             opencv_image,
-            len(data["x"]),
-            None if "object_id" not in data else data["object_id"],
-            None if "object_track_count" not in data else data["object_track_count"],
-            data["object_track_kpts_count"],
-            data["object_track_kpts_x"],
-            data["object_track_kpts_y"],
-            data["object_track_kpts_score"],
-            data["object_track_kpts_label_id"],
+            drawn.object_id,
+            drawn.track_count,
+            drawn.track_x,
+            drawn.track_y,
+            style,
         )
+    if timings is not None:
+        start = lap(timings, "trails", start)
+
+    opencv_image = annotate_object_detection(opencv_image, drawn, style)
+    if timings is not None:
+        start = lap(timings, "boxes", start)
+
+    if drawn.kpts is not None:
+        opencv_image = annotate_keypoints(opencv_image, drawn, style)
+    if timings is not None:
+        lap(timings, "keypoints", start)
     return opencv_image
 
 
-def pseudonymize_black_bbox(data, opencv_image):
-    """Pseudonymizes the given OpenCV image by drawing black bounding boxes over specified regions."""
-    for i in range(len(data["x"])):
-        start_point = (int(data["x"][i]), int(data["y"][i]))
-        end_point = (
-            int(data["x"][i] + data["w"][i]),
-            int(data["y"][i] + data["h"][i]),
-        )
-        cv2.rectangle(opencv_image, start_point, end_point, (0, 0, 0), -1, cv2.LINE_AA)
+class DetectionBatch:
+    """The detections of one event as arrays, built once so every stage of `annotate` reads the same data.
+
+    Labels and attributes are split once, and their number is checked against the number
+    of boxes before anything is drawn. Without boxes, the other fields are not checked.
+
+    Attributes:
+        boxes (numpy.ndarray): Box corners as rows of `x0, y0, x1, y1` (int32), as drawn by `cv2.rectangle`.
+        score (numpy.ndarray): Confidence scores.
+        object_id (numpy.ndarray | None): Object IDs, when tracked.
+        labels (list[str]): Labels, one per box.
+        attributes (list[str] | None): Attributes, one per box.
+        track_count (numpy.ndarray | None): Number of track points per object.
+        track_x (numpy.ndarray | None): X-coordinates of the track points, oldest first.
+        track_y (numpy.ndarray | None): Y-coordinates of the track points, oldest first.
+        kpts (dict | None): Keypoints of the last track of every object, see `decode_keypoints`.
+    """
+
+    __slots__ = (
+        "boxes",
+        "score",
+        "object_id",
+        "labels",
+        "attributes",
+        "track_count",
+        "track_x",
+        "track_y",
+        "kpts",
+    )
+
+    def __init__(self, data, scale=1.0):
+        """Builds the detections of an event.
+
+        Args:
+            data (dict): The input data of the event, see `annotate`.
+            scale (float, optional): The scale of the image relative to the coordinates in the data.
+
+        Raises:
+            ValueError: If the number of labels, attributes, scores, object IDs, box
+                coordinates or track counts does not match the number of boxes, or the
+                number of keypoint counts or keypoints does not match the tracks.
+        """
+        if scale != 1:
+            data = scale_coordinates(data, scale)
+        n = 0 if data["x"] is None else len(data["x"])
+        self.boxes = np.empty((0, 4), dtype=np.int32)
+        self.score = np.empty(0, dtype=np.float64)
+        self.object_id = None
+        self.labels = []
+        self.attributes = None
+        self.track_count = self.track_x = self.track_y = None
+        self.kpts = None
+        if n == 0:  # Nothing to draw
+            return
+
+        separator = RENDER_PLAN["object_label_separator"]
+        self.labels = "" if data["label"] is None else data["label"]
+        self.labels = self.labels.split(separator)
+        check_count("label", len(self.labels), n)
+        if "attribute" in data and data["attribute"] is not None:
+            self.attributes = data["attribute"].split(separator)
+            check_count("attribute", len(self.attributes), n)
+        for name in ["y", "w", "h", "score"]:
+            check_count(name, 0 if data[name] is None else len(data[name]), n)
+
+        x = np.asarray(data["x"], dtype=np.float64)
+        y = np.asarray(data["y"], dtype=np.float64)
+        w = np.asarray(data["w"], dtype=np.float64)
+        h = np.asarray(data["h"], dtype=np.float64)
+        # Truncated like `int()`, as OpenCV needs integer coordinates
+        self.boxes = np.stack([x, y, x + w, y + h], axis=1).astype(np.int32)
+        self.score = np.asarray(data["score"], dtype=np.float64)
+        if "object_id" in data and data["object_id"] is not None:
+            check_count("object_id", len(data["object_id"]), n)
+            self.object_id = np.asarray(data["object_id"], dtype=np.int64)
+
+        track_count = None
+        if "object_track_count" in data and data["object_track_count"] is not None:
+            track_count = data["object_track_count"]
+            check_count("object_track_count", len(track_count), n)
+            if "object_track_x" in data and data["object_track_x"] is not None:
+                self.track_count = np.asarray(track_count, dtype=np.int64)
+                self.track_x = np.asarray(data["object_track_x"], dtype=np.float64)
+                self.track_y = np.asarray(data["object_track_y"], dtype=np.float64)
+                check_count("object_track_x", len(self.track_x), self.track_count.sum())
+                check_count("object_track_y", len(self.track_y), self.track_count.sum())
+
+        if "object_track_kpts_x" in data and data["object_track_kpts_x"] is not None:
+            # One keypoint count per track, the keypoints of all tracks are concatenated
+            tracks = n if track_count is None else int(np.sum(track_count))
+            kpts_count = get_field(data, "object_track_kpts_count")
+            check_count("object_track_kpts_count", len(kpts_count), tracks, "track(s)")
+            keypoints = int(np.sum(kpts_count))
+            for name in KEYPOINT_FIELDS:
+                check_count(name, len(get_field(data, name)), keypoints, "keypoint(s)")
+            self.kpts = decode_keypoints(
+                n,
+                track_count,
+                data["object_track_kpts_count"],
+                data["object_track_kpts_x"],
+                data["object_track_kpts_y"],
+                data["object_track_kpts_score"],
+                data["object_track_kpts_label_id"],
+            )
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def cull(self, width, height):
+        """Gets the detections to draw on an image, using the `min_score`, `max_objects` and `min_box_area` settings.
+
+        Boxes below the minimum score or area and boxes outside the image are left out, and
+        of the other boxes, at most `max_objects` with the highest scores are kept in their
+        original order. The masks are computed for all boxes at once, before anything is drawn.
+        The boxes are clipped to just outside the image, so no lines are drawn that cannot be seen.
+
+        Args:
+            width (int): Width of the image.
+            height (int): Height of the image.
+
+        Returns:
+            DetectionBatch: The detections to draw, see `select`.
+        """
+        x0, y0, x1, y1 = self.boxes.T
+        keep = (x1 >= 0) & (y1 >= 0) & (x0 < width) & (y0 < height)
+        if RENDER_PLAN["min_score"] > 0:
+            keep &= self.score >= RENDER_PLAN["min_score"]
+        if RENDER_PLAN["min_box_area"] > 0:
+            area = (x1 - x0).astype(np.float64) * (y1 - y0)
+            keep &= area >= RENDER_PLAN["min_box_area"]
+        index = np.flatnonzero(keep)
+        if 0 < RENDER_PLAN["max_objects"] < len(index):
+            top = np.argsort(-self.score[index], kind="stable")
+            index = np.sort(index[top[: RENDER_PLAN["max_objects"]]])
+
+        batch = self.select(index)
+        batch.boxes = np.clip(batch.boxes, -1, [width, height, width, height])
+        return batch
+
+    def select(self, index):
+        """Gets a copy of the detections with only the given boxes, and their labels, attributes, tracks and keypoints.
+
+        Args:
+            index (numpy.ndarray): Indices of the boxes to keep, in ascending order.
+
+        Returns:
+            DetectionBatch: The selected detections.
+        """
+        keep = np.zeros(len(self), dtype=bool)
+        keep[index] = True
+        batch = DetectionBatch.__new__(DetectionBatch)
+        batch.boxes = self.boxes[index]
+        batch.score = self.score[index]
+        batch.object_id = None if self.object_id is None else self.object_id[index]
+        batch.labels = [self.labels[i] for i in index.tolist()]
+        batch.attributes = None
+        if self.attributes is not None:
+            batch.attributes = [self.attributes[i] for i in index.tolist()]
+
+        batch.track_count = batch.track_x = batch.track_y = None
+        if self.track_count is not None:
+            keep_points = np.repeat(keep, self.track_count)
+            batch.track_count = self.track_count[index]
+            batch.track_x = self.track_x[keep_points]
+            batch.track_y = self.track_y[keep_points]
+
+        batch.kpts = None
+        if self.kpts is not None:
+            keep_kpts = keep[self.kpts["object_index"]]
+            batch.kpts = {name: v[keep_kpts] for name, v in self.kpts.items()}
+            # Renumber the objects, the keypoints stay ordered by object
+            position = np.cumsum(keep) - 1
+            batch.kpts["object_index"] = position[batch.kpts["object_index"]]
+        return batch
+
+
+def check_count(name, count, expected, unit="box(es)"):
+    """Helper function to raise a `ValueError` when a field does not have one value per box, track or keypoint."""
+    if count != expected:
+        raise ValueError(f"`{name}` has {count} value(s) for {expected} {unit}")
+
+
+def get_field(data, name):
+    """Helper function to get an input variable, with an empty list when it is missing."""
+    return [] if name not in data or data[name] is None else data[name]
+
+
+def scale_coordinates(data, scale):
+    """Returns a copy of the input data with the coordinates scaled, see `COORDINATE_FIELDS`."""
+    data = dict(data)
+    for name in COORDINATE_FIELDS:
+        if name in data and data[name] is not None:
+            data[name] = np.asarray(data[name], dtype=np.float64) * scale
+    return data
+
+
+def get_overlay_style(scale=1.0):
+    """Gets the sizes of the overlays for an image with the given scale.
+
+    Labels, lines and keypoint markers shrink with downscaled images, so they cover the same
+    share of the frame, down to a minimum size, so they stay legible. The font scales are
+    rounded, so the label cache holds one sprite per label and font scale, see `get_label_sprite`.
+
+    Args:
+        scale (float, optional): The scale of the image.
+
+    Returns:
+        dict: The overlay sizes.
+            - `font_scale` (float): Font scale of bounding box labels.
+            - `thickness` (int): Thickness of lines and text.
+            - `keypoint_font_scale` (float): Font scale of keypoint labels.
+            - `keypoint_radius` (int): Radius of keypoint markers.
+    """
+    return {
+        "font_scale": round(max(MIN_FONT_SCALE, FONT_SCALE * scale), 2),
+        "thickness": max(MIN_THICKNESS, round(THICKNESS * scale)),
+        "keypoint_font_scale": round(
+            max(MIN_KEYPOINT_FONT_SCALE, KEYPOINT_FONT_SCALE * scale), 2
+        ),
+        "keypoint_radius": max(MIN_KEYPOINT_RADIUS, round(KEYPOINT_RADIUS * scale)),
+    }
+
+
+def pseudonymize(batch, opencv_image):
+    """Pseudonymizes the bounding boxes of an image, using the `pseudonymization` setting.
+
+    Only the region of interest of every box is processed, so the cost scales with the
+    area covered by the boxes rather than with the image size. Overlapping boxes are
+    merged first, so no region is processed twice.
+
+    Args:
+        batch (DetectionBatch): The detections with the bounding boxes.
+        opencv_image (numpy.ndarray): The input image in OpenCV format.
+
+    Returns:
+        numpy.ndarray: The pseudonymized OpenCV image.
+            - `black_bbox`: Boxes are filled with black.
+            - `gaussian_blur`: Boxes are blurred with a kernel sized to the box.
+            - `pixelate`: Boxes are downscaled to `PIXELATE_BLOCKS` blocks and upscaled again.
+    """
+    mode = RENDER_PLAN["pseudonymization"]
+    height, width = opencv_image.shape[:2]
+    boxes = batch.boxes.astype(np.int64)
+    boxes[:, 2:] += 1  # Include the pixels under the box outline
+    boxes = np.clip(boxes, 0, [width, height, width, height])  # Clip to the image
+
+    for x0, y0, x1, y1 in merge_boxes(boxes):
+        roi = opencv_image[y0:y1, x0:x1]  # View into the image, changed in place
+        if mode == "black_bbox":
+            roi[:] = 0
+        elif mode == "gaussian_blur":
+            kernel = max(3, min(x1 - x0, y1 - y0) // BLUR_KERNEL_DIVISOR) | 1
+            roi[:] = cv2.GaussianBlur(roi, (kernel, kernel), 0)
+        elif mode == "pixelate":
+            block = max(1, -(-max(x1 - x0, y1 - y0) // PIXELATE_BLOCKS))
+            small = cv2.resize(
+                roi,
+                (-(-(x1 - x0) // block), -(-(y1 - y0) // block)),
+                interpolation=cv2.INTER_AREA,
+            )
+            roi[:] = cv2.resize(small, (x1 - x0, y1 - y0), interpolation=cv2.INTER_NEAREST)
     return opencv_image
 
 
-def annotate_object_detection(
-    opencv_image, label, x, y, w, h, score, object_id=None, attrs=None
+def merge_boxes(boxes):
+    """Merges overlapping boxes into their bounding box, until no boxes overlap.
+
+    Args:
+        boxes (numpy.ndarray): Boxes as rows of `x0, y0, x1, y1`, with exclusive end coordinates.
+
+    Returns:
+        list[tuple[int, int, int, int]]: The merged boxes, without empty boxes.
+    """
+    merged = []
+    for box in boxes.tolist():
+        if box[0] >= box[2] or box[1] >= box[3]:  # Empty or outside the image
+            continue
+        # Merging can make a box overlap with boxes it did not overlap before
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for i, other in enumerate(merged):
+                if (
+                    box[0] < other[2]
+                    and other[0] < box[2]
+                    and box[1] < other[3]
+                    and other[1] < box[3]
+                ):
+                    box = [
+                        min(box[0], other[0]),
+                        min(box[1], other[1]),
+                        max(box[2], other[2]),
+                        max(box[3], other[3]),
+                    ]
+                    del merged[i]
+                    overlapping = True
+                    break
+        merged.append(box)
+    return [tuple(box) for box in merged]
+
+
+def annotate_trails(
+    opencv_image,
+    object_id,
+    object_track_count,
+    object_track_x,
+    object_track_y,
+    style=None,
 ):
+    """Draws the track history of every object as a trail.
+
+    The last `trail_length` track points of every object are drawn with one `cv2.polylines`
+    call, or one call per band of `TRAIL_FADE_BANDS` when `trail_fade` is enabled. The cost
+    per frame therefore does not grow with the trail length.
+
+    Args:
+        opencv_image (np.ndarray): The input image in OpenCV format.
+        object_id (list[int] | None): List of object IDs, used for the trail colors.
+        object_track_count (list[int]): Number of track points per object.
+        object_track_x (list[float]): X-coordinates of the track points, oldest first.
+        object_track_y (list[float]): Y-coordinates of the track points, oldest first.
+        style (dict, optional): The overlay sizes, see `get_overlay_style`.
+
+    Returns:
+        np.ndarray: The annotated OpenCV image.
+    """
+    if style is None:
+        style = get_overlay_style()
+    counts = np.asarray(object_track_count, dtype=np.int64)
+    ends = np.cumsum(counts)
+    starts = ends - np.minimum(counts, RENDER_PLAN["trail_length"])
+    points = np.empty((int(ends[-1]) if len(ends) else 0, 2), dtype=np.int32)
+    points[:, 0] = np.rint(np.asarray(object_track_x, dtype=np.float64))
+    points[:, 1] = np.rint(np.asarray(object_track_y, dtype=np.float64))
+
+    for o in range(len(counts)):  # pylint: disable=consider-using-enumerate
+        trail = points[starts[o] : ends[o]]
+        if len(trail) < 2:
+            continue
+        color = get_color(int(object_id[o]) - 1 if object_id is not None else 0)
+        if not RENDER_PLAN["trail_fade"]:
+            cv2.polylines(
+                opencv_image,
+                [trail],
+                False,
+                color,
+                style["thickness"],
+                RENDER_PLAN["line_type"],
+            )
+            continue
+        # Split the trail into bands that share their end points, dimmest band first
+        bounds = np.linspace(0, len(trail) - 1, TRAIL_FADE_BANDS + 1).round().astype(int)
+        for band in range(TRAIL_FADE_BANDS):
+            if bounds[band + 1] == bounds[band]:
+                continue
+            dim = (band + 1) / TRAIL_FADE_BANDS
+            cv2.polylines(
+                opencv_image,
+                [trail[bounds[band] : bounds[band + 1] + 1]],
+                False,
+                tuple(int(c * dim) for c in color),
+                style["thickness"],
+                RENDER_PLAN["line_type"],
+            )
+    return opencv_image
+
+
+def annotate_object_detection(opencv_image, batch, style=None):
     """Annotates an OpenCV image with bounding boxes, labels, and confidence scores for object detection.
 
     This function draws bounding boxes around detected objects, with optional object IDs and
-    confidence scores, and overlays the corresponding label for each object.
+    confidence scores, and overlays the corresponding label for each object. Boxes smaller than
+    `min_text_box_size` of the `render_profile` are drawn without label.
 
     Args:
         opencv_image (numpy.ndarray): The input image in OpenCV format to be annotated.
-        label (str): A string containing object labels separated by the configured separator.
-        x (list[float]): List of x-coordinates for the top-left corners of bounding boxes.
-        y (list[float]): List of y-coordinates for the top-left corners of bounding boxes.
-        w (list[float]): List of widths for the bounding boxes.
-        h (list[float]): List of heights for the bounding boxes.
-        score (list[float]): List of confidence scores for each detected object.
-        object_id (list[int], optional): List of unique object IDs. If provided, IDs are included in the annotation. A different color is used for each object ID.
-        attrs (str): A string containing attributes separated by the configured separator.
+        batch (DetectionBatch): The detections. If object IDs are provided, IDs are included
+            in the annotation and a different color is used for each object ID.
+        style (dict, optional): The overlay sizes, see `get_overlay_style`.
 
     Returns:
         numpy.ndarray: The annotated OpenCV image.
-    """
-    if x is None:  # return if no objects have been detected
-        return opencv_image
-
-    for i in range(len(x)):  # pylint: disable=consider-using-enumerate
-        start_point = (int(x[i]), int(y[i]))
-        end_point = (
-            int(x[i] + w[i]),
-            int(y[i] + h[i]),
-        )
+    """
+    object_ids = batch.object_id.tolist() if batch.object_id is not None else None
+    scores = batch.score.tolist()
+    show_text = has_text_size(batch).tolist()
 
+    for i, (x0, y0, x1, y1) in enumerate(batch.boxes.tolist()):
         text = ""
-        if object_id is not None:
-            text += f"#{object_id[i]} "
-
-        text += f"{label.split(SETTINGS['object_label_separator'])[i]} ({score[i]*100:.0f}%)"
-        if attrs is not None:
-            text = text + f" > {attrs.split(SETTINGS['object_label_separator'])[i]}"
-        if object_id is not None:
-            color = get_color(int(object_id[i]) - 1)
+        if show_text[i]:
+            if object_ids is not None:
+                text += f"#{object_ids[i]} "
+
+            text += f"{batch.labels[i]} ({scores[i]*100:.0f}%)"
+            if batch.attributes is not None:
+                text = text + f" > {batch.attributes[i]}"
+        if object_ids is not None:
+            color = get_color(object_ids[i] - 1)
         else:
             color = get_color(0)
-        opencv_image = draw_bbox(opencv_image, start_point, end_point, text, color)
+        opencv_image = draw_bbox(opencv_image, (x0, y0), (x1, y1), text, color, style)
     return opencv_image
 
 
-def draw_bbox(opencv_image, start_point, end_point, text, color):
+def draw_bbox(opencv_image, start_point, end_point, text, color, style=None):
     """Draws a bounding box with a label on an image.
 
     This function draws a rectangle around the specified region of an image and overlays
@@ -300,194 +2508,415 @@ def draw_bbox(opencv_image, start_point, end_point, text, color):
         opencv_image (numpy.ndarray): The input image in OpenCV format.
         start_point (tuple[int, int]): Coordinates (x, y) of the top-left corner of the bounding box.
         end_point (tuple[int, int]): Coordinates (x, y) of the bottom-right corner of the bounding box.
-        text (str): The label text to be displayed above the bounding box.
+        text (str): The label text to be displayed above the bounding box. Empty for no label.
         color (tuple[int, int, int]): The color of the bounding box in BGR format.
+        style (dict, optional): The overlay sizes, see `get_overlay_style`.
 
     Returns:
         numpy.ndarray: The image with the bounding box and label text drawn.
 
     Details:
-        - If the average brightness of the box color is low, the text is drawn in white.
-          Otherwise, it is drawn in black for better contrast.
-        - A filled rectangle is drawn behind the text for readability.
+        - The label is drawn from a pre-rendered sprite, see `get_label_sprite`.
     """
 
+    if style is None:
+        style = get_overlay_style()
+
     cv2.rectangle(
-        opencv_image, start_point, end_point, color, 1, cv2.LINE_AA
+        opencv_image,
+        start_point,
+        end_point,
+        color,
+        style["thickness"],
+        RENDER_PLAN["line_type"],
     )  # Draw bounding box
 
+    if not text:
+        return opencv_image
+    sprite = get_label_sprite(text, color, style["font_scale"], style["thickness"])
+    return blit_sprite(opencv_image, sprite, start_point)
+
+
+def get_label_sprite(text, color, font_scale, thickness):
+    """Gets a pre-rendered label sprite from the label cache, rendering it when needed.
+
+    The same labels are drawn in frame after frame, so labels are rendered once and kept
+    in a least recently used cache of `label_cache_size` sprites. Cache hits and misses are
+    counted in `STATS`.
+
+    Args:
+        text (str): The label text.
+        color (tuple[int, int, int]): The background color of the label in BGR format.
+        font_scale (float): The font scale of the text.
+        thickness (int): The thickness of the text.
+
+    Returns:
+        tuple: The label sprite, see `render_label_sprite`.
+    """
+    key = (
+        text,
+        color,
+        FONT_FACE,
+        font_scale,
+        thickness,
+        RENDER_PLAN["text_line_type"],
+        RENDER_PLAN["label_background"],
+    )
+    with LABEL_CACHE_LOCK:
+        sprite = LABEL_CACHE.get(key)
+        if sprite is not None:
+            LABEL_CACHE.move_to_end(key)
+            STATS["label_cache_hits"] += 1
+            return sprite
+        STATS["label_cache_misses"] += 1
+
+    sprite = render_label_sprite(text, color, font_scale, thickness)
+    if RENDER_PLAN["label_cache_size"] > 0:
+        with LABEL_CACHE_LOCK:
+            LABEL_CACHE[key] = sprite
+            if len(LABEL_CACHE) > RENDER_PLAN["label_cache_size"]:
+                LABEL_CACHE.popitem(last=False)
+    return sprite
+
+
+def render_label_sprite(text, color, font_scale, thickness):
+    """Renders a text label into a sprite that can be copied into an image.
+
+    Args:
+        text (str): The label text.
+        color (tuple[int, int, int]): The background color of the label in BGR format.
+        font_scale (float): The font scale of the text.
+        thickness (int): The thickness of the text.
+
+    Returns:
+        tuple: The label sprite.
+            - (np.ndarray): The rendered label.
+            - (tuple[int, int]): Offset of the top-left corner of the sprite from the top-left
+              corner of the bounding box.
+            - (np.ndarray | None): Mask of the pixels to copy as `uint8`, `None` to copy all pixels.
+
+    Details:
+        - If the average brightness of the box color is low, the text is drawn in white.
+          Otherwise, it is drawn in black for better contrast.
+        - A filled rectangle is drawn behind the text for readability, unless the
+          `render_profile` has no `label_background`. The text is then drawn in the box color.
+    """
     # Use white text if the background is dark, and vice versa
-    if sum(color) / 3 < 150:
+    if not RENDER_PLAN["label_background"]:
+        text_color = color
+    elif sum(color) / 3 < 150:
         text_color = (255, 255, 255)  # (b,g,r)
     else:
         text_color = (0, 0, 0)  # (b,g,r)
 
-    text_size = cv2.getTextSize(text, FONT_FACE, FONT_SCALE, THICKNESS)
+    text_size = cv2.getTextSize(text, FONT_FACE, font_scale, thickness)
     text_width = int(text_size[0][0])
     text_height = int(text_size[0][1])
     line_height = text_size[1]
 
-    x_min, y_min = start_point
-    text_x = x_min + MARGIN
-    text_y = y_min - line_height - MARGIN
-
     # Draw a filled rectangle to place the text in
-    cv2.rectangle(
-        opencv_image,
-        (text_x - MARGIN, text_y + line_height + MARGIN),
-        (text_x + text_width + MARGIN, text_y - text_height - MARGIN),
-        color,
-        -1,
-        cv2.LINE_AA,
+    patch = np.empty(
+        (text_height + line_height + 2 * MARGIN + 1, text_width + 2 * MARGIN + 1, 3),
+        dtype=np.uint8,
     )
+    patch[:] = color if RENDER_PLAN["label_background"] else 0
 
     # Add the text
     cv2.putText(
-        opencv_image,
+        patch,
         text,
-        (text_x, text_y),
+        (MARGIN, text_height + MARGIN),
         FONT_FACE,
-        FONT_SCALE,
-        text_color,
-        THICKNESS,
-        cv2.LINE_AA,
+        font_scale,
+        text_color if RENDER_PLAN["label_background"] else (255, 255, 255),
+        thickness,
+        RENDER_PLAN["text_line_type"],
     )
+    mask = None
+    if not RENDER_PLAN["label_background"]:
+        # Only copy the text, in the box color
+        mask = (patch[:, :, 0] > 127).astype(np.uint8)
+        patch[:] = text_color
+    return patch, (0, -(text_height + line_height + 2 * MARGIN)), mask
+
+
+def blit_sprite(opencv_image, sprite, position):
+    """Copies a label sprite into an image, clipped to the image bounds.
+
+    Args:
+        opencv_image (numpy.ndarray): The input image in OpenCV format.
+        sprite (tuple): The label sprite, see `render_label_sprite`.
+        position (tuple[int, int]): Coordinates (x, y) of the top-left corner of the bounding box.
+
+    Returns:
+        numpy.ndarray: The image with the label drawn.
+    """
+    patch, (offset_x, offset_y), mask = sprite
+    sprite_height, sprite_width = patch.shape[:2]
+    x = position[0] + offset_x
+    y = position[1] + offset_y
+
+    x_min = max(x, 0)
+    y_min = max(y, 0)
+    x_max = min(x + sprite_width, opencv_image.shape[1])
+    y_max = min(y + sprite_height, opencv_image.shape[0])
+    if x_min < x_max and y_min < y_max:  # Skip labels outside of the image
+        visible = (slice(y_min - y, y_max - y), slice(x_min - x, x_max - x))
+        if mask is None:
+            opencv_image[y_min:y_max, x_min:x_max] = patch[visible]
+        else:
+            # Copies into the view, much faster than `np.copyto` with `where`
+            roi = opencv_image[y_min:y_max, x_min:x_max]
+            cv2.copyTo(patch[visible], mask[visible], roi)
     return opencv_image
 
 
-def annotate_keypoints(
-    opencv_image,
-    n_objects,
-    object_ids,
-    object_track_count,
-    object_track_kpts_count,
-    object_track_kpts_x,
-    object_track_kpts_y,
-    object_track_kpts_score,
-    object_track_kpts_label_id,
-):
+def annotate_keypoints(opencv_image, batch, style=None):
     """Annotates keypoints on an image.
 
     Each keypoint is marked with a circle with a
-    text label. Only the last position of the keypoint track is drawn.
+    text label. Only the last position of the keypoint track is drawn. With the `dots`
+    keypoint markers of the `render_profile`, all markers of an object are drawn as dots with
+    one call, and objects with boxes smaller than `min_text_box_size` get no keypoint labels.
 
     Args:
         opencv_image (np.ndarray): The input image in OpenCV format to be annotated.
-        n_objects (int): The number of objects to annotate.
-        object_ids (list[int] | None): List of unique object IDs. If `None`, no object IDs are used.
-        object_track_count (list[int] | None): List of the number of tracks per object.
-            If `None`, assumes one track per object.
-        object_track_kpts_count (list[int]): List of keypoint counts per track.
-        object_track_kpts_x (list[float]): List of x-coordinates for all keypoints across tracks.
-        object_track_kpts_y (list[float]): List of y-coordinates for all keypoints across tracks.
-        object_track_kpts_score (list[float]): List of confidence scores for keypoints.
-        object_track_kpts_label_id (list[int]): List of label IDs for keypoints.
+        batch (DetectionBatch): The detections, with the keypoints of the last track of every
+            object. If there are no object IDs, the color of object ID 1 is used.
+        style (dict, optional): The overlay sizes, see `get_overlay_style`.
 
     Returns:
         np.ndarray: The annotated OpenCV image.
     """
-    kpts_count_pointer = 0
-    # Get keypoints as list of lists for object
-    offset = 0
+    if style is None:
+        style = get_overlay_style()
+    radius = style["keypoint_radius"]
+    kpts = batch.kpts
+    n_objects = len(batch)
+    if kpts is None or len(kpts["object_index"]) == 0:
+        return opencv_image
+
+    kpts_labels = RENDER_PLAN["kpts_labels"]
+    segments = skeleton_segments(kpts, n_objects)
+
+    # Keypoints of an object are stored consecutively, so split them per object
+    bounds = np.searchsorted(kpts["object_index"], np.arange(n_objects + 1)).tolist()
+    points = kpts["points"].tolist()
+    label_id = kpts["label_id"].tolist()
+    is_right = kpts["is_right"].tolist()
+
+    line_type = RENDER_PLAN["line_type"]
+    dots = RENDER_PLAN["keypoint_markers"] == "dots"
+    show_labels = RENDER_PLAN["show_keypoint_labels"] and len(kpts_labels) > 0
+    show_text = has_text_size(batch).tolist()
+
+    object_ids = batch.object_id.tolist() if batch.object_id is not None else None
     for o in range(n_objects):
         if object_ids is not None:
-            object_id = int(object_ids[o])
+            object_id = object_ids[o]
         else:
             object_id = 1
-        kpts_x = []
-        kpts_y = []
-        score = []
-        label_id = []
-        if object_track_count is None:
-            number_of_tracks_object = 1
-        else:
-            number_of_tracks_object = object_track_count[o]
-        for t in range(number_of_tracks_object):
-            kpts_count = object_track_kpts_count[kpts_count_pointer]
-            kpts_count_pointer += 1
-            kpts_x.append(object_track_kpts_x[offset : offset + kpts_count])
-            kpts_y.append(object_track_kpts_y[offset : offset + kpts_count])
-            score.append(object_track_kpts_score[offset : offset + kpts_count])
-            label_id.append(object_track_kpts_label_id[offset : offset + kpts_count])
-            offset += kpts_count
-
-        # Plot keypoints per object
-
-        # Plot all keypoints in track
-        # for t in range(number_of_tracks_object):
-        # Plot last keypoints in track
-        for t in [number_of_tracks_object - 1]:
-
-            # Lines
-            if SETTINGS["skeleton"] != "":
-                for skeleton_pair in SETTINGS["skeleton"].split(","):
-                    try:
-                        sk_from = skeleton_pair.split("-")[0]
-                        sk_to = skeleton_pair.split("-")[1]
-                        sk_from_id = SETTINGS["kpts_labels"].split(",").index(sk_from)
-                        sk_to_id = SETTINGS["kpts_labels"].split(",").index(sk_to)
-
-                        pos_a = label_id[t].index(sk_from_id)
-                        pos_b = label_id[t].index(sk_to_id)
-
-                        start_point = (int(kpts_x[t][pos_a]), int(kpts_y[t][pos_a]))
-                        end_point = (int(kpts_x[t][pos_b]), int(kpts_y[t][pos_b]))
-                        opencv_image = cv2.line(
-                            opencv_image,
-                            start_point,
-                            end_point,
-                            get_color(object_id - 1),
-                            1,
-                            cv2.LINE_AA,
-                        )
-                    except ValueError:
-                        pass
-
-            for k in range(len(kpts_x[t])):
-                if SETTINGS["kpts_labels"] != "":
-                    label_name = SETTINGS["kpts_labels"].split(",")[label_id[t][k]]
-                else:
-                    label_name = ""
+        color = get_color(object_id - 1)
+
+        # Lines
+        if segments[o] is not None:
+            cv2.polylines(
+                opencv_image, segments[o], False, color, style["thickness"], line_type
+            )
+
+        if dots and bounds[o] < bounds[o + 1]:
+            # A line from a point to itself is drawn as a dot of the line thickness
+            centers = kpts["points"][bounds[o] : bounds[o + 1], None, :]
+            cv2.polylines(
+                opencv_image,
+                list(np.repeat(centers, 2, axis=1)),
+                False,
+                color,
+                2 * radius + 1,
+                line_type,
+            )
+
+        if dots and not (show_labels and show_text[o]):
+            continue
+        for k in range(bounds[o], bounds[o + 1]):
+            center = tuple(points[k])
 
+            if not dots:
                 # Use rectangle for right body parts and circle for left body parts
-                if label_name.startswith("r_") or label_name.startswith("right_"):
+                if is_right[k]:
                     cv2.rectangle(
                         opencv_image,
-                        (int(kpts_x[t][k]) - 4, int(kpts_y[t][k]) - 4),
-                        (int(kpts_x[t][k]) + 4, int(kpts_y[t][k]) + 4),
-                        get_color(object_id - 1),
+                        (center[0] - radius, center[1] - radius),
+                        (center[0] + radius, center[1] + radius),
+                        color,
                         -1,
-                        cv2.LINE_AA,
+                        line_type,
                     )
                 else:
                     cv2.circle(
                         opencv_image,
-                        (int(kpts_x[t][k]), int(kpts_y[t][k])),
-                        4,
-                        get_color(object_id - 1),
+                        center,
+                        radius,
+                        color,
                         -1,
-                        cv2.LINE_AA,
+                        line_type,
                     )
 
-                if SETTINGS["show_keypoint_labels"] == "yes":
-                    cv2.putText(
-                        opencv_image,
-                        label_name,
-                        (int(kpts_x[t][k]), int(kpts_y[t][k])),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.5,
-                        (255, 255, 255),
-                        1,
-                        cv2.LINE_AA,
-                    )
+            if show_labels and show_text[o] and label_id[k] < len(kpts_labels):
+                cv2.putText(
+                    opencv_image,
+                    kpts_labels[label_id[k]],
+                    center,
+                    FONT_FACE,
+                    style["keypoint_font_scale"],
+                    (255, 255, 255),
+                    style["thickness"],
+                    RENDER_PLAN["text_line_type"],
+                )
     return opencv_image
 
 
+def has_text_size(batch):
+    """Gets whether the boxes are large enough for text, using `min_text_box_size` of the `render_profile`.
+
+    Returns:
+        np.ndarray: Whether every box gets text.
+    """
+    sizes = np.minimum(
+        batch.boxes[:, 2] - batch.boxes[:, 0], batch.boxes[:, 3] - batch.boxes[:, 1]
+    )
+    return sizes >= RENDER_PLAN["min_text_box_size"]
+
+
+def decode_keypoints(
+    n_objects,
+    object_track_count,
+    object_track_kpts_count,
+    object_track_kpts_x,
+    object_track_kpts_y,
+    object_track_kpts_score,
+    object_track_kpts_label_id,
+):
+    """Decodes the flat keypoint arrays of an event into the keypoints of the last track of every object.
+
+    The keypoints of all tracks are stored consecutively in the flat arrays. The offset of every
+    track is computed with a cumulative sum over the keypoint counts, so no Python loop over
+    the keypoints is needed.
+
+    Args:
+        n_objects (int): The number of objects.
+        object_track_count (list[int] | None): List of the number of tracks per object.
+            If `None`, assumes one track per object.
+        object_track_kpts_count (list[int]): List of keypoint counts per track.
+        object_track_kpts_x (list[float]): List of x-coordinates for all keypoints across tracks.
+        object_track_kpts_y (list[float]): List of y-coordinates for all keypoints across tracks.
+        object_track_kpts_score (list[float]): List of confidence scores for keypoints.
+        object_track_kpts_label_id (list[int]): List of label IDs for keypoints.
+
+    Returns:
+        dict: The keypoints of the last track of every object, ordered by object.
+            - `object_index` (np.ndarray): Index of the object every keypoint belongs to.
+            - `points` (np.ndarray): Integer (x, y) coordinates, with shape (n, 2).
+            - `score` (np.ndarray): Confidence scores.
+            - `label_id` (np.ndarray): Label IDs.
+            - `is_right` (np.ndarray): Whether a keypoint is a right body part.
+    """
+    kpts_count = np.asarray(object_track_kpts_count, dtype=np.int64).reshape(-1)
+    if object_track_count is None:
+        track_count = np.ones(n_objects, dtype=np.int64)
+    else:
+        track_count = np.asarray(object_track_count, dtype=np.int64)[:n_objects]
+
+    # Offset of every track in the flat keypoint arrays
+    track_offset = np.concatenate(([0], np.cumsum(kpts_count)))
+    # Position of the last track of every object in the keypoint counts
+    last_track = np.cumsum(track_count) - 1
+    has_track = (track_count > 0) & (last_track < len(kpts_count))
+    last_track = last_track[has_track]
+    count = np.zeros(len(track_count), dtype=np.int64)
+    count[has_track] = kpts_count[last_track]
+    start = np.zeros(len(track_count), dtype=np.int64)
+    start[has_track] = track_offset[last_track]
+
+    # Index of every keypoint of the last tracks in the flat keypoint arrays
+    kpts_offset = np.concatenate(([0], np.cumsum(count)))
+    index = np.arange(kpts_offset[-1]) + np.repeat(start - kpts_offset[:-1], count)
+
+    label_id = take(object_track_kpts_label_id, index, np.int64)
+    kpts_is_right = RENDER_PLAN["kpts_is_right"]
+    is_right = np.zeros(len(index), dtype=bool)
+    known = (label_id >= 0) & (label_id < len(kpts_is_right))
+    is_right[known] = np.asarray(kpts_is_right, dtype=bool)[label_id[known]]
+
+    return {
+        "object_index": np.repeat(np.arange(len(track_count)), count),
+        "points": np.stack(
+            (
+                take(object_track_kpts_x, index, np.float64),
+                take(object_track_kpts_y, index, np.float64),
+            ),
+            axis=1,
+        ).astype(np.int32),
+        "score": take(object_track_kpts_score, index, np.float64),
+        "label_id": label_id,
+        "is_right": is_right,
+    }
+
+
+def take(values, index, dtype):
+    """Helper function to gather values by index from a list or array into a NumPy array.
+
+    Lists are gathered without converting the whole list, as only the keypoints of the
+    last tracks are needed.
+    """
+    if isinstance(values, np.ndarray):
+        return values[index].astype(dtype, copy=False)
+    if len(index) == 0:
+        return np.empty(0, dtype=dtype)
+    if len(index) == 1:
+        return np.array([values[int(index[0])]], dtype=dtype)
+    return np.array(operator.itemgetter(*index.tolist())(values), dtype=dtype)
+
+
+def skeleton_segments(kpts, n_objects):
+    """Resolves the skeleton edges of the render plan into line segments for every object.
+
+    A lookup table from (object, label ID) to keypoint position is used to find both
+    endpoints of every skeleton edge at once.
+
+    Args:
+        kpts (dict): Decoded keypoints, see `decode_keypoints`.
+        n_objects (int): The number of objects.
+
+    Returns:
+        list[np.ndarray | None]: For every object, the line segments with shape (n, 2, 2),
+            or `None` if no skeleton edge could be resolved.
+    """
+    edges = np.asarray(RENDER_PLAN["skeleton_edges"], dtype=np.int64).reshape(-1, 2)
+    label_id = kpts["label_id"]
+    valid = label_id >= 0
+    if len(edges) == 0 or not valid.any():
+        return [None] * n_objects
+
+    n_ids = max(int(label_id.max()) + 1, int(edges.max()) + 1)
+    lookup = np.full((n_objects, n_ids), -1, dtype=np.int64)
+    # Assign in reverse, so the first keypoint with a label ID is used, like `list.index`
+    position = np.flatnonzero(valid)[::-1]
+    lookup[kpts["object_index"][position], label_id[position]] = position
+
+    pos_a = lookup[:, edges[:, 0]]
+    pos_b = lookup[:, edges[:, 1]]
+    found = (pos_a >= 0) & (pos_b >= 0)
+    segments = np.stack((kpts["points"][pos_a], kpts["points"][pos_b]), axis=2)
+
+    return [
+        segments[o][found[o]] if found[o].any() else None for o in range(n_objects)
+    ]
+
+
 def get_color(object_id):
-    """Helper function to get a BGR color from a list of RGB colors."""
-    return COLORS[object_id % len(COLORS)][
-        ::-1
-    ]  # Reverse the list to use BGR instead of RGB
+    """Helper function to get a BGR color from the palette."""
+    return COLORS_BGR[object_id % len(COLORS_BGR)]
 
 
 _espconfig_ = {
@@ -554,6 +2983,18 @@ _espconfig_ = {
                 "esp_type": "array(i32)",
                 "optional": True,
             },
+            {
+                "name": "object_track_x",
+                "desc": "X-coordinates of the track points, oldest first, `object_track_count` points per object (array(dbl))",
+                "esp_type": "array(dbl)",
+                "optional": True,
+            },
+            {
+                "name": "object_track_y",
+                "desc": "Y-coordinates of the track points, oldest first, `object_track_count` points per object (array(dbl))",
+                "esp_type": "array(dbl)",
+                "optional": True,
+            },
             {
                 "name": "object_track_kpts_count",
                 "desc": "Number of keypoints per detected object for the track (array(i32))",
@@ -584,12 +3025,12 @@ _espconfig_ = {
                 "esp_type": "array(i32)",
                 "optional": True,
             },
-            # {
-            #     "name": "camera_id",
-            #     "desc": "Camera ID",
-            #     "esp_type": "string",
-            #     "optional": True,
-            # },
+            {
+                "name": "camera_id",
+                "desc": "Camera ID, used to limit the annotated frames per camera",
+                "esp_type": "string",
+                "optional": True,
+            },
         ],
     },
     "outputVariables": {
@@ -599,13 +3040,58 @@ _espconfig_ = {
                 "name": "annotated_image",
                 "desc": "Annotated image (blob)",
                 "esp_type": "blob",
-            }
+            },
+            {
+                "name": "heatmap_image",
+                "desc": "Detection heatmap (blob), when `heatmap_output` is `field`. Only set for annotated frames",
+                "esp_type": "blob",
+            },
+            {
+                "name": "segment_file",
+                "desc": "File name of the video segment that the frame is written to, when `segment_directory` is set. Not set for skipped frames or frames dropped from a full queue",
+                "esp_type": "string",
+            },
+            {
+                "name": "processing_us",
+                "desc": "Time to process the event in microseconds, when `timing_fields` is `yes` (int64)",
+                "esp_type": "int64",
+            },
+            {
+                "name": "decode_us",
+                "desc": "Time to decode the image in microseconds, when `timing_fields` is `yes` (int64)",
+                "esp_type": "int64",
+            },
+            {
+                "name": "pseudonymize_us",
+                "desc": "Time to pseudonymize the bounding boxes in microseconds, when `timing_fields` is `yes` (int64)",
+                "esp_type": "int64",
+            },
+            {
+                "name": "trails_us",
+                "desc": "Time to draw the track trails in microseconds, when `timing_fields` is `yes` (int64)",
+                "esp_type": "int64",
+            },
+            {
+                "name": "boxes_us",
+                "desc": "Time to draw the bounding boxes in microseconds, when `timing_fields` is `yes` (int64)",
+                "esp_type": "int64",
+            },
+            {
+                "name": "keypoints_us",
+                "desc": "Time to draw the keypoints in microseconds, when `timing_fields` is `yes` (int64)",
+                "esp_type": "int64",
+            },
+            {
+                "name": "encode_us",
+                "desc": "Time to encode the image in microseconds, when `timing_fields` is `yes` (int64)",
+                "esp_type": "int64",
+            },
         ],
     },
     "settings": {
         "desc": "",
         "expand_parms": False,
-        "process_blocks": False,
+        "process_blocks": True,
         "encode_binary": False,
     },
     "initialization": {
@@ -627,10 +3113,10 @@ _espconfig_ = {
             },
             {
                 "name": "pseudonymization",
-                "desc": "Pseudonymization setting - must be one of the following: `none`, `black_bbox`",
+                "desc": "Pseudonymization setting - must be one of the following: `none`, `black_bbox`, `gaussian_blur`, `pixelate`. Only the bounding boxes are processed",
                 "default": "none",
                 "input_type": "dropdown",
-                "values": ["none", "black_bbox"],
+                "values": ["none", "black_bbox", "gaussian_blur", "pixelate"],
             },
             {
                 "name": "object_label_separator",
@@ -654,6 +3140,237 @@ _espconfig_ = {
                 "input_type": "dropdown",
                 "values": ["yes", "no"],
             },
+            {
+                "name": "label_cache_size",
+                "desc": "Maximum number of pre-rendered labels to keep. Use `0` to disable the label cache",
+                "default": "1024",
+            },
+            {
+                "name": "render_profile",
+                "desc": "Drawing quality - must be one of the following: `quality`, `balanced` (no anti-aliased lines), `fast` (no anti-aliasing, label background or text on small boxes)",
+                "default": "quality",
+                "input_type": "dropdown",
+                "values": ["quality", "balanced", "fast"],
+            },
+            {
+                "name": "buffer_pool_size",
+                "desc": "Maximum number of free image buffers to keep per image size, to reuse the memory of decoded images. Use `0` to disable the buffer pool",
+                "default": "4",
+            },
+            {
+                "name": "worker_threads",
+                "desc": "Number of threads to process an event block with. Use more than `1` to annotate the events of a block in parallel",
+                "default": "1",
+            },
+            {
+                "name": "worker_processes",
+                "desc": "Number of processes to annotate an event block with. Frames are passed to the processes through shared memory. Use `0` for no processes",
+                "default": "0",
+            },
+            {
+                "name": "process_slots",
+                "desc": "Number of frames in the shared memory of the worker processes, the maximum number of frames being annotated at once",
+                "default": "8",
+            },
+            {
+                "name": "process_slot_mb",
+                "desc": "Maximum size of a decoded frame for the worker processes in MiB. Larger frames are annotated without processes. A 4K frame takes 24 MiB",
+                "default": "24",
+            },
+            {
+                "name": "encoder_preset",
+                "desc": "Encoder options for `jpg` and `png` output - must be one of the following: `default` (OpenCV defaults), `speed`, `balanced`, `size`, `quality`",
+                "default": "default",
+                "input_type": "dropdown",
+                "values": ["default", "speed", "balanced", "size", "quality"],
+            },
+            {
+                "name": "jpeg_quality",
+                "desc": "JPEG quality from 1 to 100. Leave empty to use the encoder preset",
+                "default": "",
+            },
+            {
+                "name": "jpeg_chroma_subsampling",
+                "desc": "JPEG chroma subsampling - must be one of the following: `preset`, `444`, `422`, `420`",
+                "default": "preset",
+                "input_type": "dropdown",
+                "values": ["preset", "444", "422", "420"],
+            },
+            {
+                "name": "jpeg_progressive",
+                "desc": "Whether to write progressive JPEG - must be one of the following: `preset`, `yes`, `no`",
+                "default": "preset",
+                "input_type": "dropdown",
+                "values": ["preset", "yes", "no"],
+            },
+            {
+                "name": "jpeg_optimize",
+                "desc": "Whether to optimize the JPEG Huffman tables - must be one of the following: `preset`, `yes`, `no`",
+                "default": "preset",
+                "input_type": "dropdown",
+                "values": ["preset", "yes", "no"],
+            },
+            {
+                "name": "jpeg_backend",
+                "desc": "JPEG encoder - must be one of the following: `opencv`, `simplejpeg`. `simplejpeg` is faster, but falls back to `opencv` when it is not installed or when progressive or optimized JPEG is used",
+                "default": "opencv",
+                "input_type": "dropdown",
+                "values": ["opencv", "simplejpeg"],
+            },
+            {
+                "name": "png_compression",
+                "desc": "PNG compression level from 0 (fastest) to 9 (smallest). Leave empty to use the encoder preset",
+                "default": "",
+            },
+            {
+                "name": "output_scale",
+                "desc": "Scale of the output image, above 0 up to 1. Downscaled images are faster to decode, annotate and encode",
+                "default": "1",
+            },
+            {
+                "name": "output_max_width",
+                "desc": "Maximum width of the output image in pixels. Wider images are downscaled. Use `0` for no maximum",
+                "default": "0",
+            },
+            {
+                "name": "max_output_fps",
+                "desc": "Maximum annotated frames per second per camera. Frames over this budget are skipped without decoding. Use `0` for no maximum",
+                "default": "0",
+            },
+            {
+                "name": "annotate_every_n",
+                "desc": "Annotate every n-th frame per camera. The other frames are skipped without decoding",
+                "default": "1",
+            },
+            {
+                "name": "skip_mode",
+                "desc": "What to do with skipped frames - must be one of the following: `drop`, `passthrough`. `passthrough` outputs the frames without annotations",
+                "default": "drop",
+                "input_type": "dropdown",
+                "values": ["drop", "passthrough"],
+            },
+            {
+                "name": "min_score",
+                "desc": "Minimum confidence score of the boxes to draw, from 0 to 1. Boxes below it are not drawn, but still pseudonymized",
+                "default": "0",
+            },
+            {
+                "name": "max_objects",
+                "desc": "Maximum number of boxes to draw per frame, the highest scores first. Use `0` for no maximum",
+                "default": "0",
+            },
+            {
+                "name": "min_box_area",
+                "desc": "Minimum area of the boxes to draw, in pixels of the output image. Smaller boxes are not drawn, but still pseudonymized",
+                "default": "0",
+            },
+            {
+                "name": "trail_length",
+                "desc": "Number of track points to draw as a trail per object. Requires `object_track_x`, `object_track_y` and `object_track_count`. Use `0` for no trails",
+                "default": "0",
+            },
+            {
+                "name": "trail_fade",
+                "desc": "Whether to fade the trails from old to new - must be one of the following: `yes`, `no`",
+                "default": "yes",
+                "input_type": "dropdown",
+                "values": ["yes", "no"],
+            },
+            {
+                "name": "heatmap",
+                "desc": "Detection heatmap per camera - must be one of the following: `none`, `centers` (box centers), `areas` (box areas)",
+                "default": "none",
+                "input_type": "dropdown",
+                "values": ["none", "centers", "areas"],
+            },
+            {
+                "name": "heatmap_output",
+                "desc": "How to output the heatmap - must be one of the following: `blend` (under the annotations), `field` (as `heatmap_image`)",
+                "default": "blend",
+                "input_type": "dropdown",
+                "values": ["blend", "field"],
+            },
+            {
+                "name": "heatmap_cell_size",
+                "desc": "Size of the heatmap cells in input image pixels. Larger cells are faster to render",
+                "default": "16",
+            },
+            {
+                "name": "heatmap_half_life",
+                "desc": "Number of frames after which detections count half in the heatmap",
+                "default": "300",
+            },
+            {
+                "name": "segment_directory",
+                "desc": "Directory to write the annotated frames to as rolling MJPEG video segments (AVI). Leave empty to not write segments",
+                "default": "",
+            },
+            {
+                "name": "segment_seconds",
+                "desc": "Maximum duration of a video segment in seconds",
+                "default": "60",
+            },
+            {
+                "name": "segment_max_mb",
+                "desc": "Maximum size of a video segment in MiB. Use `0` for no maximum",
+                "default": "0",
+            },
+            {
+                "name": "segment_fps",
+                "desc": "Frame rate of the video segments",
+                "default": "10",
+            },
+            {
+                "name": "segment_queue_size",
+                "desc": "Maximum number of frames waiting to be written to the video segments. Frames are dropped when the queue is full",
+                "default": "64",
+            },
+            {
+                "name": "instrumentation",
+                "desc": "Whether to keep latency histograms per stage and log a p50/p95/p99 summary periodically - must be one of the following: `yes`, `no`",
+                "default": "no",
+                "input_type": "dropdown",
+                "values": ["yes", "no"],
+            },
+            {
+                "name": "instrumentation_log_events",
+                "desc": "Number of events between latency summaries. Use `0` to not log by number of events",
+                "default": "1000",
+            },
+            {
+                "name": "instrumentation_log_seconds",
+                "desc": "Seconds between latency summaries. Use `0` to not log by time",
+                "default": "60",
+            },
+            {
+                "name": "timing_fields",
+                "desc": "Whether to add the latencies in microseconds to the output fields (`processing_us`, `decode_us`, ...) - must be one of the following: `yes`, `no`",
+                "default": "no",
+                "input_type": "dropdown",
+                "values": ["yes", "no"],
+            },
+            {
+                "name": "warm_up",
+                "desc": "Whether to annotate a synthetic frame when the window starts, so the first events do not pay one-time initialization costs - must be one of the following: `yes`, `no`",
+                "default": "no",
+                "input_type": "dropdown",
+                "values": ["yes", "no"],
+            },
+            {
+                "name": "warm_up_width",
+                "desc": "Width of the synthetic frame of the warm-up, use the width of the input images",
+                "default": "1920",
+            },
+            {
+                "name": "warm_up_height",
+                "desc": "Height of the synthetic frame of the warm-up, use the height of the input images",
+                "default": "1080",
+            },
+            {
+                "name": "warm_up_labels",
+                "desc": "Object labels to draw in the warm-up, separated by commas. Optional",
+                "default": "",
+            },
         ],
     },
 }
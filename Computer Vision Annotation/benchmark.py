@@ -0,0 +1,673 @@
+"""This file can be used to benchmark the computer vision annotation custom window.
+
+It measures the latency per frame of every stage of the custom window (`decode_image`,
+`annotate`, `encode_image` and the whole `create` path) on the frames in `test_files/`,
+using the `_espconfig_` defaults with the keypoints of the captures. Every variant changes one thing compared to the
+`base` variant: the capture (or a synthetic frame, see `synthetic_events.py`), the number of objects, the keypoints per object, the
+resolution, the image encodings or a setting, such as the encoder preset or the JPEG backend.
+The size of the encoded frame is reported with the encoding latency. Event blocks are measured for different
+numbers of worker threads, and on the `synthetic_200` frames for different numbers of
+worker processes, where drawing the objects in Python dominates. A long run on 4K frames
+compares the number of allocated image buffers, the minor page faults and the resident set
+size with and without the buffer pool. Loading a synthetic capture with `esp_capture.py` is compared to
+the `pandas.read_csv` converters, by rows per second and peak memory.
+
+The results can be saved as JSON and compared to a saved baseline, to measure the effect
+of a change to `annotation.py`.
+
+Usage: python benchmark.py [--repeat N] [--workers 1,2,4] [--processes 0,2,4] [--block-size N]
+                           [--pool-frames N] [--filter TEXT]
+                           [--json results.json] [--baseline baseline.json] [--threshold 0.1]
+"""
+
+import argparse
+import base64
+import csv
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import cv2
+import pandas as pd
+
+# Use the stand-ins for the ESP packages, so `create()` can run outside ESP
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_esp")
+)
+import annotation  # pylint: disable=wrong-import-position
+import esp_capture
+import replay
+import synthetic_events
+from esp_utils import image_conversion
+
+# The `_espconfig_` defaults, with the keypoints of the captures in `test_files/`
+SETTINGS = dict(
+    replay.default_settings(),
+    kpts_labels="nose,l_eye,r_eye,l_ear,r_ear,l_shoulder,r_shoulder,l_elbow,r_elbow,l_wrist,r_wrist,l_hip,r_hip,l_knee,r_knee,l_ankle,r_ankle",
+    skeleton="nose-l_eye,nose-r_eye,l_eye-r_eye,l_eye-l_ear,r_eye-r_ear,l_ear-l_shoulder,r_ear-r_shoulder,l_shoulder-r_shoulder,l_shoulder-l_elbow,l_shoulder-l_hip,r_shoulder-r_elbow,r_shoulder-r_hip,l_elbow-l_wrist,r_elbow-r_wrist,l_hip-r_hip,l_knee-l_hip,r_knee-r_hip,l_ankle-l_knee,r_ankle-r_knee",
+)
+
+# Captured frames, with the column mappings of `esp_capture.MAPPINGS`
+CAPTURES = {
+    "object_tracker": "test_files/array_rect_object_tracker_frame_id_180_pingpong.csv",
+    "postprocessing": "test_files/array_rect_postprocessing_frame_id_180_pingpong.csv",
+}
+
+# Synthetic frames for worst-case loads, see `synthetic_events.generate_event` for the arguments
+SYNTHETIC_CAPTURES = {
+    "synthetic_200": {"objects": 200, "track_depth": 30},
+    "synthetic_8k": {"objects": 8, "width": 7680, "height": 4320},
+}
+
+# Synthetic capture for the loading benchmark, see `write_capture`
+LOADING_CAPTURE = {
+    "rows": 200,
+    "objects": 20,
+    "track_depth": 30,
+    "width": 320,
+    "height": 180,
+}
+
+# Input variables with one value per object, per track point and per keypoint
+OBJECT_FIELDS = ["x", "y", "w", "h", "score", "object_id", "object_track_count"]
+TRACK_FIELDS = ["object_track_x", "object_track_y"]
+KEYPOINT_FIELDS = [
+    "object_track_kpts_x",
+    "object_track_kpts_y",
+    "object_track_kpts_score",
+    "object_track_kpts_label_id",
+]
+
+# Long runs of 4K frames for the buffer pool, see `run_buffer_pool`
+BUFFER_POOL_RUNS = {
+    "wide_4k": {"input_image_encoding": "wide", "output_image_encoding": "wide"},
+    "wide_4k_to_1080p": {
+        "input_image_encoding": "wide",
+        "output_image_encoding": "jpg",
+        "output_max_width": "1920",
+    },
+}
+
+# The variant every other variant is compared to
+BASE_VARIANT = {
+    "capture": "object_tracker",
+    "objects": None,  # Number of objects, `None` for the objects of the capture
+    "keypoints": None,  # Keypoints per object, `None` for the keypoints of the capture
+    "resolution": 1.0,  # Scale of the captured frame
+    "input": "jpg",
+    "output": "jpg",
+    "settings": {},
+}
+
+# Changes to the base variant, one sweep per dimension
+SWEEPS = {
+    "capture": ["postprocessing"] + list(SYNTHETIC_CAPTURES),
+    "objects": [1, 10, 50],
+    "keypoints": [0, 5],
+    "resolution": [0.5, 1.5, 3.0],
+    "input": ["png", "wide"],
+    "output": ["png", "wide"],
+    "settings": [
+        {"skeleton": ""},
+        {"show_keypoint_labels": "yes"},
+        {"render_profile": "balanced"},
+        {"render_profile": "fast"},
+        {"pseudonymization": "black_bbox"},
+        {"pseudonymization": "gaussian_blur"},
+        {"pseudonymization": "pixelate"},
+        {"trail_length": "10"},
+        {"max_objects": "10"},
+        {"min_score": "0.5"},
+        {"heatmap": "centers"},
+        {"heatmap": "areas"},
+        {"output_scale": "0.5"},
+        {"input_image_encoding": "wide", "output_image_encoding": "wide"},
+        {"encoder_preset": "speed"},
+        {"encoder_preset": "size"},
+        {"jpeg_backend": "simplejpeg"},
+        {"encoder_preset": "speed", "jpeg_backend": "simplejpeg"},
+    ],
+}
+
+
+def load_capture(path, mapping):
+    """Loads a CSV file written by a File and Socket subscriber as a list of events.
+
+    Args:
+        path (str): Path to the CSV file.
+        mapping (dict): Mapping from CSV columns to _espconfig_ input variables.
+
+    Returns:
+        list[tuple[dict, numpy.ndarray]]: The events without image and their decoded frames.
+    """
+    capture = esp_capture.read_capture(path, mapping)
+    events = []
+    for i in range(len(capture)):
+        data = capture[i]
+        frame = data.pop("image")
+        # Lists, so objects can be joined by `join_objects`
+        data = {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in data.items()}
+        events.append((data, frame))
+    return events
+
+
+def csv_string_to_list(string, output_type=int):
+    """Converts an array cell to a list, like the `pandas.read_csv` converters used before `esp_capture`."""
+    return (
+        list(map(output_type, string.strip("[]").replace("'", "").split(";")))
+        if string != "" and string != "[]"
+        else []
+    )
+
+
+def load_with_converters(path, mapping):
+    """Loads a capture with `pandas.read_csv` and a `csv_string_to_list` converter per array column.
+
+    Returns:
+        pandas.DataFrame: The input variables of the events, with the images as base64 strings.
+    """
+    converters = {
+        column: lambda x, t=int if name in esp_capture.INTEGER_FIELDS else float: (
+            csv_string_to_list(x, t)
+        )
+        for column, name in mapping.items()
+        if name not in ["image", "label"]
+    }
+    df = pd.read_csv(path, converters=converters)
+    return df[[column for column in mapping if column in df]].rename(columns=mapping)
+
+
+def write_capture(path, rows, **kwargs):
+    """Writes synthetic events as a CSV file in the format of a File and Socket subscriber.
+
+    Args:
+        path (str): Path to the CSV file.
+        rows (int): Number of events.
+        **kwargs: Arguments of `synthetic_events.generate_event`.
+    """
+    columns = {
+        name: column for column, name in esp_capture.MAPPINGS["object_tracker"].items()
+    }
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns.values())
+        for data in synthetic_events.generate_events(rows, image_encoding="jpg", **kwargs):
+            row = []
+            for name in columns:
+                value = data[name]
+                if name == "image":
+                    value = base64.b64encode(value).decode()
+                elif name != "label":
+                    value = ";".join(
+                        f"{v:.6f}" if isinstance(v, float) else str(v) for v in value
+                    )
+                    value = f"[{value}]"
+                row.append(value)
+            writer.writerow(row)
+
+
+def run_loading(repeat):
+    """Measures loading a synthetic capture with `esp_capture` and with the `csv_string_to_list` converters.
+
+    Returns:
+        dict: The measurements by loader, with the rows per second and the peak memory in MiB.
+    """
+    mapping = esp_capture.MAPPINGS["object_tracker"]
+    loaders = {
+        "load_converters": load_with_converters,
+        "load_capture": esp_capture.read_capture,
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture.csv")
+        write_capture(path, **LOADING_CAPTURE)
+        for name, load in loaders.items():
+            result = measure(lambda load=load: load(path, mapping), repeat)
+            result["fps"] *= LOADING_CAPTURE["rows"]
+            tracemalloc.start()
+            load(path, mapping)
+            result["peak_mib"] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            results[name] = result
+    return {"loading": results}
+
+
+def generate_capture(**kwargs):
+    """Generates a synthetic event in the format of `load_capture`."""
+    data = next(synthetic_events.generate_events(1, **kwargs))
+    return [(data, data.pop("image"))]
+
+
+def split_objects(data):
+    """Splits the input variables of an event into one dictionary per object.
+
+    Returns:
+        list[dict]: The input variables of every object, with a list per variable.
+    """
+    labels = data["label"].split(SETTINGS["object_label_separator"])
+    track_count = data.get("object_track_count", [1] * len(data["x"]))
+    kpts_count = data.get("object_track_kpts_count", [])
+    objects = []
+    track = kpts_set = kpt = 0
+    for o in range(len(data["x"])):
+        obj = {"label": [labels[o]]}
+        obj.update({name: [data[name][o]] for name in OBJECT_FIELDS if name in data})
+        obj.update(
+            {
+                name: data[name][track : track + track_count[o]]
+                for name in TRACK_FIELDS
+                if name in data
+            }
+        )
+        track += track_count[o]
+        if kpts_count:
+            counts = kpts_count[kpts_set : kpts_set + track_count[o]]
+            obj["object_track_kpts_count"] = counts
+            obj.update(
+                {name: data[name][kpt : kpt + sum(counts)] for name in KEYPOINT_FIELDS}
+            )
+            kpts_set += len(counts)
+            kpt += sum(counts)
+        objects.append(obj)
+    return objects
+
+
+def join_objects(objects):
+    """Joins the dictionaries of `split_objects` into the input variables of an event."""
+    data = {name: [] for name in objects[0]}
+    for obj in objects:
+        for name, values in obj.items():
+            data[name] += values
+    data["label"] = SETTINGS["object_label_separator"].join(data["label"])
+    return data
+
+
+def make_event(data, frame, variant):
+    """Makes the input variables and the frame of a variant from a captured event.
+
+    Objects are repeated and shifted to reach the number of objects of the variant,
+    keypoint sets are truncated to the keypoints per object of the variant, and the frame
+    and all coordinates are scaled to the resolution of the variant.
+
+    Returns:
+        tuple[dict, numpy.ndarray]: The input variables and the frame.
+    """
+    objects = split_objects(data)
+    if variant["objects"] is not None:
+        width = frame.shape[1]
+        repeated = []
+        for i in range(variant["objects"]):
+            obj = {k: list(v) for k, v in objects[i % len(objects)].items()}
+            shift = (i // len(objects)) * 37 % (width // 2)
+            for name in ["x", "object_track_x", "object_track_kpts_x"]:
+                if name in obj:
+                    obj[name] = [(v + shift) % width for v in obj[name]]
+            if "object_id" in obj:
+                obj["object_id"] = [i + 1]
+            repeated.append(obj)
+        objects = repeated
+
+    if variant["keypoints"] is not None:
+        for obj in objects:
+            if "object_track_kpts_count" not in obj:
+                continue
+            keep = []
+            start = 0
+            for count in obj["object_track_kpts_count"]:
+                keep += range(start, start + min(count, variant["keypoints"]))
+                start += count
+            obj["object_track_kpts_count"] = [
+                min(count, variant["keypoints"])
+                for count in obj["object_track_kpts_count"]
+            ]
+            for name in KEYPOINT_FIELDS:
+                obj[name] = [obj[name][k] for k in keep]
+
+    data = join_objects(objects)
+    if variant["keypoints"] == 0:
+        for name in ["object_track_kpts_count"] + KEYPOINT_FIELDS:
+            data.pop(name, None)
+
+    if variant["resolution"] != 1:
+        frame = cv2.resize(
+            frame, None, fx=variant["resolution"], fy=variant["resolution"]
+        )
+        for name in annotation.COORDINATE_FIELDS:
+            if name in data:
+                data[name] = [v * variant["resolution"] for v in data[name]]
+    return data, frame
+
+
+def make_variants(name_filter=""):
+    """Makes the `base` variant and one variant for every change in `SWEEPS`.
+
+    Args:
+        name_filter (str, optional): Only make the variants with this text in their name.
+
+    Returns:
+        dict: The variants by name, in the order of `SWEEPS`.
+    """
+    variants = {"base": BASE_VARIANT}
+    for dimension, values in SWEEPS.items():
+        for value in values:
+            if dimension == "settings":
+                name = ",".join(f"{k}={v}" for k, v in value.items())
+            else:
+                name = f"{dimension}={value}"
+            variants[name] = dict(BASE_VARIANT, **{dimension: value})
+    return {name: v for name, v in variants.items() if name_filter in name}
+
+
+def configure(**settings):
+    """Configures the custom window with the benchmark settings and the given changes."""
+    annotation.SETTINGS = dict(SETTINGS, **settings)
+    annotation.RENDER_PLAN = annotation.compile_render_plan(annotation.SETTINGS)
+    annotation.ENCODER = annotation.compile_encoder(annotation.SETTINGS)
+
+
+def measure(function, repeat):
+    """Calls `function` `repeat` times, after one warm-up call.
+
+    Returns:
+        dict: The median and 99th percentile latency in microseconds and the calls per second.
+    """
+    function()
+    timings = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings[i] = time.perf_counter() - start
+    return {
+        "p50_us": float(np.percentile(timings, 50) * 1e6),
+        "p99_us": float(np.percentile(timings, 99) * 1e6),
+        "fps": float(repeat / timings.sum()),
+    }
+
+
+def run_variant(variant, captures, repeat):
+    """Measures every stage of the custom window for a variant.
+
+    Returns:
+        dict: The measurements per stage, see `measure`. The `encode` stage also has the
+            size of the encoded frame in bytes.
+    """
+    data, frame = make_event(*captures[variant["capture"]][0], variant)
+    # Settings can override the image encodings of the variant
+    configure(
+        **{
+            "input_image_encoding": variant["input"],
+            "output_image_encoding": variant["output"],
+            **variant["settings"],
+        }
+    )
+    input_encoding = annotation.SETTINGS["input_image_encoding"]
+    if input_encoding == "wide":
+        # Writable, so `create` can annotate wide images in place
+        blob = bytearray(image_conversion.opencv_image_to_sas_wide_image(frame))
+    else:
+        blob = cv2.imencode(f".{input_encoding}", frame)[1].tobytes()
+    image, scale = annotation.decode_image(blob)
+    annotated = annotation.annotate(data, image.copy(), scale)
+    event = dict(data, image=blob)
+
+    return {
+        "decode": measure(lambda: annotation.decode_image(blob), repeat),
+        # Includes copying the image, which is small compared to annotating it
+        "annotate": measure(
+            lambda: annotation.annotate(data, image.copy(), scale), repeat
+        ),
+        "encode": dict(
+            measure(lambda: annotation.encode_image(annotated), repeat),
+            bytes_per_frame=len(annotation.encode_image(annotated)),
+        ),
+        "create": measure(lambda: annotation.create(event, None), repeat),
+    }
+
+
+def run_blocks(captures, workers, block_size, repeat):
+    """Measures `create()` for event blocks of the `base` variant, per number of worker threads.
+
+    Returns:
+        dict: The measurements by variant name, with the latency per block and frames per second.
+    """
+    data, frame = make_event(*captures[BASE_VARIANT["capture"]][0], BASE_VARIANT)
+    configure(input_image_encoding="jpg")
+    block = [dict(data, image=cv2.imencode(".jpg", frame)[1].tobytes())] * block_size
+    results = {}
+    for worker_threads in workers:
+        annotation.start_thread_pool(worker_threads)
+        result = measure(lambda: annotation.create(block, None), repeat)
+        result["fps"] *= block_size
+        results[f"worker_threads={worker_threads}"] = {"create_block": result}
+    annotation.start_thread_pool(1)
+    return results
+
+
+def run_processes(captures, processes, block_size, repeat):
+    """Measures `create()` for event blocks of the `synthetic_200` frames, per number of worker processes.
+
+    Returns:
+        dict: The measurements by variant name, with the latency per block and frames per second.
+    """
+    variant = dict(BASE_VARIANT, capture="synthetic_200")
+    data, frame = make_event(*captures[variant["capture"]][0], variant)
+    configure(input_image_encoding="jpg")
+    block = [dict(data, image=cv2.imencode(".jpg", frame)[1].tobytes())] * block_size
+    results = {}
+    for worker_processes in processes:
+        annotation.start_process_pool(worker_processes)
+        result = measure(lambda: annotation.create(block, None), repeat)
+        result["fps"] *= block_size
+        results[f"worker_processes={worker_processes}"] = {"create_block": result}
+    annotation.start_process_pool(0)
+    return results
+
+
+def run_buffer_pool(captures, frames):
+    """Measures long runs of `create()` on 4K frames, with and without the buffer pool.
+
+    The number of image buffers allocated is taken from `STATS`. Allocating and freeing a
+    full-size image maps and unmaps its memory, which shows as minor page faults.
+
+    Returns:
+        dict: The measurements by variant name, with the image buffers allocated and the minor
+            page faults per frame, and the minimum and maximum resident set size in MiB.
+    """
+    data, frame = captures[BASE_VARIANT["capture"]][0]
+    variant = dict(BASE_VARIANT, resolution=3840 / frame.shape[1])
+    data, frame = make_event(data, frame, variant)
+    event = dict(data, image=image_conversion.opencv_image_to_sas_wide_image(frame))
+    results = {}
+    for name, settings in BUFFER_POOL_RUNS.items():
+        for buffer_pool_size in ["0", "4"]:
+            configure(**settings, buffer_pool_size=buffer_pool_size)
+            rss = []
+
+            def create():
+                annotation.create(event, None)
+                rss.append(get_rss_mib())
+
+            misses = annotation.STATS["buffer_pool_misses"]
+            faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+            result = measure(create, frames)
+            faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults
+            misses = annotation.STATS["buffer_pool_misses"] - misses
+            result["buffers_per_frame"] = misses / (frames + 1)
+            result["page_faults_per_frame"] = faults / (frames + 1)
+            result["rss_min_mib"] = min(rss)
+            result["rss_max_mib"] = max(rss)
+            results[f"buffer_pool_size={buffer_pool_size} {name}"] = {
+                "create_run": result
+            }
+    with annotation.BUFFER_POOL_LOCK:
+        annotation.BUFFER_POOL.clear()
+    return results
+
+
+def get_rss_mib():
+    """Helper function to get the resident set size of the benchmark in MiB, on Linux."""
+    with open("/proc/self/statm", "r", encoding="utf-8") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def compare(results, baseline, threshold):
+    """Adds the change of the median latency to a baseline to the results.
+
+    Args:
+        results (dict): The measurements by variant name and stage.
+        baseline (dict): The baseline measurements by variant name and stage.
+        threshold (float): Relative increase of the median latency that is a regression.
+
+    Returns:
+        list[str]: The regressions, as `variant/stage`.
+    """
+    regressions = []
+    for variant, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(variant, {}).get(stage)
+            if base is None:
+                continue
+            result["p50_change"] = result["p50_us"] / base["p50_us"] - 1
+            if result["p50_change"] > threshold:
+                regressions.append(f"{variant}/{stage}")
+    return regressions
+
+
+def print_results(results):
+    """Prints the results as a table, with the change to the baseline when available."""
+    print(
+        f"{'variant':<36} {'stage':<15} {'p50 (us)':>10} {'p99 (us)':>10} {'frames/s':>10} {'p50 change':>11} {'peak (MiB)':>11} {'bytes/frame':>12}"
+    )
+    for variant, stages in results.items():
+        for stage, result in stages.items():
+            change = f"{result['p50_change']:+.1%}" if "p50_change" in result else ""
+            peak = f"{result['peak_mib']:.1f}" if "peak_mib" in result else ""
+            size = str(result["bytes_per_frame"]) if "bytes_per_frame" in result else ""
+            print(
+                f"{variant:<36} {stage:<15} {result['p50_us']:>10.1f} {result['p99_us']:>10.1f} {result['fps']:>10.1f} {change:>11} {peak:>11} {size:>12}"
+            )
+    runs = {
+        variant: stages["create_run"]
+        for variant, stages in results.items()
+        if "create_run" in stages
+    }
+    if runs:
+        print(
+            f"\n{'variant':<36} {'buffers/frame':>14} {'faults/frame':>13} {'RSS min (MiB)':>14} {'RSS max (MiB)':>14}"
+        )
+    for variant, result in runs.items():
+        print(
+            f"{variant:<36} {result['buffers_per_frame']:>14.2f} {result['page_faults_per_frame']:>13.1f} {result['rss_min_mib']:>14.1f} {result['rss_max_mib']:>14.1f}"
+        )
+
+
+def main():
+    """Runs the benchmark, prints the results and optionally saves and compares them."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repeat", type=int, default=100, help="Repetitions per stage and variant"
+    )
+    parser.add_argument(
+        "--workers",
+        default=",".join(str(2**i) for i in range(os.cpu_count().bit_length())),
+        help="Comma separated numbers of worker threads for the event blocks",
+    )
+    parser.add_argument(
+        "--processes",
+        default=",".join(
+            ["0"] + [str(2**i) for i in range(1, os.cpu_count().bit_length())]
+        ),
+        help="Comma separated numbers of worker processes for the event blocks",
+    )
+    parser.add_argument(
+        "--block-size", type=int, default=64, help="Number of events per block"
+    )
+    parser.add_argument(
+        "--pool-frames",
+        type=int,
+        default=1000,
+        help="Number of frames of the long runs with and without the buffer pool",
+    )
+    parser.add_argument(
+        "--filter", default="", help="Only run the variants with this text in their name"
+    )
+    parser.add_argument("--json", help="Save the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative increase of the median latency that is reported as a regression",
+    )
+    args = parser.parse_args()
+
+    captures = {
+        name: load_capture(path, esp_capture.MAPPINGS[name])
+        for name, path in CAPTURES.items()
+    }
+    captures.update(
+        {name: generate_capture(**kwargs) for name, kwargs in SYNTHETIC_CAPTURES.items()}
+    )
+    results = {}
+    for name, variant in make_variants(args.filter).items():
+        results[name] = run_variant(variant, captures, args.repeat)
+    if args.filter in "worker_threads=":
+        results.update(
+            run_blocks(
+                captures,
+                [int(workers) for workers in args.workers.split(",")],
+                args.block_size,
+                max(1, args.repeat // 10),
+            )
+        )
+    if args.filter in "worker_processes=":
+        results.update(
+            run_processes(
+                captures,
+                [int(processes) for processes in args.processes.split(",")],
+                args.block_size,
+                max(1, args.repeat // 10),
+            )
+        )
+    if args.filter in "buffer_pool_size=":
+        results.update(run_buffer_pool(captures, args.pool_frames))
+    if args.filter in "loading":
+        results.update(run_loading(max(1, args.repeat // 10)))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "environment": {
+                        "python": platform.python_version(),
+                        "opencv": cv2.__version__,
+                        "numpy": np.__version__,
+                        "machine": platform.machine(),
+                        "cpu_count": os.cpu_count(),
+                    },
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if regressions:
+        print(f"\nSlower than the baseline by more than {args.threshold:.0%}:")
+        print("\n".join(f"  {regression}" for regression in regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""This file can be used to load CSV files written by a File and Socket subscriber, such as the files in `test_files/`.
+
+Array cells such as `[1.0;2.0;3.0]` are parsed into NumPy arrays a column at a time: the
+cells of a column are joined and tokenized by one `numpy.fromstring` call, and every row
+gets a view of the result. Images stay base64 strings until a row is accessed.
+
+Example:
+    capture = esp_capture.read_capture(path, esp_capture.MAPPINGS["object_tracker"])
+    data = capture[0]  # Input variables of the first event, with the decoded image
+"""
+
+import base64
+import csv
+import sys
+import cv2
+import numpy as np
+import pandas as pd
+
+# Mappings from the columns of a capture to the _espconfig_ input variables
+MAPPINGS = {
+    "object_tracker": {
+        "image": "image",
+        "Object_label": "label",
+        "Object_x": "x",
+        "Object_y": "y",
+        "Object_w": "w",
+        "Object_h": "h",
+        "Object_score": "score",
+        "Object_id": "object_id",
+        "Object_track_count": "object_track_count",
+        "Object_track_x": "object_track_x",
+        "Object_track_y": "object_track_y",
+        "Object_track_kpts_count": "object_track_kpts_count",
+        "Object_track_kpts_x": "object_track_kpts_x",
+        "Object_track_kpts_y": "object_track_kpts_y",
+        "Object_track_kpts_score": "object_track_kpts_score",
+        "Object_track_kpts_label_id": "object_track_kpts_label_id",
+    },
+    "postprocessing": {
+        "image": "image",
+        "Object_labels": "label",
+        "Object_x": "x",
+        "Object_y": "y",
+        "Object_width": "w",
+        "Object_height": "h",
+        "Object_score": "score",
+        "Object_kpts_count": "object_track_kpts_count",
+        "Object_kpts_x": "object_track_kpts_x",
+        "Object_kpts_y": "object_track_kpts_y",
+        "Object_kpts_score": "object_track_kpts_score",
+        "Object_kpts_label_id": "object_track_kpts_label_id",
+    },
+}
+
+# Input variables that contain integers, all other arrays contain doubles
+INTEGER_FIELDS = [
+    "object_id",
+    "object_track_count",
+    "object_track_kpts_count",
+    "object_track_kpts_label_id",
+]
+
+
+def parse_arrays(cells, dtype=np.float64):
+    """Parses ESP array cells into NumPy arrays, with one conversion for all cells.
+
+    Args:
+        cells (list[str]): Array cells such as `[1;2;3]`. Empty cells and `[]` are empty arrays.
+        dtype (numpy.dtype, optional): Type of the values.
+
+    Returns:
+        list[numpy.ndarray]: One array per cell. The arrays are views of one buffer.
+    """
+    bodies = [cell.strip("[]").replace("'", "") for cell in cells]
+    counts = np.array([body.count(";") + 1 if body else 0 for body in bodies])
+    tokens = ";".join(body for body in bodies if body).split(";") if counts.sum() else []
+    try:
+        values = np.array(tokens, dtype=dtype)
+    except ValueError as e:
+        raise ValueError("Array cells contain values that are not numbers") from e
+    return np.split(values, np.cumsum(counts)[:-1])
+
+
+def iter_capture(path, mapping, chunk_rows=256):
+    """Reads a capture in chunks of rows, so captures do not have to fit in memory.
+
+    The array cells of every chunk are parsed a column at a time, see `parse_arrays`.
+    Columns that are not in the mapping are skipped, empty cells are `None`.
+
+    Args:
+        path (str): Path to the CSV file.
+        mapping (dict): Mapping from CSV columns to _espconfig_ input variables.
+        chunk_rows (int, optional): Number of rows to parse at a time.
+
+    Yields:
+        tuple[int, dict]: The row number and the input variables of the event, with the
+            image as base64 string.
+    """
+    csv.field_size_limit(sys.maxsize)  # Images are stored as base64 strings
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        columns = {
+            column: name for column, name in mapping.items() if column in reader.fieldnames
+        }
+        index = 0
+        while True:
+            rows = [row for _, row in zip(range(chunk_rows), reader)]
+            if not rows:
+                return
+            chunk = {}
+            for column, name in columns.items():
+                cells = [row[column] for row in rows]
+                if name != "image" and any(cell.startswith("[") for cell in cells):
+                    dtype = np.int64 if name in INTEGER_FIELDS else np.float64
+                    arrays = parse_arrays(cells, dtype)
+                    cells = [a if c else None for a, c in zip(arrays, cells)]
+                else:
+                    cells = [cell if cell else None for cell in cells]
+                chunk[name] = cells
+            for i in range(len(rows)):
+                yield index, {name: cells[i] for name, cells in chunk.items()}
+                index += 1
+
+
+def read_capture(path, mapping):
+    """Reads a whole capture, see `iter_capture`.
+
+    Returns:
+        Capture: The events of the capture.
+    """
+    return Capture([data for _, data in iter_capture(path, mapping)])
+
+
+def decode_base64_image(image):
+    """Decodes a base64 encoded image to an OpenCV image."""
+    return cv2.imdecode(
+        np.frombuffer(base64.b64decode(image), dtype=np.uint8), cv2.IMREAD_COLOR
+    )
+
+
+class Capture:
+    """The events of a capture, with the images decoded when an event is accessed."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def __len__(self):
+        return len(self.events)
+
+    def __getitem__(self, index):
+        """Returns the input variables of an event, with the image decoded to an OpenCV image."""
+        data = dict(self.events[index])
+        data["image"] = decode_base64_image(data["image"])
+        return data
+
+    def blob(self, index):
+        """Returns the image of an event as encoded in the capture, such as a JPEG image."""
+        return base64.b64decode(self.events[index]["image"])
+
+    def to_dataframe(self):
+        """Returns the events as a DataFrame, with the images as base64 strings."""
+        return pd.DataFrame(self.events)
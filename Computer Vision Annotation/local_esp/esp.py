@@ -0,0 +1,30 @@
+"""Stand-in for the `esp` package of ESP, so the custom window can run outside ESP.
+
+Messages are logged with the `logging` module, with the logging context as logger name.
+Add `local_esp/` to the Python path before importing `annotation`:
+
+    PYTHONPATH=local_esp python -c "import annotation"
+"""
+
+import logging
+
+# ESP log levels and the matching `logging` levels
+LEVELS = {
+    "trace": logging.DEBUG,
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warn": logging.WARNING,
+    "error": logging.ERROR,
+    "fatal": logging.CRITICAL,
+}
+
+
+def logMessage(logcontext, message, level="info"):  # pylint: disable=invalid-name
+    """Logs a message like `esp.logMessage` does in ESP.
+
+    Args:
+        logcontext (str): Logging context, used as logger name.
+        message (str): The message.
+        level (str, optional): ESP log level, see `LEVELS`.
+    """
+    logging.getLogger(logcontext).log(LEVELS[level], message)
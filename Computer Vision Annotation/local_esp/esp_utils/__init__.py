@@ -0,0 +1,3 @@
+"""Stand-in for the `esp_utils` package of ESP, see `image_conversion`."""
+
+from . import image_conversion
@@ -0,0 +1,76 @@
+"""Stand-in for `esp_utils.image_conversion` of ESP, with the wide image format and JPEG and PNG images.
+
+A wide image is an uncompressed OpenCV image with a header of three little-endian 64-bit
+integers: the width, the height and the OpenCV type, followed by the pixels in row-major
+order. The type is numbered like in OpenCV 4 (`16` for `CV_8UC3`), also with OpenCV 5.
+"""
+
+import cv2
+import numpy as np
+
+# Size of the header of a wide image in bytes
+WIDE_HEADER_SIZE = 24
+
+# NumPy types of the OpenCV depths, by `type & 7`
+DEPTHS = [np.uint8, np.int8, np.uint16, np.int16, np.int32, np.float32, np.float64]
+
+
+def sas_wide_image_to_opencv_image(wide_image):
+    """Converts a wide image to an OpenCV image.
+
+    Args:
+        wide_image (bytes): The wide image.
+
+    Returns:
+        numpy.ndarray: The OpenCV image, a copy of the pixels of the wide image.
+
+    Raises:
+        ValueError: If the size of the wide image does not match its header.
+    """
+    width, height, cv_type = np.frombuffer(wide_image, dtype="<i8", count=3)
+    dtype = np.dtype(DEPTHS[cv_type & 7])
+    channels = (cv_type >> 3) + 1
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    if len(wide_image) != WIDE_HEADER_SIZE + height * width * channels * dtype.itemsize:
+        raise ValueError("Size of the wide image does not match its header")
+    return (
+        np.frombuffer(wide_image, dtype=dtype, offset=WIDE_HEADER_SIZE)
+        .reshape(shape)
+        .copy()
+    )
+
+
+def opencv_image_to_sas_wide_image(opencv_image):
+    """Converts an OpenCV image to a wide image.
+
+    Args:
+        opencv_image (numpy.ndarray): The OpenCV image.
+
+    Returns:
+        bytes: The wide image.
+    """
+    height, width = opencv_image.shape[:2]
+    channels = opencv_image.shape[2] if opencv_image.ndim == 3 else 1
+    depth = DEPTHS.index(opencv_image.dtype.type)
+    header = np.array([width, height, depth + ((channels - 1) << 3)], dtype="<i8")
+    return header.tobytes() + np.ascontiguousarray(opencv_image).tobytes()
+
+
+def blob_image_to_opencv_image(blob_image):
+    """Decodes a JPEG or PNG image to an OpenCV image with 3 channels."""
+    return cv2.imdecode(np.frombuffer(blob_image, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def opencv_image_to_blob_image(
+    opencv_image, type=".jpg"
+):  # pylint: disable=redefined-builtin
+    """Encodes an OpenCV image to a JPEG or PNG image.
+
+    Args:
+        opencv_image (numpy.ndarray): The OpenCV image.
+        type (str, optional): `.jpg` or `.png`.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    return cv2.imencode(type, opencv_image)[1].tobytes()
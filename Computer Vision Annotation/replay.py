@@ -0,0 +1,229 @@
+"""This file can be used to annotate a whole ESP capture offline, with the same settings as the custom window.
+
+It reads a CSV file written by a File and Socket subscriber, such as the files in
+`test_files/`, in chunks of rows with `esp_capture.py`, so captures do not have to fit in memory. The columns are
+renamed to the `_espconfig_` input variables with a mapping preset or `--map` options.
+The frames are annotated by a pool of processes with `annotation.annotate()` and written
+as numbered images to a directory, or as an MJPG video to an `.avi` file.
+
+The settings are the `_espconfig_` defaults, changed with `--setting` options. They are
+validated and applied with `annotation.init()`, in this process and in every worker. The
+images of a capture are JPEG or PNG, so `input_image_encoding` is always `jpg`. Rows
+with invalid detections are logged and skipped. With a `heatmap`, the rows are annotated by
+a single worker, as the heatmap of a camera accumulates its frames in order.
+
+Usage: python replay.py CAPTURE OUTPUT [--mapping object_tracker] [--map COLUMN=VARIABLE]
+                        [--setting NAME=VALUE] [--workers N] [--fps 30] [--image-format jpg]
+"""
+
+import argparse
+import base64
+import multiprocessing
+import os
+import sys
+import threading
+import cv2
+
+# Use the stand-ins for the ESP packages, so `init()` can run outside ESP
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_esp")
+)
+import annotation  # pylint: disable=wrong-import-position
+import esp_capture
+
+# Rows that are read, but not written yet, per worker process
+ROWS_IN_FLIGHT_PER_WORKER = 4
+
+# Output of the worker processes, see `start_worker`
+OUTPUT = ""
+IMAGE_FORMAT = "jpg"
+
+
+def default_settings():
+    """Returns the default settings of the custom window, from the `_espconfig_` initialization."""
+    return {
+        field["name"]: field["default"]
+        for field in annotation._espconfig_[  # pylint: disable=protected-access
+            "initialization"
+        ]["fields"]
+    }
+
+
+def start_worker(settings, output, image_format):
+    """Initializes the custom window in a worker process, see `annotation.init`."""
+    global OUTPUT
+    global IMAGE_FORMAT
+
+    annotation.init(settings)
+    OUTPUT = output
+    IMAGE_FORMAT = image_format
+
+
+def annotate_row(row):
+    """Annotates the frame of one row, in a worker process.
+
+    The frame is decoded and downscaled like in the custom window, see `annotation.decode_image`.
+    Rows with invalid detections are logged and skipped, see `annotation.DetectionBatch`.
+
+    Args:
+        row (tuple[int, dict]): The row number and the input variables, see `esp_capture.iter_capture`.
+
+    Returns:
+        tuple[int, numpy.ndarray | None, bool]: The row number, the annotated frame and
+            whether the row is annotated. When writing images, the image is written by the
+            worker and `None` is returned.
+    """
+    index, data = row
+    # The heatmap reads the input image size from the image
+    data = dict({"x": None}, **data)
+    data["image"] = base64.b64decode(data["image"])
+    frame, scale = annotation.decode_image(data["image"])
+    if annotation.RENDER_PLAN["heatmap"] != "none":
+        annotation.add_to_heatmap(data)
+    try:
+        batch = annotation.DetectionBatch(data, scale)
+    except ValueError as e:
+        annotation.esp.logMessage(
+            logcontext=annotation.LOGGING_CONTEXT,
+            message=f"Skipping row {index} with invalid detections: {e}",
+            level="warn",
+        )
+        annotation.release_buffer(frame)
+        return index, None, False
+    # Also on frames without detections, like in the custom window
+    annotation.draw_heatmap(data, frame, scale, {})
+    if len(batch.boxes) > 0:
+        frame = annotation.annotate(batch, frame, scale)
+
+    if OUTPUT.endswith(".avi"):
+        return index, frame, True
+    cv2.imwrite(os.path.join(OUTPUT, f"frame_{index:06d}.{IMAGE_FORMAT}"), frame)
+    annotation.release_buffer(frame)
+    return index, None, True
+
+
+def replay(path, output, mapping, settings, workers=1, fps=30.0, image_format="jpg"):
+    """Annotates all frames of a capture and writes them as images or as a video.
+
+    Args:
+        path (str): Path to the capture.
+        output (str): Directory for numbered images, or path of an `.avi` video.
+        mapping (dict): Mapping from CSV columns to _espconfig_ input variables.
+        settings (dict): The settings of the custom window.
+        workers (int, optional): Number of worker processes.
+        fps (float, optional): Frames per second of the video.
+        image_format (str, optional): `jpg` or `png` for numbered images.
+
+    Returns:
+        int: The number of frames, without the skipped rows.
+
+    Raises:
+        ValueError: If the settings are not valid, see `annotation.init`.
+    """
+    settings = dict(settings, input_image_encoding="jpg")
+    annotation.error = False
+    annotation.init(settings)
+    if annotation.error:
+        raise ValueError("Invalid settings of the custom window, see the log")
+    if settings["heatmap"] != "none":
+        workers = 1
+    if not output.endswith(".avi"):
+        os.makedirs(output, exist_ok=True)
+    writer = None
+    frames = 0
+    # The pool reads rows ahead of the results, so the rows in flight are limited
+    in_flight = threading.Semaphore(workers * ROWS_IN_FLIGHT_PER_WORKER)
+
+    def rows():
+        for row in esp_capture.iter_capture(path, mapping):
+            in_flight.acquire()  # pylint: disable=consider-using-with
+            yield row
+
+    # Spawned, as `init()` started the threads of the custom window in this process
+    with multiprocessing.get_context("spawn").Pool(
+        workers, initializer=start_worker, initargs=(settings, output, image_format)
+    ) as pool:
+        # Results are returned in the order of the rows
+        for _, frame, annotated in pool.imap(annotate_row, rows()):
+            in_flight.release()
+            if not annotated:
+                continue
+            if frame is not None:
+                if writer is None:
+                    writer = cv2.VideoWriter(
+                        output,
+                        cv2.VideoWriter_fourcc(*"MJPG"),
+                        fps,
+                        (frame.shape[1], frame.shape[0]),
+                    )
+                writer.write(frame)
+            frames += 1
+    if writer is not None:
+        writer.release()
+    return frames
+
+
+def main():
+    """Parses the command line and replays the capture."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="CSV file written by a File and Socket subscriber")
+    parser.add_argument(
+        "output", help="Directory for numbered images, or an .avi file for an MJPG video"
+    )
+    parser.add_argument(
+        "--mapping",
+        choices=esp_capture.MAPPINGS,
+        default="object_tracker",
+        help="Mapping preset from CSV columns to input variables",
+    )
+    parser.add_argument(
+        "--map",
+        action="append",
+        default=[],
+        metavar="COLUMN=VARIABLE",
+        help="Map a CSV column to an input variable, in addition to the mapping preset",
+    )
+    parser.add_argument(
+        "--setting",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Change a setting of the custom window",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--fps", type=float, default=30.0, help="Frames per second of the video"
+    )
+    parser.add_argument(
+        "--image-format", choices=["jpg", "png"], default="jpg", help="Format of the images"
+    )
+    args = parser.parse_args()
+
+    mapping = dict(esp_capture.MAPPINGS[args.mapping])
+    mapping.update(dict(item.split("=", 1) for item in args.map))
+    settings = default_settings()
+    for item in args.setting:
+        name, value = item.split("=", 1)
+        if name not in settings:
+            parser.error(f"Unknown setting `{name}`")
+        settings[name] = value
+
+    try:
+        frames = replay(
+            args.capture,
+            args.output,
+            mapping,
+            settings,
+            args.workers,
+            args.fps,
+            args.image_format,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Annotated {frames} frame(s) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""This file can be used to generate synthetic events for the computer vision annotation custom window.
+
+The events have the layout of the `_espconfig_` input variables of `annotation.py`, like
+the events of an Object Tracker window (with `track_depth` above 0) or of a
+post-processing window (with `track_depth` of 0). The number of objects, keypoints per
+object, track depth and resolution can be set, so worst-case loads can be tested that
+are not in the captures in `test_files/`. Events with the same seed are identical.
+
+Example:
+    import synthetic_events
+    for data in synthetic_events.generate_events(10, objects=200, track_depth=30, seed=1):
+        annotation.create(data, None)
+"""
+
+import cv2
+import numpy as np
+
+LABELS = ["person", "car", "bicycle", "dog"]
+ATTRIBUTES = ["walking", "standing", "running", "sitting"]
+
+# Keypoint labels of the `kpts_labels` setting in `test.py`, COCO keypoint order
+KPTS_LABELS = "nose,l_eye,r_eye,l_ear,r_ear,l_shoulder,r_shoulder,l_elbow,r_elbow,l_wrist,r_wrist,l_hip,r_hip,l_knee,r_knee,l_ankle,r_ankle"
+
+
+def generate_image(rng, width, height, image_encoding="array"):
+    """Generates a smooth random image, which compresses like a camera frame.
+
+    Args:
+        rng (numpy.random.Generator): The random number generator.
+        width (int): Width of the image.
+        height (int): Height of the image.
+        image_encoding (str, optional): `array` for an OpenCV image, `jpg` or `png` for an encoded image.
+
+    Returns:
+        numpy.ndarray | bytes: The image.
+    """
+    coarse = rng.integers(0, 256, (9, 16, 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    image = cv2.add(image, rng.integers(0, 8, image.shape, dtype=np.uint8))  # Sensor noise
+    if image_encoding == "array":
+        return image
+    if image_encoding not in ["jpg", "png"]:
+        raise ValueError(f"Image encoding `{image_encoding}` is not supported")
+    return cv2.imencode(f".{image_encoding}", image)[1].tobytes()
+
+
+def generate_event(
+    rng,
+    objects=2,
+    keypoints=17,
+    track_depth=10,
+    width=1280,
+    height=720,
+    image_encoding="array",
+    attributes=False,
+    label_separator=",",
+):
+    """Generates the input variables of one event.
+
+    Args:
+        rng (numpy.random.Generator): The random number generator.
+        objects (int, optional): Number of detected objects.
+        keypoints (int, optional): Keypoints per track point, `0` for no keypoint fields.
+            At most 17, the number of `KPTS_LABELS`.
+        track_depth (int, optional): Track points per object. With `0`, the object tracking
+            fields (`object_id`, `object_track_count`, `object_track_x`, `object_track_y`)
+            are left out and there is one keypoint set per object.
+        width (int, optional): Width of the image.
+        height (int, optional): Height of the image.
+        image_encoding (str, optional): `array` for an OpenCV image, `jpg` or `png` for an encoded image.
+        attributes (bool, optional): Whether to add the `attribute` field.
+        label_separator (str, optional): Separator of the `label` and `attribute` fields.
+
+    Returns:
+        dict: The input variables, with the lists and delimited strings ESP passes to `create()`.
+    """
+    if keypoints > len(KPTS_LABELS.split(",")):
+        raise ValueError(f"At most {len(KPTS_LABELS.split(','))} keypoints are supported")
+
+    w = rng.uniform(0.05, 0.2, objects) * width
+    h = rng.uniform(0.1, 0.5, objects) * height
+    x = rng.uniform(0, 1, objects) * (width - w)
+    y = rng.uniform(0, 1, objects) * (height - h)
+    data = {
+        "image": generate_image(rng, width, height, image_encoding),
+        "label": label_separator.join(rng.choice(LABELS, objects)),
+        "x": x.tolist(),
+        "y": y.tolist(),
+        "w": w.tolist(),
+        "h": h.tolist(),
+        "score": rng.uniform(0.3, 1, objects).tolist(),
+    }
+    if attributes:
+        data["attribute"] = label_separator.join(rng.choice(ATTRIBUTES, objects))
+
+    sets_per_object = max(track_depth, 1)
+    if track_depth > 0:
+        # Tracks walk to the center of the box, oldest point first
+        steps = rng.normal(0, 0.005 * width, (objects, track_depth, 2))
+        steps[:, -1] = 0
+        walk = np.cumsum(steps[:, ::-1], axis=1)[:, ::-1]
+        data["object_id"] = list(range(1, objects + 1))
+        data["object_track_count"] = [track_depth] * objects
+        data["object_track_x"] = ((x + w / 2)[:, None] - walk[..., 0]).ravel().tolist()
+        data["object_track_y"] = ((y + h / 2)[:, None] - walk[..., 1]).ravel().tolist()
+
+    if keypoints > 0:
+        sets = objects * sets_per_object
+        # Keypoints are spread over the box of their object
+        box = np.repeat(np.stack([x, y, w, h], axis=1), sets_per_object, axis=0)
+        position = rng.uniform(0, 1, (sets, keypoints, 2))
+        kpts_x = box[:, None, 0] + position[..., 0] * box[:, None, 2]
+        kpts_y = box[:, None, 1] + position[..., 1] * box[:, None, 3]
+        data["object_track_kpts_count"] = [keypoints] * sets
+        data["object_track_kpts_x"] = kpts_x.ravel().tolist()
+        data["object_track_kpts_y"] = kpts_y.ravel().tolist()
+        data["object_track_kpts_score"] = rng.uniform(0.3, 1, sets * keypoints).tolist()
+        data["object_track_kpts_label_id"] = np.tile(np.arange(keypoints), sets).tolist()
+    return data
+
+
+def generate_events(count, seed=0, **kwargs):
+    """Generates the input variables of `count` events, see `generate_event` for the arguments.
+
+    Args:
+        count (int): Number of events.
+        seed (int, optional): Seed of the random number generator.
+
+    Yields:
+        dict: The input variables of an event.
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        yield generate_event(rng, **kwargs)
@@ -6,14 +6,28 @@ uses data from w_postprocess and w_object_tracker from this example: https://git
 
 import inspect
 import base64
+import os
+import queue
+import tempfile
 import unittest
+import unittest.mock
 import numpy as np
 import cv2
 import pandas as pd
 import re
-import annotation
-
-annotation.SETTINGS = {
+import subprocess
+import sys
+
+# Use the stand-ins for the ESP packages, so `init()` and `create()` can run outside ESP
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_esp")
+)
+import annotation  # pylint: disable=wrong-import-position
+import synthetic_events
+import replay
+import esp_capture
+
+SETTINGS = {
     "pseudonymization": "none",
     "input_image_encoding": "wide",
     "output_image_encoding": "jpg",
@@ -22,7 +36,62 @@ annotation.SETTINGS = {
     # "kpts_labels": "",
     "skeleton": "nose-l_eye,nose-r_eye,l_eye-r_eye,l_eye-l_ear,r_eye-r_ear,l_ear-l_shoulder,r_ear-r_shoulder,l_shoulder-r_shoulder,l_shoulder-l_elbow,l_shoulder-l_hip,r_shoulder-r_elbow,r_shoulder-r_hip,l_elbow-l_wrist,r_elbow-r_wrist,l_hip-r_hip,l_knee-l_hip,r_knee-r_hip,l_ankle-l_knee,r_ankle-r_knee",
     "show_keypoint_labels": "no",
+    "render_profile": "quality",
+    "label_cache_size": "1024",
+    "buffer_pool_size": "4",
+    "worker_threads": "1",
+    "worker_processes": "0",
+    "process_slots": "8",
+    "process_slot_mb": "24",
+    "encoder_preset": "default",
+    "jpeg_quality": "",
+    "jpeg_chroma_subsampling": "preset",
+    "jpeg_progressive": "preset",
+    "jpeg_optimize": "preset",
+    "png_compression": "",
+    "jpeg_backend": "opencv",
+    "output_scale": "1",
+    "output_max_width": "0",
+    "max_output_fps": "0",
+    "annotate_every_n": "1",
+    "skip_mode": "drop",
+    "min_score": "0",
+    "max_objects": "0",
+    "min_box_area": "0",
+    "trail_length": "0",
+    "trail_fade": "yes",
+    "heatmap": "none",
+    "heatmap_output": "blend",
+    "heatmap_cell_size": "16",
+    "heatmap_half_life": "300",
+    "segment_directory": "",
+    "segment_seconds": "60",
+    "segment_max_mb": "0",
+    "segment_fps": "10",
+    "segment_queue_size": "64",
+    "instrumentation": "no",
+    "instrumentation_log_events": "1000",
+    "instrumentation_log_seconds": "60",
+    "timing_fields": "no",
+    "warm_up": "no",
+    "warm_up_width": "1920",
+    "warm_up_height": "1080",
+    "warm_up_labels": "",
 }
+annotation.SETTINGS = dict(SETTINGS)
+SKELETON = annotation.SETTINGS["skeleton"]
+ENCODER_SETTINGS = [
+    "output_image_encoding",
+    "encoder_preset",
+    "jpeg_quality",
+    "jpeg_chroma_subsampling",
+    "jpeg_progressive",
+    "jpeg_optimize",
+    "png_compression",
+    "jpeg_backend",
+]
+annotation.RENDER_PLAN = annotation.compile_render_plan(annotation.SETTINGS)
+annotation.ENCODER = annotation.compile_encoder(annotation.SETTINGS)
 espconfig = annotation._espconfig_  # pylint: disable=protected-access
 
 
@@ -148,6 +217,1523 @@ class TestEspConfigValidation(unittest.TestCase):
         )
 
 
+class TestRenderPlan(unittest.TestCase):
+    """Test class to validate the render plan compiled from the settings."""
+
+    def test_skeleton_edges(self):
+        """Tests that skeleton pairs are compiled into pairs of label IDs."""
+        plan = annotation.compile_render_plan(
+            dict(annotation.SETTINGS, skeleton="nose-l_eye,r_knee-r_hip")
+        )
+        self.assertEqual(plan["skeleton_edges"], [(0, 1), (14, 12)])
+
+    def test_unknown_skeleton_labels(self):
+        """Tests that skeleton pairs with unknown or missing keypoint labels are left out."""
+        plan = annotation.compile_render_plan(
+            dict(annotation.SETTINGS, skeleton="nose-tail,nose,nose-l_eye")
+        )
+        self.assertEqual(plan["skeleton_edges"], [(0, 1)])
+        plan = annotation.compile_render_plan(
+            dict(annotation.SETTINGS, kpts_labels="")
+        )
+        self.assertEqual(plan["skeleton_edges"], [])
+
+    def test_right_body_parts(self):
+        """Tests that right body parts are flagged to be drawn as rectangles."""
+        plan = annotation.compile_render_plan(annotation.SETTINGS)
+        self.assertFalse(plan["kpts_is_right"][plan["kpts_labels"].index("l_eye")])
+        self.assertTrue(plan["kpts_is_right"][plan["kpts_labels"].index("r_eye")])
+
+
+class TestKeypointDecoding(unittest.TestCase):
+    """Test class to validate decoding of the flat keypoint arrays."""
+
+    def test_last_track_per_object(self):
+        """Tests that only the keypoints of the last track of every object are kept."""
+        kpts = annotation.decode_keypoints(
+            2, [2, 1], [2, 3, 1], range(6), range(10, 16), [0.5] * 6, [0, 1, 0, 1, 2, 6]
+        )
+        self.assertEqual(kpts["object_index"].tolist(), [0, 0, 0, 1])
+        self.assertEqual(kpts["points"].tolist(), [[2, 12], [3, 13], [4, 14], [5, 15]])
+        self.assertEqual(kpts["label_id"].tolist(), [0, 1, 2, 6])
+        self.assertEqual(kpts["is_right"].tolist(), [False, False, True, True])
+
+    def test_one_track_per_object(self):
+        """Tests that one track per object is assumed without `object_track_count`."""
+        kpts = annotation.decode_keypoints(
+            2, None, [1, 2], [1.9, 2.0, 3.0], [0, 0, 0], [1, 1, 1], [0, 0, 1]
+        )
+        self.assertEqual(kpts["object_index"].tolist(), [0, 1, 1])
+        self.assertEqual(kpts["points"][:, 0].tolist(), [1, 2, 3])
+
+    def test_skeleton_segments(self):
+        """Tests that skeleton edges are resolved per object and missing keypoints are skipped."""
+        update_settings(skeleton="nose-l_eye,nose-r_eye")
+        try:
+            kpts = annotation.decode_keypoints(
+                2, None, [2, 2], [0, 1, 2, 3], [0, 0, 0, 0], [1] * 4, [0, 1, 0, 2]
+            )
+            segments = annotation.skeleton_segments(kpts, 3)
+        finally:
+            update_settings(skeleton=SKELETON)
+        self.assertEqual(segments[0].tolist(), [[[0, 0], [1, 0]]])
+        self.assertEqual(segments[1].tolist(), [[[2, 0], [3, 0]]])
+        self.assertIsNone(segments[2])
+
+
+class TestLabelCache(unittest.TestCase):
+    """Test class to validate the cache of pre-rendered labels."""
+
+    def setUp(self):
+        annotation.LABEL_CACHE.clear()
+        update_settings(label_cache_size="2")
+
+    def tearDown(self):
+        annotation.LABEL_CACHE.clear()
+        update_settings(label_cache_size=SETTINGS["label_cache_size"])
+
+    def test_hits_and_misses(self):
+        """Tests that repeated labels are taken from the cache."""
+        hits = annotation.STATS["label_cache_hits"]
+        misses = annotation.STATS["label_cache_misses"]
+        image = np.zeros((100, 100, 3), dtype=np.uint8)
+        for _ in range(3):
+            annotation.draw_bbox(image, (10, 50), (60, 90), "#1 person (93%)", (0, 0, 0))
+        self.assertEqual(annotation.STATS["label_cache_hits"] - hits, 2)
+        self.assertEqual(annotation.STATS["label_cache_misses"] - misses, 1)
+
+    def test_cache_size(self):
+        """Tests that the least recently used labels are removed from the cache."""
+        for text in ["a", "b", "a", "c"]:
+            annotation.get_label_sprite(text, (0, 0, 0), annotation.FONT_SCALE, 1)
+        self.assertEqual([key[0] for key in annotation.LABEL_CACHE], ["a", "c"])
+
+    def test_label_clipped_to_image(self):
+        """Tests that labels partially outside the image are clipped."""
+        image = np.zeros((100, 100, 3), dtype=np.uint8)
+        annotation.draw_bbox(image, (-20, 5), (30, 40), "#1 person (93%)", (255, 255, 255))
+        self.assertTrue(image[:5, :10].any())
+        annotation.draw_bbox(image, (95, 95), (150, 150), "#1 person (93%)", (255, 255, 255))
+        self.assertTrue(image[90:, 95:].any())
+
+
+class TestBufferPool(unittest.TestCase):
+    """Test class to validate the pool of reusable image buffers."""
+
+    def setUp(self):
+        annotation.BUFFER_POOL.clear()
+        update_settings(
+            input_image_encoding="wide",
+            output_image_encoding="wide",
+            buffer_pool_size="1",
+        )
+        image = np.random.default_rng(0).integers(0, 256, (60, 80, 3), dtype=np.uint8)
+        self.blob = annotation.esp_utils.image_conversion.opencv_image_to_sas_wide_image(
+            image
+        )
+        self.data = {
+            "image": self.blob,
+            "label": "person",
+            "x": [10],
+            "y": [10],
+            "w": [30],
+            "h": [20],
+            "score": [0.9],
+        }
+
+    def tearDown(self):
+        annotation.BUFFER_POOL.clear()
+        update_settings(
+            input_image_encoding=SETTINGS["input_image_encoding"],
+            output_image_encoding=SETTINGS["output_image_encoding"],
+            buffer_pool_size=SETTINGS["buffer_pool_size"],
+        )
+
+    def test_buffers_reused(self):
+        """Tests that decoded images are reused by the next events, with the same output."""
+        update_settings(buffer_pool_size="0")
+        expected = annotation.create(self.data, None)["annotated_image"]
+        update_settings(buffer_pool_size="1")
+        hits = annotation.STATS["buffer_pool_hits"]
+        misses = annotation.STATS["buffer_pool_misses"]
+        for _ in range(3):
+            event = annotation.create(self.data, None)
+            self.assertEqual(event["annotated_image"], expected)
+        self.assertEqual(annotation.STATS["buffer_pool_hits"] - hits, 2)
+        self.assertEqual(annotation.STATS["buffer_pool_misses"] - misses, 1)
+
+    def test_downscaled_wide_image(self):
+        """Tests that a downscaled wide image is resized into a pooled buffer without changing the input."""
+        update_settings(output_scale="0.5")
+        try:
+            for _ in range(2):
+                image, scale = annotation.decode_image(self.blob)
+                self.assertEqual((image.shape, scale), ((30, 40, 3), 0.5))
+                annotation.release_buffer(image)
+            self.assertIs(annotation.decode_image(self.blob)[0], image)
+        finally:
+            update_settings(output_scale=SETTINGS["output_scale"])
+
+    def test_views_not_kept(self):
+        """Tests that images sharing memory, such as wide images annotated in place, are not pooled."""
+        image = annotation.take_buffer((60, 80, 3), np.uint8)
+        annotation.release_buffer(image[10:])
+        annotation.release_buffer(annotation.view_wide_image(bytearray(self.blob)))
+        self.assertEqual(annotation.BUFFER_POOL[((60, 80, 3), "|u1")], [])
+
+    def test_encode_wide_image(self):
+        """Tests that wide images are encoded like `opencv_image_to_sas_wide_image` does."""
+        conversion = annotation.esp_utils.image_conversion
+        for image in [
+            np.arange(60 * 80 * 3, dtype=np.uint8).reshape(60, 80, 3),
+            np.zeros((60, 80), dtype=np.uint8),
+            np.zeros((60, 80, 3), dtype=np.float32),
+        ]:
+            with self.subTest(shape=image.shape, dtype=image.dtype):
+                self.assertEqual(
+                    annotation.encode_wide_image(image),
+                    conversion.opencv_image_to_sas_wide_image(image),
+                )
+
+
+class TestPassthrough(unittest.TestCase):
+    """Test class to validate that frames without detections are passed through."""
+
+    def test_passthrough_without_detections(self):
+        """Tests that the input image is returned untouched when there is nothing to draw."""
+        update_settings(input_image_encoding="jpg", output_image_encoding="jpg")
+        try:
+            blob = b"\xff\xd8 not decoded"
+            for x in [None, []]:
+                with self.subTest(x=x):
+                    passthrough_frames = annotation.STATS["passthrough_frames"]
+                    event = annotation.create({"image": blob, "x": x}, None)
+                    self.assertIs(event["annotated_image"], blob)
+                    self.assertEqual(
+                        annotation.STATS["passthrough_frames"], passthrough_frames + 1
+                    )
+        finally:
+            update_settings(
+                input_image_encoding=SETTINGS["input_image_encoding"],
+                output_image_encoding=SETTINGS["output_image_encoding"],
+            )
+
+
+class TestDownscaling(unittest.TestCase):
+    """Test class to validate the downscaled output mode."""
+
+    def setUp(self):
+        update_settings(input_image_encoding="jpg")
+        self.image = np.zeros((480, 640, 3), dtype=np.uint8)
+
+    def tearDown(self):
+        update_settings(
+            input_image_encoding=SETTINGS["input_image_encoding"],
+            output_scale=SETTINGS["output_scale"],
+            output_max_width=SETTINGS["output_max_width"],
+        )
+
+    def test_blob_image_size(self):
+        """Tests that the image size is read from JPEG and PNG headers."""
+        for extension in [".jpg", ".png"]:
+            with self.subTest(extension=extension):
+                blob = cv2.imencode(extension, self.image)[1].tobytes()
+                self.assertEqual(annotation.get_blob_image_size(blob), (640, 480))
+        self.assertIsNone(annotation.get_blob_image_size(b"not an image"))
+
+    def test_reduced_decode(self):
+        """Tests that JPEG images are decoded to the output size."""
+        blob = cv2.imencode(".jpg", self.image)[1].tobytes()
+        for settings, shape in [
+            ({"output_scale": "0.25"}, (120, 160, 3)),
+            ({"output_scale": "0.3"}, (144, 192, 3)),
+            ({"output_max_width": "320"}, (240, 320, 3)),
+            ({"output_scale": "0.5", "output_max_width": "1280"}, (240, 320, 3)),
+        ]:
+            with self.subTest(settings=settings):
+                update_settings(
+                    **dict({"output_scale": "1", "output_max_width": "0"}, **settings)
+                )
+                image, _ = annotation.decode_image(blob)
+                self.assertEqual(image.shape, shape)
+
+    def test_png_full_size_decode(self):
+        """Tests that PNG images are decoded at full size and only resized with `INTER_AREA`."""
+        update_settings(input_image_encoding="png", output_scale="0.5")
+        image = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+        blob = cv2.imencode(".png", image)[1].tobytes()
+        expected = cv2.resize(image, (320, 240), interpolation=cv2.INTER_AREA)
+        with unittest.mock.patch.object(
+            annotation.cv2, "imdecode", wraps=cv2.imdecode
+        ) as imdecode:
+            np.testing.assert_array_equal(annotation.decode_image(blob)[0], expected)
+        self.assertEqual(imdecode.call_args.args[1], cv2.IMREAD_COLOR)
+
+    def test_scaled_annotate(self):
+        """Tests that the coordinates are scaled to the downscaled image."""
+        data = {
+            "label": "person",
+            "x": [400.0],
+            "y": [200.0],
+            "w": [200.0],
+            "h": [200.0],
+            "score": [0.9],
+        }
+        image = annotation.annotate(data, np.zeros((240, 320, 3), dtype=np.uint8), 0.5)
+        self.assertTrue(image[100:201, 200, :].any())  # Left edge of the box
+        self.assertFalse(image[202:, :, :].any())  # Below the box
+        self.assertEqual(data["x"], [400.0])
+
+    def test_scaled_labels(self):
+        """Tests that labels shrink with the output scale down to a minimum, with one sprite per font scale."""
+        style = annotation.get_overlay_style(1.0)
+        self.assertEqual(style["font_scale"], annotation.FONT_SCALE)
+        self.assertEqual(annotation.get_overlay_style(0.8)["font_scale"], 0.24)
+        for scale in [0.5, 0.25]:
+            style = annotation.get_overlay_style(scale)
+            self.assertEqual(style["font_scale"], annotation.MIN_FONT_SCALE)
+            self.assertEqual(style["thickness"], annotation.MIN_THICKNESS)
+
+        data = {
+            "label": "person",
+            "x": [40.0],
+            "y": [40.0],
+            "w": [200.0],
+            "h": [200.0],
+            "score": [0.9],
+        }
+        annotation.LABEL_CACHE.clear()
+        for scale in [1.0, 0.5, 0.25]:
+            annotation.annotate(data, np.zeros((480, 640, 3), dtype=np.uint8), scale)
+        font_scales = {key[3] for key in annotation.LABEL_CACHE}
+        self.assertEqual(font_scales, {annotation.FONT_SCALE, annotation.MIN_FONT_SCALE})
+
+
+class TestEventBlocks(unittest.TestCase):
+    """Test class to validate processing of event blocks."""
+
+    def setUp(self):
+        update_settings(input_image_encoding="jpg", output_image_encoding="jpg")
+
+    def tearDown(self):
+        annotation.start_thread_pool(1)
+        update_settings(
+            input_image_encoding=SETTINGS["input_image_encoding"],
+            output_image_encoding=SETTINGS["output_image_encoding"],
+        )
+
+    def test_block_order(self):
+        """Tests that the output events are in the same order as the input events."""
+        block = [{"image": f"frame {i}".encode(), "x": []} for i in range(50)]
+        for worker_threads in [1, 4]:
+            with self.subTest(worker_threads=worker_threads):
+                annotation.start_thread_pool(worker_threads)
+                events = annotation.create(block, None)
+                self.assertEqual(
+                    [event["annotated_image"] for event in events],
+                    [data["image"] for data in block],
+                )
+
+    def test_single_event(self):
+        """Tests that a single event is processed without a block."""
+        event = annotation.create({"image": b"frame", "x": None}, None)
+        self.assertEqual(event["annotated_image"], b"frame")
+
+
+class TestFrameRateLimiting(unittest.TestCase):
+    """Test class to validate the frame-rate limiting per camera."""
+
+    def setUp(self):
+        update_settings(input_image_encoding="jpg", output_image_encoding="jpg")
+        annotation.CAMERA_STATE.clear()
+        annotation.STATS["skipped_frames"].clear()
+
+    def tearDown(self):
+        update_settings(
+            input_image_encoding=SETTINGS["input_image_encoding"],
+            output_image_encoding=SETTINGS["output_image_encoding"],
+            max_output_fps=SETTINGS["max_output_fps"],
+            annotate_every_n=SETTINGS["annotate_every_n"],
+            skip_mode=SETTINGS["skip_mode"],
+        )
+
+    def test_annotate_every_n(self):
+        """Tests that every n-th frame of every camera is processed."""
+        update_settings(annotate_every_n="3")
+        block = [
+            {"image": f"{camera} {i}".encode(), "x": [], "camera_id": camera}
+            for i in range(6)
+            for camera in ["a", "b"]
+        ]
+        events = annotation.create(block, None)
+        self.assertEqual(
+            [event["annotated_image"] for event in events],
+            [b"a 0", b"b 0", b"a 3", b"b 3"],
+        )
+        self.assertEqual(annotation.STATS["skipped_frames"], {"a": 4, "b": 4})
+
+    def test_max_output_fps(self):
+        """Tests that frames within the minimum interval of a camera are skipped."""
+        update_settings(max_output_fps="10", skip_mode="passthrough")
+        passthrough_frames = annotation.STATS["passthrough_frames"]
+        with unittest.mock.patch.object(annotation.time, "monotonic") as monotonic:
+            skipped = []
+            for now in [0.0, 0.05, 0.1, 0.12, 0.35, 0.4, 0.44]:
+                monotonic.return_value = now
+                skipped.append(annotation.skip_frame({"x": None}))
+            event = annotation.create({"image": b"frame", "x": [1.0]}, None)
+        self.assertEqual(skipped, [False, True, False, True, False, False, True])
+        self.assertEqual(annotation.STATS["skipped_frames"], {None: 4})
+        self.assertEqual(event["annotated_image"], b"frame")
+        self.assertEqual(annotation.STATS["passthrough_frames"], passthrough_frames + 1)
+
+
+class TestPseudonymization(unittest.TestCase):
+    """Test class to validate pseudonymization of bounding boxes."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.image = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+        self.data = {
+            "x": [10.0, 30.0, 150.0],
+            "y": [10.0, 20.0, 100.0],
+            "w": [40.0, 40.0, 20.0],
+            "h": [40.0, 40.0, 30.0],
+            "score": [0.9, 0.8, 0.7],
+            "label": "person,person,person",
+        }
+
+    def tearDown(self):
+        update_settings(pseudonymization=SETTINGS["pseudonymization"])
+
+    def test_merge_boxes(self):
+        """Tests that overlapping boxes are merged, including boxes that overlap after merging."""
+        boxes = np.array(
+            [[0, 0, 10, 10], [20, 0, 30, 10], [5, 5, 25, 8], [40, 40, 40, 50]]
+        )
+        self.assertEqual(annotation.merge_boxes(boxes), [(0, 0, 30, 10)])
+
+    def test_modes(self):
+        """Tests that only the clipped boxes are changed, for every mode."""
+        inside = np.zeros(self.image.shape[:2], dtype=bool)
+        inside[10:61, 10:71] = True
+        inside[100:, 150:] = True
+        for mode in ["black_bbox", "gaussian_blur", "pixelate"]:
+            with self.subTest(pseudonymization=mode):
+                update_settings(pseudonymization=mode)
+                image = annotation.pseudonymize(
+                    annotation.DetectionBatch(self.data), self.image.copy()
+                )
+                np.testing.assert_array_equal(image[~inside], self.image[~inside])
+                self.assertGreater((image[inside] != self.image[inside]).mean(), 0.5)
+                if mode == "black_bbox":
+                    self.assertFalse(image[inside].any())
+                if mode == "pixelate":  # Blocks of 8 pixels for a box of 61 by 51 pixels
+                    self.assertTrue((image[10:18, 10:18] == image[10, 10]).all())
+
+
+class TestTrails(unittest.TestCase):
+    """Test class to validate track trail rendering."""
+
+    def tearDown(self):
+        update_settings(
+            trail_length=SETTINGS["trail_length"], trail_fade=SETTINGS["trail_fade"]
+        )
+
+    def draw(self):
+        """Draws a horizontal trail of 10 points, oldest on the left, for a single object."""
+        return annotation.annotate_trails(
+            np.zeros((20, 120, 3), dtype=np.uint8),
+            [1],
+            [10],
+            [10.0 * i + 10 for i in range(10)],
+            [10.0] * 10,
+        )
+
+    def test_trail_length(self):
+        """Tests that only the last `trail_length` track points are drawn."""
+        update_settings(trail_length="4", trail_fade="no")
+        image = self.draw()
+        self.assertFalse(image[10, :69].any())
+        self.assertTrue(image[10, 71:100].any(axis=1).all())
+
+    def test_trail_fade(self):
+        """Tests that the oldest part of a trail is dimmer than the newest part."""
+        update_settings(trail_length="10", trail_fade="yes")
+        image = self.draw().astype(int)
+        self.assertTrue(image[10, 15].any())
+        self.assertLess(image[10, 15].sum(), image[10, 95].sum())
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Test class to validate the latency instrumentation."""
+
+    def setUp(self):
+        # Decoded at a reduced size and encoded with OpenCV, so no ESP packages are needed
+        update_settings(
+            input_image_encoding="jpg",
+            output_scale="0.5",
+            encoder_preset="speed",
+        )
+        self.data = {
+            "image": cv2.imencode(".jpg", np.zeros((64, 64, 3), np.uint8))[1].tobytes(),
+            "label": "person",
+            "x": [10.0],
+            "y": [10.0],
+            "w": [20.0],
+            "h": [20.0],
+            "score": [0.9],
+        }
+
+    def tearDown(self):
+        update_settings(
+            **{
+                name: SETTINGS[name]
+                for name in [
+                    "input_image_encoding",
+                    "output_scale",
+                    "encoder_preset",
+                    "instrumentation",
+                    "instrumentation_log_events",
+                    "timing_fields",
+                ]
+            }
+        )
+
+    def test_disabled(self):
+        """Tests that no timing fields are added and nothing is recorded by default."""
+        annotation.reset_timings()
+        event = annotation.create(self.data, None)
+        self.assertEqual(list(event), ["annotated_image"])
+        self.assertEqual(annotation.TIMINGS["events"], 0)
+
+    def test_timing_fields(self):
+        """Tests that the latency of every stage is added to the output event."""
+        update_settings(timing_fields="yes")
+        event = annotation.create(self.data, None)
+        stages = [f"{stage}_us" for stage in ["processing"] + annotation.TIMING_STAGES]
+        self.assertEqual(sorted(event), sorted(["annotated_image"] + stages))
+        self.assertGreaterEqual(
+            event["processing_us"],
+            sum(event[stage] for stage in stages[1:]) - len(stages),  # Rounding
+        )
+
+    def test_summary(self):
+        """Tests that a summary is logged and the histograms are reset every N events."""
+        update_settings(instrumentation="yes", instrumentation_log_events="3")
+        annotation.reset_timings()
+        with unittest.mock.patch.object(annotation, "esp", create=True) as esp:
+            for _ in range(4):
+                annotation.create(self.data, None)
+        esp.logMessage.assert_called_once()
+        message = esp.logMessage.call_args.kwargs["message"]
+        self.assertIn("last 3 event(s)", message)
+        self.assertRegex(message, r"encode p50=\d+ p95=\d+ p99=\d+")
+        self.assertEqual(annotation.TIMINGS["events"], 1)
+        self.assertEqual(annotation.TIMINGS["histograms"]["processing"].sum(), 1)
+
+
+class TestSyntheticEvents(unittest.TestCase):
+    """Test class to validate the synthetic event generator."""
+
+    def test_layout(self):
+        """Tests that the fields and array lengths match the _espconfig_ input variables."""
+        input_field_names = [d["name"] for d in espconfig["inputVariables"]["fields"]]
+        data = next(
+            synthetic_events.generate_events(
+                1, objects=5, keypoints=17, track_depth=3, attributes=True
+            )
+        )
+        self.assertLessEqual(set(data), set(input_field_names))
+        self.assertEqual(len(data["label"].split(",")), 5)
+        self.assertEqual(len(data["attribute"].split(",")), 5)
+        self.assertEqual(len(data["object_track_x"]), 15)
+        self.assertEqual(len(data["object_track_kpts_count"]), 15)
+        self.assertEqual(len(data["object_track_kpts_x"]), 15 * 17)
+        # The last track point of every object is the center of its box
+        self.assertAlmostEqual(data["object_track_x"][2], data["x"][0] + data["w"][0] / 2)
+
+    def test_without_tracks(self):
+        """Tests the layout of a post-processing window, without object tracking."""
+        data = next(synthetic_events.generate_events(1, objects=4, track_depth=0))
+        self.assertNotIn("object_track_count", data)
+        self.assertNotIn("object_id", data)
+        self.assertEqual(len(data["object_track_kpts_count"]), 4)
+
+    def test_seed(self):
+        """Tests that the same seed generates the same events."""
+        first, second = [
+            list(synthetic_events.generate_events(2, seed=7, image_encoding="png"))
+            for _ in range(2)
+        ]
+        self.assertEqual(first, second)
+        image = cv2.imdecode(np.frombuffer(first[0]["image"], np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(image.shape, (720, 1280, 3))
+
+    def test_annotate_many_objects(self):
+        """Tests annotating 200 tracked objects with keypoints and trails."""
+        update_settings(trail_length="30")
+        try:
+            data = next(
+                synthetic_events.generate_events(1, objects=200, track_depth=30)
+            )
+            image = annotation.annotate(data, data["image"].copy())
+            self.assertEqual(image.shape, data["image"].shape)
+        finally:
+            update_settings(trail_length=SETTINGS["trail_length"])
+
+
+class TestReplay(unittest.TestCase):
+    """Test class to validate the offline replay of captures."""
+
+    def setUp(self):
+        self.capture = "test_files/array_rect_object_tracker_frame_id_180_pingpong.csv"
+        self.settings = dict(replay.default_settings(), kpts_labels=SETTINGS["kpts_labels"])
+
+    def test_images_and_video(self):
+        """Tests that numbered images and a video are written by a pool of processes."""
+        with tempfile.TemporaryDirectory() as directory:
+            frames = replay.replay(
+                self.capture,
+                directory,
+                esp_capture.MAPPINGS["object_tracker"],
+                self.settings,
+                workers=2,
+            )
+            self.assertEqual(frames, 1)
+            image = cv2.imread(os.path.join(directory, "frame_000000.jpg"))
+            self.assertEqual(image.shape, (720, 1280, 3))
+
+            video = os.path.join(directory, "replay.avi")
+            replay.replay(
+                self.capture,
+                video,
+                esp_capture.MAPPINGS["object_tracker"],
+                dict(self.settings, output_scale="0.5"),
+            )
+            capture = cv2.VideoCapture(video)
+            ok, frame = capture.read()
+            capture.release()
+            self.assertTrue(ok)
+            self.assertEqual(frame.shape, (360, 640, 3))
+
+    def test_invalid_settings(self):
+        """Tests that the settings are validated with `init()` before replaying."""
+        try:
+            with self.assertLogs(annotation.LOGGING_CONTEXT, "CRITICAL"):
+                with self.assertRaises(ValueError):
+                    replay.replay(
+                        self.capture,
+                        "unused.avi",
+                        esp_capture.MAPPINGS["object_tracker"],
+                        dict(self.settings, heatmap="everywhere"),
+                    )
+        finally:
+            annotation.error = False
+            annotation.init(dict(SETTINGS))
+
+    def test_invalid_row_skipped(self):
+        """Tests that a row with invalid detections is logged and skipped."""
+        _, data = next(
+            esp_capture.iter_capture(self.capture, esp_capture.MAPPINGS["object_tracker"])
+        )
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                replay.start_worker(
+                    dict(self.settings, input_image_encoding="jpg"), directory, "jpg"
+                )
+                with self.assertLogs(annotation.LOGGING_CONTEXT, "WARNING") as logs:
+                    result = replay.annotate_row((7, dict(data, y=data["y"][:-1])))
+                self.assertEqual(result, (7, None, False))
+                self.assertIn("Skipping row 7", logs.output[0])
+                self.assertEqual(os.listdir(directory), [])
+        finally:
+            annotation.init(dict(SETTINGS))
+
+    def test_decoded_like_window(self):
+        """Tests that rows are decoded and downscaled with `decode_image`, like in the custom window."""
+        _, data = next(
+            esp_capture.iter_capture(self.capture, esp_capture.MAPPINGS["object_tracker"])
+        )
+        settings = dict(self.settings, input_image_encoding="jpg", output_scale="0.5")
+        try:
+            replay.start_worker(settings, "unused.avi", "jpg")
+            with unittest.mock.patch.object(
+                annotation, "decode_image", wraps=annotation.decode_image
+            ) as decode_image:
+                _, frame, annotated = replay.annotate_row((0, data))
+            decode_image.assert_called_once_with(base64.b64decode(data["image"]))
+            self.assertTrue(annotated)
+            self.assertEqual(frame.shape, (360, 640, 3))
+        finally:
+            annotation.init(dict(SETTINGS))
+
+
+class TestCapture(unittest.TestCase):
+    """Test class to validate the loader of captures."""
+
+    def setUp(self):
+        self.capture = "test_files/array_rect_object_tracker_frame_id_180_pingpong.csv"
+
+    def test_parse_arrays(self):
+        """Tests that array cells are parsed into one array per cell, with empty arrays for empty cells."""
+        arrays = esp_capture.parse_arrays(["[1.5;2]", "", "[]", "['3';'4';'5']"])
+        self.assertEqual(
+            [a.tolist() for a in arrays], [[1.5, 2.0], [], [], [3.0, 4.0, 5.0]]
+        )
+        arrays = esp_capture.parse_arrays(["[1;2]", "[3]"], np.int64)
+        self.assertEqual(arrays[1].dtype, np.int64)
+        self.assertEqual(arrays[1].tolist(), [3])
+        for cell in ["[1;a;2]", "[1;;2]", "[1;2a]"]:
+            with self.assertRaises(ValueError):
+                esp_capture.parse_arrays([cell])
+
+    def test_read_capture(self):
+        """Tests that rows are mapped to input variables with arrays for array cells."""
+        capture = esp_capture.read_capture(
+            self.capture, esp_capture.MAPPINGS["object_tracker"]
+        )
+        self.assertEqual(len(capture), 1)
+        data = capture[0]
+        self.assertEqual(data["object_id"].tolist(), [1, 2])
+        self.assertEqual(data["x"].tolist(), [932.0, 124.0])
+        self.assertEqual(data["label"], "person,person")
+        self.assertEqual(len(data["object_track_x"]), sum(data["object_track_count"]))
+        self.assertEqual(data["image"].shape, (720, 1280, 3))
+        # The image is decoded when the row is accessed
+        self.assertIsInstance(capture.events[0]["image"], str)
+        self.assertEqual(capture.blob(0)[:2], b"\xff\xd8")
+
+    def test_chunks(self):
+        """Tests that the rows are the same for every chunk size."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "capture.csv")
+            with open(self.capture, "r", encoding="utf-8") as f:
+                header, row = f.read().splitlines()[:2]
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join([header] + [row] * 5) + "\n")
+            mapping = esp_capture.MAPPINGS["object_tracker"]
+            chunked = list(esp_capture.iter_capture(path, mapping, chunk_rows=2))
+            self.assertEqual([index for index, _ in chunked], list(range(5)))
+            for (_, expected), (_, data) in zip(
+                esp_capture.iter_capture(path, mapping), chunked
+            ):
+                self.assertEqual(
+                    data["object_track_kpts_x"].tolist(),
+                    expected["object_track_kpts_x"].tolist(),
+                )
+                self.assertEqual(data["image"], expected["image"])
+
+
+class TestLocalEsp(unittest.TestCase):
+    """Test class to validate `init()` and `create()` with the stand-ins for the ESP packages."""
+
+    def setUp(self):
+        self.data = next(synthetic_events.generate_events(1, objects=3, track_depth=5))
+
+    def tearDown(self):
+        annotation.error = False
+        annotation.init(dict(SETTINGS))
+
+    def test_wide_image(self):
+        """Tests that wide images keep the size, type and pixels of OpenCV images."""
+        conversion = annotation.esp_utils.image_conversion
+        for image in [
+            self.data["image"],
+            self.data["image"][..., 0].copy(),
+            self.data["image"].astype(np.float32),
+        ]:
+            with self.subTest(shape=image.shape, dtype=image.dtype):
+                wide = conversion.opencv_image_to_sas_wide_image(image)
+                self.assertEqual(len(wide), 24 + image.nbytes)
+                self.assertEqual(
+                    np.frombuffer(wide[:24], "<i8").tolist()[:2], [1280, 720]
+                )
+                decoded = conversion.sas_wide_image_to_opencv_image(wide)
+                self.assertEqual(decoded.dtype, image.dtype)
+                self.assertTrue((decoded == image).all())
+        with self.assertRaises(ValueError):
+            conversion.sas_wide_image_to_opencv_image(wide[:-1])
+
+    def test_init(self):
+        """Tests that `init()` logs the settings, and a fatal error for invalid settings."""
+        with self.assertLogs(annotation.LOGGING_CONTEXT, "INFO") as logs:
+            annotation.init(dict(SETTINGS))
+        self.assertIn(
+            "Using `wide` (input) and `jpg` (output) image encoding", logs.output[1]
+        )
+        self.assertFalse(annotation.error)
+
+        with self.assertLogs(annotation.LOGGING_CONTEXT, "CRITICAL") as logs:
+            annotation.init(dict(SETTINGS, worker_threads="0"))
+        self.assertIn(
+            "Setting `worker_threads` value `0` is not supported", logs.output[0]
+        )
+        self.assertIsNone(annotation.create(self.data, None))
+
+    def test_create(self):
+        """Tests the whole `create()` path for every input and output image encoding."""
+        conversion = annotation.esp_utils.image_conversion
+        blobs = {
+            "wide": conversion.opencv_image_to_sas_wide_image(self.data["image"]),
+            "jpg": conversion.opencv_image_to_blob_image(self.data["image"], ".jpg"),
+            "png": conversion.opencv_image_to_blob_image(self.data["image"], ".png"),
+        }
+        for input_encoding, blob in blobs.items():
+            for output_encoding in annotation.SUPPORTED_IMAGE_ENCODING:
+                with self.subTest(input=input_encoding, output=output_encoding):
+                    with self.assertLogs(annotation.LOGGING_CONTEXT, "INFO"):
+                        annotation.init(
+                            dict(
+                                SETTINGS,
+                                input_image_encoding=input_encoding,
+                                output_image_encoding=output_encoding,
+                            )
+                        )
+                    event = annotation.create(dict(self.data, image=blob), None)
+                    if output_encoding == "wide":
+                        image = conversion.sas_wide_image_to_opencv_image(
+                            event["annotated_image"]
+                        )
+                    else:
+                        image = conversion.blob_image_to_opencv_image(
+                            event["annotated_image"]
+                        )
+                    self.assertEqual(image.shape, self.data["image"].shape)
+                    # The boxes are drawn, so the image differs from the input image
+                    self.assertGreater(
+                        cv2.absdiff(image, self.data["image"]).max(), 64
+                    )
+
+    def test_wide_in_place(self):
+        """Tests that writable wide images are annotated in place, and other wide images are copied."""
+        conversion = annotation.esp_utils.image_conversion
+        wide = conversion.opencv_image_to_sas_wide_image(self.data["image"])
+        update_settings(input_image_encoding="wide", output_image_encoding="wide")
+        try:
+            annotation.STATS["wide_in_place_frames"] = 0
+            annotation.STATS["wide_copied_frames"] = 0
+            blob = bytearray(wide)
+            event = annotation.create(dict(self.data, image=blob), None)
+            self.assertIs(event["annotated_image"], blob)
+            self.assertNotEqual(bytes(blob), wide)
+
+            # Read-only buffers are copied, with the same result
+            copied = annotation.create(dict(self.data, image=wide), None)
+            self.assertEqual(copied["annotated_image"], bytes(blob))
+            self.assertEqual(annotation.STATS["wide_in_place_frames"], 1)
+            self.assertEqual(annotation.STATS["wide_copied_frames"], 1)
+
+            # Downscaled images are copied
+            update_settings(output_scale="0.5")
+            event = annotation.create(dict(self.data, image=bytearray(wide)), None)
+            image = conversion.sas_wide_image_to_opencv_image(event["annotated_image"])
+            self.assertEqual(image.shape, (360, 640, 3))
+            self.assertEqual(annotation.STATS["wide_copied_frames"], 2)
+        finally:
+            update_settings(
+                input_image_encoding=SETTINGS["input_image_encoding"],
+                output_image_encoding=SETTINGS["output_image_encoding"],
+                output_scale=SETTINGS["output_scale"],
+            )
+
+    def test_wide_layout_mismatch(self):
+        """Tests that wide images are converted with `esp_utils` when its layout is not the expected layout."""
+
+        def to_wide(image):  # The height before the width
+            header = np.array([image.shape[0], image.shape[1], 16], dtype="<i8")
+            return header.tobytes() + image.tobytes()
+
+        def from_wide(blob):
+            height, width = np.frombuffer(blob, dtype="<i8", count=2).tolist()
+            return np.frombuffer(blob, dtype=np.uint8, offset=24).reshape(height, width, 3).copy()
+
+        with unittest.mock.patch.multiple(
+            annotation.esp_utils.image_conversion,
+            opencv_image_to_sas_wide_image=to_wide,
+            sas_wide_image_to_opencv_image=from_wide,
+        ):
+            with self.assertLogs(annotation.LOGGING_CONTEXT, "WARNING") as logs:
+                annotation.init(dict(SETTINGS, output_image_encoding="wide"))
+            self.assertIn("The wide image layout of esp_utils", logs.output[0])
+            self.assertFalse(annotation.WIDE_LAYOUT)
+
+            blob = bytearray(to_wide(self.data["image"]))
+            self.assertEqual(annotation.get_input_image_size(blob), (1280, 720))
+            annotation.STATS["wide_copied_frames"] = 0
+            event = annotation.create(dict(self.data, image=blob), None)
+            self.assertEqual(annotation.STATS["wide_copied_frames"], 1)
+            image = from_wide(bytes(event["annotated_image"]))
+            self.assertEqual(image.shape, self.data["image"].shape)
+            self.assertGreater(cv2.absdiff(image, self.data["image"]).max(), 64)
+
+        annotation.init(dict(SETTINGS))
+        self.assertTrue(annotation.WIDE_LAYOUT)
+
+
+class TestDetectionBatch(unittest.TestCase):
+    """Test class to validate the detections built once per event."""
+
+    def setUp(self):
+        self.data = next(
+            synthetic_events.generate_events(
+                1, objects=3, track_depth=2, attributes=True, image_encoding="jpg"
+            )
+        )
+
+    def test_fields(self):
+        """Tests that boxes are truncated like `int()`, and labels and keypoints are decoded once."""
+        batch = annotation.DetectionBatch(dict(self.data, x=[1.9, 2.5, 3.0]))
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.boxes.dtype, np.int32)
+        self.assertEqual(batch.boxes[:, 0].tolist(), [1, 2, 3])
+        self.assertEqual(batch.boxes[0, 2], int(1.9 + self.data["w"][0]))
+        self.assertEqual(batch.labels, self.data["label"].split(","))
+        self.assertEqual(len(batch.attributes), 3)
+        self.assertEqual(batch.object_id.tolist(), [1, 2, 3])
+        self.assertEqual(len(batch.track_x), 6)
+        self.assertEqual(
+            batch.kpts["object_index"].tolist(), np.repeat([0, 1, 2], 17).tolist()
+        )
+        with self.assertRaises(AttributeError):
+            batch.other = None  # pylint: disable=attribute-defined-outside-init
+
+        # Without boxes, nothing is checked or decoded
+        batch = annotation.DetectionBatch(dict(self.data, x=[]))
+        self.assertEqual(len(batch), 0)
+        self.assertIsNone(batch.kpts)
+
+    def test_count_mismatch(self):
+        """Tests that labels and attributes that do not match the boxes are rejected before drawing."""
+        for name, value in [("label", "person,car"), ("attribute", "a,b,c,d")]:
+            with self.subTest(name=name):
+                with self.assertRaisesRegex(ValueError, f"`{name}` has"):
+                    annotation.DetectionBatch(dict(self.data, **{name: value}))
+
+    def test_track_and_keypoint_count_mismatch(self):
+        """Tests that track counts and keypoint arrays that do not match are rejected before drawing."""
+        data = self.data
+        for name, value, message in [
+            ("object_track_count", data["object_track_count"][:-1], "for 3 box(es)"),
+            ("object_track_kpts_count", data["object_track_kpts_count"][:-1], "for 6 track(s)"),
+            ("object_track_kpts_x", data["object_track_kpts_x"][:-1], "for 102 keypoint(s)"),
+            ("object_track_kpts_y", None, "for 102 keypoint(s)"),
+            ("object_track_kpts_score", data["object_track_kpts_score"][:5], "keypoint(s)"),
+            ("object_track_kpts_label_id", data["object_track_kpts_label_id"] * 2, "keypoint(s)"),
+        ]:
+            with self.subTest(name=name):
+                with self.assertRaisesRegex(ValueError, f"`{name}` has .* {re.escape(message)}"):
+                    annotation.DetectionBatch(dict(data, **{name: value}))
+        # Without tracks, there is one keypoint count per box
+        data = {name: v for name, v in data.items() if not name.startswith("object_track")}
+        data.update(object_track_kpts_count=[17] * 2, object_track_kpts_x=[0.0] * 34)
+        with self.assertRaisesRegex(ValueError, "for 3 track"):
+            annotation.DetectionBatch(data)
+
+    def test_invalid_frame_dropped(self):
+        """Tests that `create()` logs, counts and drops a frame with invalid detections."""
+        update_settings(input_image_encoding="jpg")
+        annotation.STATS["invalid_frames"] = 0
+        try:
+            with self.assertLogs(annotation.LOGGING_CONTEXT, "WARNING") as logs:
+                events = annotation.create(
+                    [dict(self.data, label="person"), self.data], None
+                )
+        finally:
+            update_settings(input_image_encoding=SETTINGS["input_image_encoding"])
+        self.assertEqual(len(events), 1)
+        self.assertIn("`label` has 1 value(s) for 3 box(es)", logs.output[0])
+        self.assertEqual(annotation.STATS["invalid_frames"], 1)
+
+    def test_cull(self):
+        """Tests that `min_score`, `min_box_area` and `max_objects` leave out boxes with their labels, tracks and keypoints."""
+        data = dict(
+            self.data, score=[0.75, 0.95, 0.45], w=[20, 100, 100], h=[20, 100, 100]
+        )
+        batch = annotation.DetectionBatch(data)
+        for settings, kept in [
+            ({}, [0, 1, 2]),
+            ({"min_score": "0.5"}, [0, 1]),
+            ({"min_box_area": "1000"}, [1, 2]),
+            ({"max_objects": "2"}, [0, 1]),
+            ({"max_objects": "1", "min_box_area": "1000"}, [1]),
+            ({"min_score": "0.99"}, []),
+        ]:
+            with self.subTest(settings=settings):
+                update_settings(**settings)
+                try:
+                    culled = batch.cull(1280, 1280)
+                finally:
+                    update_settings(**{name: SETTINGS[name] for name in settings})
+                self.assertEqual(culled.object_id.tolist(), [i + 1 for i in kept])
+                self.assertEqual(culled.labels, [batch.labels[i] for i in kept])
+                self.assertEqual(culled.attributes, [batch.attributes[i] for i in kept])
+                self.assertEqual(culled.track_count.tolist(), [2] * len(kept))
+                self.assertEqual(
+                    culled.track_x.tolist(),
+                    [batch.track_x[2 * i + j] for i in kept for j in range(2)],
+                )
+                self.assertEqual(
+                    culled.kpts["object_index"].tolist(),
+                    np.repeat(range(len(kept)), 17).tolist(),
+                )
+                self.assertEqual(
+                    culled.kpts["points"].tolist(),
+                    batch.kpts["points"][np.isin(batch.kpts["object_index"], kept)].tolist(),
+                )
+
+    def test_cull_off_frame(self):
+        """Tests that boxes outside the image are left out, and the other boxes are clipped."""
+        data = dict(
+            self.data, x=[-50, -200, 10], y=[10, 10, 300], w=[100] * 3, h=[50] * 3
+        )
+        culled = annotation.DetectionBatch(data).cull(200, 200)
+        self.assertEqual(culled.boxes.tolist(), [[-1, 10, 50, 60]])
+        self.assertEqual(culled.labels, [data["label"].split(",")[0]])
+
+    def test_culled_boxes_pseudonymized(self):
+        """Tests that boxes that are not drawn are still pseudonymized."""
+        image = np.full((200, 200, 3), 255, dtype=np.uint8)
+        data = dict(self.data, x=[10, 100, 300], y=[10, 100, 10], w=[50] * 3, h=[50] * 3)
+        update_settings(pseudonymization="black_bbox", min_score="0.99")
+        try:
+            annotated = annotation.annotate(data, image.copy())
+        finally:
+            update_settings(
+                pseudonymization=SETTINGS["pseudonymization"], min_score=SETTINGS["min_score"]
+            )
+        self.assertEqual(annotated[10:61, 10:61].max(), 0)
+        self.assertEqual(annotated[100:151, 100:151].max(), 0)
+        self.assertEqual(annotated[70:90, 70:90].min(), 255)
+
+
+class TestRenderProfiles(unittest.TestCase):
+    """Test class to validate the line types, labels and keypoint markers of the render profiles."""
+
+    def setUp(self):
+        annotation.LABEL_CACHE.clear()
+
+    def tearDown(self):
+        annotation.LABEL_CACHE.clear()
+        update_settings(render_profile=SETTINGS["render_profile"])
+
+    def test_profiles(self):
+        """Tests that every profile annotates an image, and that the profiles draw differently."""
+        data = next(synthetic_events.generate_events(1, objects=5, track_depth=3))
+        images = {}
+        for profile in annotation.RENDER_PROFILES:
+            with self.subTest(render_profile=profile):
+                update_settings(render_profile=profile, show_keypoint_labels="yes")
+                try:
+                    images[profile] = annotation.annotate(data, data["image"].copy())
+                finally:
+                    update_settings(show_keypoint_labels=SETTINGS["show_keypoint_labels"])
+                self.assertFalse((images[profile] == data["image"]).all())
+        self.assertFalse((images["quality"] == images["balanced"]).all())
+        self.assertFalse((images["balanced"] == images["fast"]).all())
+
+    def test_line_type(self):
+        """Tests that `quality` draws anti-aliased lines, and `fast` draws lines without blending."""
+        images = {}
+        for profile in ["quality", "fast"]:
+            update_settings(render_profile=profile)
+            images[profile] = np.zeros((100, 100, 3), dtype=np.uint8)
+            annotation.draw_bbox(images[profile], (10, 50), (90, 80), "", (255, 255, 255))
+        self.assertGreater(len(np.unique(images["quality"])), 2)
+        self.assertEqual(np.unique(images["fast"]).tolist(), [0, 255])
+
+    def test_fast_labels(self):
+        """Tests that `fast` labels have no background and that small boxes get no label."""
+        update_settings(render_profile="fast")
+        image = np.zeros((100, 100, 3), dtype=np.uint8)
+        annotation.draw_bbox(image, (10, 50), (90, 80), "#1 person", (255, 255, 255))
+        label = image[35:49, 10:60]
+        self.assertTrue(label.any())
+        self.assertFalse(label.all())
+
+        data = {
+            "label": "person,person",
+            "x": [5, 40],
+            "y": [30, 30],
+            "w": [10, 50],
+            "h": [10, 50],
+            "score": [0.9, 0.9],
+        }
+        image = annotation.annotate(data, np.zeros((100, 100, 3), dtype=np.uint8))
+        self.assertFalse(image[15:29, 5:16].any())
+        self.assertTrue(image[15:29, 40:91].any())
+
+    def test_keypoint_dots(self):
+        """Tests that `fast` keypoint markers are dots of the marker size, for left and right body parts."""
+        data = {
+            "label": "person",
+            "x": [10],
+            "y": [10],
+            "w": [80],
+            "h": [80],
+            "score": [0.9],
+            "object_track_kpts_count": [2],
+            "object_track_kpts_x": [30, 70],
+            "object_track_kpts_y": [50, 50],
+            "object_track_kpts_score": [0.9, 0.9],
+            "object_track_kpts_label_id": [1, 2],
+        }
+        radius = annotation.KEYPOINT_RADIUS
+        for profile in ["quality", "fast"]:
+            with self.subTest(render_profile=profile):
+                update_settings(render_profile=profile, skeleton="")
+                try:
+                    image = annotation.annotate(
+                        data, np.zeros((100, 100, 3), dtype=np.uint8)
+                    )
+                finally:
+                    update_settings(skeleton=SETTINGS["skeleton"])
+                for x in [30, 70]:
+                    self.assertTrue(image[50, x - radius + 1 : x + radius].all())
+                    self.assertFalse(image[50, x + radius + 2].any())
+
+    def test_invalid_profile(self):
+        """Tests that `init()` rejects unknown render profiles."""
+        try:
+            with self.assertLogs(annotation.LOGGING_CONTEXT, "CRITICAL") as logs:
+                annotation.init(dict(SETTINGS, render_profile="slow"))
+        finally:
+            annotation.error = False
+            annotation.init(dict(SETTINGS))
+        self.assertIn("Setting `render_profile` value `slow`", logs.output[0])
+
+
+class TestHeatmap(unittest.TestCase):
+    """Test class to validate the detection heatmap per camera."""
+
+    def setUp(self):
+        annotation.HEATMAPS.clear()
+        update_settings(
+            heatmap="centers",
+            heatmap_cell_size="10",
+            heatmap_half_life="1",
+            input_image_encoding="jpg",
+        )
+        image = np.zeros((100, 200, 3), dtype=np.uint8)
+        self.blob = cv2.imencode(".jpg", image)[1].tobytes()
+
+    def tearDown(self):
+        annotation.HEATMAPS.clear()
+        update_settings(
+            **{
+                name: SETTINGS[name]
+                for name in [
+                    "heatmap",
+                    "heatmap_output",
+                    "heatmap_cell_size",
+                    "heatmap_half_life",
+                    "input_image_encoding",
+                    "skip_mode",
+                ]
+            }
+        )
+
+    def event(self, x, camera_id=None):
+        """Makes an event with 20 by 20 pixel boxes at the given x-coordinates."""
+        data = {
+            "image": self.blob,
+            "label": ",".join(["person"] * len(x)),
+            "x": x,
+            "y": [40] * len(x),
+            "w": [20] * len(x),
+            "h": [20] * len(x),
+            "score": [0.9] * len(x),
+        }
+        if camera_id is not None:
+            data["camera_id"] = camera_id
+        return data
+
+    def test_centers(self):
+        """Tests that box centers are added to their cells, with the decay applied when rendering."""
+        annotation.add_to_heatmap(self.event([40, 40, 140]))
+        annotation.add_to_heatmap(self.event([]))
+        annotation.add_to_heatmap(self.event([40]))
+        heatmap = annotation.HEATMAPS[None]
+        self.assertEqual(heatmap["grid"].shape, (10, 20))
+        self.assertEqual(heatmap["weight"], 4.0)  # Grows by 2 per frame with a half-life of 1
+        self.assertEqual(heatmap["grid"][5, 5], 2 + 4)
+        self.assertEqual(heatmap["grid"].sum(), 3 + 4)
+
+        colored = annotation.render_heatmap(self.event([]), (50, 100, 3), 0.5)
+        self.assertEqual(colored.shape, (50, 100, 3))
+        self.assertEqual(heatmap["weight"], 1.0)
+        self.assertEqual(heatmap["grid"][5, 5], 0.5 + 1)
+        self.assertEqual(heatmap["grid"][5, 15], 0.25)
+        self.assertGreater(colored[27, 27].sum(), colored[27, 77].sum())
+        self.assertFalse(colored[5, 5].any())
+
+    def test_areas(self):
+        """Tests that the cells under the boxes are added, and that cameras have separate heatmaps."""
+        update_settings(heatmap="areas")
+        annotation.add_to_heatmap(self.event([45, 190], camera_id="a"))
+        annotation.add_to_heatmap(self.event([0], camera_id="b"))
+        grid = annotation.HEATMAPS["a"]["grid"]
+        self.assertEqual(
+            np.argwhere(grid[:, :10]).tolist(),
+            [[4, 4], [4, 5], [4, 6], [5, 4], [5, 5], [5, 6]],
+        )
+        self.assertEqual(grid[4:6, 19].tolist(), [1, 1])  # Clipped to the image
+        self.assertEqual(annotation.HEATMAPS["b"]["grid"].sum(), 4)
+
+    def test_renormalize(self):
+        """Tests that the grid is divided by the weight before the weight gets too large."""
+        for _ in range(25):
+            annotation.add_to_heatmap(self.event([40]))
+        heatmap = annotation.HEATMAPS[None]
+        self.assertLessEqual(heatmap["weight"], annotation.HEATMAP_MAX_WEIGHT)
+        annotation.render_heatmap(self.event([]), (100, 200, 3))
+        self.assertAlmostEqual(float(heatmap["grid"][5, 5]), 2.0, places=4)
+
+    def test_outputs(self):
+        """Tests that `create()` blends the heatmap into the image or outputs it as a field."""
+        data = self.event([40, 140])
+        plain = annotation.create(dict(data), None)
+        self.assertNotIn("heatmap_image", plain)
+        for output in annotation.SUPPORTED_HEATMAP_OUTPUTS:
+            with self.subTest(heatmap_output=output):
+                annotation.HEATMAPS.clear()
+                update_settings(heatmap_output=output)
+                event = annotation.create(dict(data), None)
+                annotated = cv2.imdecode(
+                    np.frombuffer(event["annotated_image"], np.uint8), cv2.IMREAD_COLOR
+                )
+                if output == "blend":
+                    self.assertNotIn("heatmap_image", event)
+                    self.assertGreater(annotated[50, 50].sum(), 100)
+                else:
+                    heatmap = cv2.imdecode(
+                        np.frombuffer(event["heatmap_image"], np.uint8), cv2.IMREAD_COLOR
+                    )
+                    self.assertEqual(heatmap.shape, (100, 200, 3))
+                    self.assertGreater(heatmap[50, 50].sum(), 100)
+                    self.assertLess(annotated[50, 50].sum(), 30)
+
+    def test_empty_frames(self):
+        """Tests that frames without detections show the heatmap, and skipped frames are passed through."""
+        annotation.create(self.event([40, 140]), None)
+        for output in annotation.SUPPORTED_HEATMAP_OUTPUTS:
+            with self.subTest(heatmap_output=output):
+                update_settings(heatmap_output=output)
+                event = annotation.create(self.event([]), None)
+                annotated = cv2.imdecode(
+                    np.frombuffer(event["annotated_image"], np.uint8), cv2.IMREAD_COLOR
+                )
+                if output == "blend":
+                    self.assertNotIn("heatmap_image", event)
+                    self.assertGreater(annotated[50, 50].sum(), 100)
+                else:
+                    heatmap = cv2.imdecode(
+                        np.frombuffer(event["heatmap_image"], np.uint8), cv2.IMREAD_COLOR
+                    )
+                    self.assertGreater(heatmap[50, 50].sum(), 100)
+                    self.assertLess(annotated[50, 50].sum(), 30)
+
+        update_settings(skip_mode="passthrough")
+        event = annotation.process_event(self.event([]), skipped=True)
+        self.assertEqual(event, {"annotated_image": self.blob})
+
+
+class TestSegments(unittest.TestCase):
+    """Test class to validate the rolling video segments of annotated frames."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        update_settings(input_image_encoding="jpg", segment_seconds="60")
+        annotation.start_segment_sink(self.directory.name, 10.0, 64)
+        image = np.zeros((100, 200, 3), dtype=np.uint8)
+        self.data = {
+            "image": cv2.imencode(".jpg", image)[1].tobytes(),
+            "label": "person",
+            "x": [40],
+            "y": [40],
+            "w": [20],
+            "h": [20],
+            "score": [0.9],
+        }
+
+    def tearDown(self):
+        annotation.start_segment_sink("", 10.0, 64)
+        update_settings(
+            input_image_encoding=SETTINGS["input_image_encoding"],
+            segment_seconds=SETTINGS["segment_seconds"],
+        )
+        self.directory.cleanup()
+
+    def frame_counts(self):
+        """Closes the segments and returns the number of frames per segment file."""
+        annotation.start_segment_sink("", 10.0, 64)
+        counts = {}
+        for name in os.listdir(self.directory.name):
+            capture = cv2.VideoCapture(os.path.join(self.directory.name, name))
+            counts[name] = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            capture.release()
+        return counts
+
+    def test_segments_closed_at_exit(self):
+        """Tests that the open segments are closed when the process exits, so they can be played."""
+        script = "\n".join(
+            [
+                "import sys",
+                "sys.path.insert(0, 'local_esp')",
+                "import cv2, numpy as np, annotation, test",
+                "annotation.init(dict(test.SETTINGS, input_image_encoding='jpg',"
+                f" segment_directory={self.directory.name!r}))",
+                "image = cv2.imencode('.jpg', np.zeros((100, 200, 3), np.uint8))[1].tobytes()",
+                "data = dict(label='person', x=[40], y=[40], w=[20], h=[20], score=[0.9])",
+                "annotation.create([dict(data, image=image)] * 3, None)",
+            ]
+        )
+        subprocess.run([sys.executable, "-c", script], check=True, capture_output=True)
+        (name,) = os.listdir(self.directory.name)
+        capture = cv2.VideoCapture(os.path.join(self.directory.name, name))
+        self.assertEqual(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 3)
+        capture.release()
+
+    def test_segments(self):
+        """Tests that frames are written to a segment per camera, and that the file names are output."""
+        written = annotation.STATS["segment_frames"]
+        events = annotation.create(
+            [
+                dict(self.data, camera_id="a"),
+                dict(self.data, camera_id="b/1"),
+                dict(self.data, camera_id="a"),
+            ],
+            None,
+        )
+        self.assertEqual(events[0]["segment_file"], events[2]["segment_file"])
+        self.assertTrue(events[0]["segment_file"].startswith("a_"))
+        self.assertTrue(events[1]["segment_file"].startswith("b_1_"))
+        self.assertEqual(
+            self.frame_counts(),
+            {events[0]["segment_file"]: 2, events[1]["segment_file"]: 1},
+        )
+        self.assertEqual(annotation.STATS["segment_frames"] - written, 3)
+
+    def test_empty_frames(self):
+        """Tests that frames without detections are written to the segment, and skipped frames are not."""
+        update_settings(skip_mode="passthrough")
+        try:
+            empty = dict(self.data, x=[], y=[], w=[], h=[], score=[], label="")
+            events = annotation.create([dict(self.data), empty, empty], None)
+            skipped = annotation.process_event(dict(empty), skipped=True)
+        finally:
+            update_settings(skip_mode=SETTINGS["skip_mode"])
+        self.assertEqual(events[1]["segment_file"], events[0]["segment_file"])
+        self.assertEqual(events[1]["annotated_image"], self.data["image"])
+        self.assertNotIn("segment_file", skipped)
+        self.assertEqual(self.frame_counts(), {events[0]["segment_file"]: 3})
+
+    def test_rollover(self):
+        """Tests that a new segment is started after `segment_seconds` and for another frame size."""
+        update_settings(segment_seconds="1")
+        names = []
+        with unittest.mock.patch("time.monotonic", side_effect=[0.0, 0.5, 1.2, 1.3]):
+            for image in [self.data["image"]] * 3 + [
+                cv2.imencode(".jpg", np.zeros((50, 80, 3), dtype=np.uint8))[1].tobytes()
+            ]:
+                event = annotation.create(dict(self.data, image=image), None)
+                names.append(event["segment_file"])
+        self.assertEqual(names[0], names[1])
+        self.assertEqual(len(set(names)), 3)
+        self.assertEqual(sorted(self.frame_counts().values()), [1, 1, 2])
+
+    def test_queue_full(self):
+        """Tests that frames are dropped and counted when the queue is full."""
+        dropped = annotation.STATS["segment_dropped_frames"]
+        with unittest.mock.patch.object(annotation, "SEGMENT_QUEUE", queue.Queue(1)):
+            annotation.create(dict(self.data), None)
+            event = annotation.create(dict(self.data), None)
+        self.assertNotIn("segment_file", event)
+        self.assertEqual(annotation.STATS["segment_dropped_frames"] - dropped, 1)
+
+    def test_invalid_directory(self):
+        """Tests that `init()` rejects a segment directory that cannot be created."""
+        path = os.path.join(self.directory.name, "file")
+        with open(path, "w", encoding="utf-8"):
+            pass
+        try:
+            with self.assertLogs(annotation.LOGGING_CONTEXT, "CRITICAL") as logs:
+                annotation.init(dict(SETTINGS, segment_directory=path))
+        finally:
+            annotation.error = False
+            annotation.init(dict(SETTINGS))
+        self.assertIn("Setting `segment_directory`", logs.output[0])
+
+
+class TestProcessPool(unittest.TestCase):
+    """Test class to validate annotating event blocks with the process pool."""
+
+    def setUp(self):
+        update_settings(
+            input_image_encoding="jpg",
+            output_image_encoding="png",
+            process_slots="2",
+            process_slot_mb="1",
+        )
+        image = np.full((120, 160, 3), 128, dtype=np.uint8)
+        self.block = [
+            {
+                "image": cv2.imencode(".jpg", image)[1].tobytes(),
+                "label": "person",
+                "x": [10 + i],
+                "y": [20],
+                "w": [40],
+                "h": [30],
+                "score": [0.9],
+            }
+            for i in range(5)
+        ]
+
+    def tearDown(self):
+        annotation.start_process_pool(0)
+        update_settings(
+            input_image_encoding=SETTINGS["input_image_encoding"],
+            output_image_encoding=SETTINGS["output_image_encoding"],
+            process_slots=SETTINGS["process_slots"],
+            process_slot_mb=SETTINGS["process_slot_mb"],
+        )
+
+    def test_same_output(self):
+        """Tests that the process pool outputs the same images in the same order as without processes."""
+        expected = annotation.create(self.block, None)
+        annotation.start_process_pool(2)
+        events = annotation.create(self.block, None)
+        self.assertEqual(
+            [event["annotated_image"] for event in events],
+            [event["annotated_image"] for event in expected],
+        )
+
+    def test_passthrough_and_invalid(self):
+        """Tests that frames without detections pass through and invalid frames are dropped."""
+        self.block[1] = dict(self.block[1], x=[])
+        self.block[3] = dict(self.block[3], y=[20, 30])
+        annotation.start_process_pool(2)
+        annotation.STATS["invalid_frames"] = 0
+        with self.assertLogs(annotation.LOGGING_CONTEXT, "WARNING"):
+            events = annotation.create(self.block, None)
+        self.assertEqual(len(events), 4)
+        self.assertEqual(
+            events[1]["annotated_image"],
+            annotation.passthrough_image(self.block[1]["image"]),
+        )
+        self.assertEqual(annotation.STATS["invalid_frames"], 1)
+
+    def test_oversized_frame(self):
+        """Tests that frames larger than a slot are annotated without the process pool, decoded once."""
+        update_settings(process_slot_mb="0.01")
+        annotation.start_process_pool(1)
+        oversized = annotation.STATS["process_oversized_frames"]
+        with unittest.mock.patch.object(
+            annotation, "decode_image", wraps=annotation.decode_image
+        ) as decode_image:
+            events = annotation.create(self.block[:2], None)
+        self.assertEqual(decode_image.call_count, 2)
+        self.assertEqual(annotation.STATS["process_oversized_frames"], oversized + 2)
+        self.assertTrue(all(event is not None for event in events))
+
+
+class TestWarmUp(unittest.TestCase):
+    """Test class to validate the warm-up of `init()`."""
+
+    def tearDown(self):
+        annotation.error = False
+        annotation.init(dict(SETTINGS))
+
+    def test_warm_up(self):
+        """Tests that the warm-up renders every label and keypoint name, and leaves `STATS` as it was."""
+        stats = dict(annotation.STATS)
+        with self.assertLogs(
+            annotation.LOGGING_CONTEXT, "INFO"
+        ) as logs, unittest.mock.patch.object(
+            annotation.cv2, "putText", wraps=cv2.putText
+        ) as put_text:
+            annotation.init(
+                dict(
+                    SETTINGS,
+                    input_image_encoding="jpg",
+                    show_keypoint_labels="yes",
+                    warm_up="yes",
+                    warm_up_width="320",
+                    warm_up_height="240",
+                    warm_up_labels="person,car",
+                )
+            )
+        self.assertTrue(any("Warmed up in" in line for line in logs.output))
+        self.assertEqual(annotation.STATS, stats)
+        texts = {key[0] for key in annotation.LABEL_CACHE}
+        self.assertTrue({"#1 person (100%)", "#2 car (100%)"} <= texts)
+        texts = {call.args[1] for call in put_text.call_args_list}
+        self.assertTrue(set(SETTINGS["kpts_labels"].split(",")) <= texts)
+        colors = {key[1] for key in annotation.LABEL_CACHE}
+        self.assertTrue(set(annotation.COLORS_BGR) <= colors)
+
+    def test_invalid_size(self):
+        """Tests that `init()` rejects a warm-up frame without pixels."""
+        with self.assertLogs(annotation.LOGGING_CONTEXT, "CRITICAL") as logs:
+            annotation.init(dict(SETTINGS, warm_up="yes", warm_up_width="0"))
+        self.assertIn("Setting `warm_up_width` value `0`", logs.output[0])
+
+
+class TestEncoder(unittest.TestCase):
+    """Test class to validate the encoder options."""
+
+    def tearDown(self):
+        update_settings(**{name: SETTINGS[name] for name in ENCODER_SETTINGS})
+
+    def test_default_preset(self):
+        """Tests that the default preset leaves the encoding to ESP, with the OpenCV defaults."""
+        encoder = annotation.compile_encoder(SETTINGS)
+        self.assertIsNone(encoder["params"])
+        self.assertEqual(encoder["backend"], "opencv")
+
+    def test_overrides(self):
+        """Tests that settings override the options of the preset."""
+        encoder = annotation.compile_encoder(
+            dict(SETTINGS, encoder_preset="size", jpeg_quality="55", jpeg_progressive="no")
+        )
+        self.assertEqual(encoder["options"]["jpeg_quality"], 55)
+        self.assertFalse(encoder["options"]["jpeg_progressive"])
+        self.assertTrue(encoder["options"]["jpeg_optimize"])
+
+    def test_presets(self):
+        """Tests that every preset encodes a decodable image, and that `size` gives the smallest JPEG."""
+        image = base64_string_to_opencv(
+            pd.read_csv(
+                "test_files/array_rect_postprocessing_frame_id_180_pingpong.csv"
+            )["image"][0]
+        )
+        sizes = {}
+        for encoding in ["jpg", "png"]:
+            for preset in annotation.ENCODER_PRESETS:
+                if preset == "default":
+                    continue  # Encoded by ESP
+                with self.subTest(encoding=encoding, preset=preset):
+                    update_settings(output_image_encoding=encoding, encoder_preset=preset)
+                    blob = annotation.encode_image(image)
+                    decoded = cv2.imdecode(np.frombuffer(blob, np.uint8), cv2.IMREAD_COLOR)
+                    self.assertEqual(decoded.shape, image.shape)
+                    sizes[(encoding, preset)] = len(blob)
+        self.assertLess(sizes[("jpg", "size")], sizes[("jpg", "speed")])
+        self.assertLess(sizes[("png", "size")], sizes[("png", "speed")])
+
+    @unittest.skipIf(annotation.simplejpeg is None, "simplejpeg is not installed")
+    def test_simplejpeg_backend(self):
+        """Tests that simplejpeg is used, unless progressive or optimized JPEG is requested."""
+        encoder = annotation.compile_encoder(
+            dict(SETTINGS, encoder_preset="speed", jpeg_backend="simplejpeg")
+        )
+        self.assertEqual(encoder["backend"], "simplejpeg")
+        encoder = annotation.compile_encoder(
+            dict(SETTINGS, encoder_preset="size", jpeg_backend="simplejpeg")
+        )
+        self.assertEqual(encoder["backend"], "opencv")
+
+
 class TestAnnotationCustomWindow(unittest.TestCase):
     """Parent class to test the custom window."""
 
@@ -183,9 +1769,8 @@ class TestArrayRectObjectTracker(TestAnnotationCustomWindow):
         created before every test.
 
         The method works as follows:
-        - Create a dataframe by reading from a CSV file. This CSV file has been created by subscribing to an Object Tracker window using a File and Socket subscriber.
-        - Convert string representations of arrays into lists of appropriate types (integers or floats).
-        - Rename columns to match the _espconfig_ inputs (variable mapping)
+        - Read a CSV file with `esp_capture`. This CSV file has been created by subscribing to an Object Tracker window using a File and Socket subscriber.
+          Arrays are converted to NumPy arrays of integers or floats and columns are renamed to match the _espconfig_ inputs (variable mapping).
         - Drop unused columns
         - Check if all required fields have been set
 
@@ -197,41 +1782,10 @@ class TestArrayRectObjectTracker(TestAnnotationCustomWindow):
             FileNotFoundError: If the specified CSV file does not exist at the provided path.
             ValueError: If there is an issue with the `set_and_check_mapping` function.
         """
-        df = pd.read_csv(
+        df = esp_capture.read_capture(
             "test_files/array_rect_object_tracker_frame_id_180_pingpong.csv",
-            converters={
-                "Object_id": lambda x: csv_string_to_list(x, int),
-                "Object_x": lambda x: csv_string_to_list(x, float),
-                "Object_y": lambda x: csv_string_to_list(x, float),
-                "Object_w": lambda x: csv_string_to_list(x, float),
-                "Object_h": lambda x: csv_string_to_list(x, float),
-                "Object_score": lambda x: csv_string_to_list(x, float),
-                "Object_track_count": lambda x: csv_string_to_list(x, int),
-                "Object_track_kpts_count": lambda x: csv_string_to_list(x, int),
-                "Object_track_kpts_x": lambda x: csv_string_to_list(x, float),
-                "Object_track_kpts_y": lambda x: csv_string_to_list(x, float),
-                "Object_track_kpts_score": lambda x: csv_string_to_list(x, float),
-                "Object_track_kpts_label_id": lambda x: csv_string_to_list(x, int),
-            },
-        )
-        df = df.rename(
-            columns={
-                "image": "image",
-                "Object_label": "label",
-                "Object_x": "x",
-                "Object_y": "y",
-                "Object_w": "w",
-                "Object_h": "h",
-                "Object_score": "score",
-                "Object_id": "object_id",
-                "Object_track_count": "object_track_count",
-                "Object_track_kpts_count": "object_track_kpts_count",
-                "Object_track_kpts_x": "object_track_kpts_x",
-                "Object_track_kpts_y": "object_track_kpts_y",
-                "Object_track_kpts_score": "object_track_kpts_score",
-                "Object_track_kpts_label_id": "object_track_kpts_label_id",
-            }
-        )
+            esp_capture.MAPPINGS["object_tracker"],
+        ).to_dataframe()
 
         df = drop_unused_columns(df)
         df = check_mapping(df)
@@ -244,17 +1798,17 @@ class TestArrayRectObjectTracker(TestAnnotationCustomWindow):
 
     def test_pseudonymization_options(self):
         """Tests the annotation process with different pseudonymization options."""
-        pseudonymization_options = ["black_bbox", "none"]
+        pseudonymization_options = ["black_bbox", "gaussian_blur", "pixelate", "none"]
         original_setting = annotation.SETTINGS["pseudonymization"]
 
         for option in pseudonymization_options:
             with self.subTest(pseudonymization=option):
                 try:
-                    annotation.SETTINGS["pseudonymization"] = option
+                    update_settings(pseudonymization=option)
                     df = self.df
                     self.process_and_validate_frame(df, f"_{option}")
                 finally:
-                    annotation.SETTINGS["pseudonymization"] = original_setting
+                    update_settings(pseudonymization=original_setting)
 
     def test_keypoint_labels_options(self):
         """Tests the annotation process with different keypoint label display options."""
@@ -264,11 +1818,11 @@ class TestArrayRectObjectTracker(TestAnnotationCustomWindow):
         for option in keypoint_label_options:
             with self.subTest(show_keypoint_labels=option):
                 try:
-                    annotation.SETTINGS["show_keypoint_labels"] = option
+                    update_settings(show_keypoint_labels=option)
                     df = self.df
                     self.process_and_validate_frame(df, f"_kpts_{option}")
                 finally:
-                    annotation.SETTINGS["show_keypoint_labels"] = original_setting
+                    update_settings(show_keypoint_labels=original_setting)
 
     def test_skeleton_options(self):
         """Tests the annotation process with different skeleton options."""
@@ -282,11 +1836,24 @@ class TestArrayRectObjectTracker(TestAnnotationCustomWindow):
             skeleton_label = "full" if option else "empty"
             with self.subTest(skeleton=skeleton_label):
                 try:
-                    annotation.SETTINGS["skeleton"] = option
+                    update_settings(skeleton=option)
                     df = self.df
                     self.process_and_validate_frame(df, f"_skeleton_{skeleton_label}")
                 finally:
-                    annotation.SETTINGS["skeleton"] = original_setting
+                    update_settings(skeleton=original_setting)
+
+    def test_trail_options(self):
+        """Tests the annotation process with track trails, with and without fading."""
+        try:
+            for option in ["yes", "no"]:
+                with self.subTest(trail_fade=option):
+                    update_settings(trail_length="10", trail_fade=option)
+                    self.process_and_validate_frame(self.df, f"_trail_fade_{option}")
+        finally:
+            update_settings(
+                trail_length=SETTINGS["trail_length"],
+                trail_fade=SETTINGS["trail_fade"],
+            )
 
     def test_ot_no_keypoints(self):
         """Tests the annotation process without object keypoints, but with an object ID."""
@@ -315,37 +1882,10 @@ class TestArrayRectPostprocessing(TestAnnotationCustomWindow):
     def setUp(self):
         """See TestArrayRectObjectTracker.setUp()."""
 
-        df = pd.read_csv(
+        df = esp_capture.read_capture(
             "test_files/array_rect_postprocessing_frame_id_180_pingpong.csv",
-            converters={
-                "Object_x": lambda x: csv_string_to_list(x, float),
-                "Object_y": lambda x: csv_string_to_list(x, float),
-                "Object_width": lambda x: csv_string_to_list(x, float),
-                "Object_height": lambda x: csv_string_to_list(x, float),
-                "Object_score": lambda x: csv_string_to_list(x, float),
-                "Object_kpts_count": lambda x: csv_string_to_list(x, int),
-                "Object_kpts_x": lambda x: csv_string_to_list(x, float),
-                "Object_kpts_y": lambda x: csv_string_to_list(x, float),
-                "Object_kpts_score": lambda x: csv_string_to_list(x, float),
-                "Object_kpts_label_id": lambda x: csv_string_to_list(x, int),
-            },
-        )
-        df = df.rename(
-            columns={
-                "image": "image",
-                "Object_labels": "label",
-                "Object_x": "x",
-                "Object_y": "y",
-                "Object_width": "w",
-                "Object_height": "h",
-                "Object_score": "score",
-                "Object_kpts_count": "object_track_kpts_count",
-                "Object_kpts_x": "object_track_kpts_x",
-                "Object_kpts_y": "object_track_kpts_y",
-                "Object_kpts_score": "object_track_kpts_score",
-                "Object_kpts_label_id": "object_track_kpts_label_id",
-            }
-        )
+            esp_capture.MAPPINGS["postprocessing"],
+        ).to_dataframe()
 
         df = drop_unused_columns(df)
         df = check_mapping(df)
@@ -368,6 +1908,13 @@ class TestArrayRectPostprocessing(TestAnnotationCustomWindow):
         self.process_and_validate_frame(df)
 
 
+def update_settings(**settings):
+    """Updates the custom window settings and recompiles the render plan, like `annotation.init()` does."""
+    annotation.SETTINGS.update(settings)
+    annotation.RENDER_PLAN = annotation.compile_render_plan(annotation.SETTINGS)
+    annotation.ENCODER = annotation.compile_encoder(annotation.SETTINGS)
+
+
 # def show_frame(frame):
 #     cv2.imshow(inspect.stack()[2][3], frame)
 #     while cv2.waitKey(0) & 0xFF == ord("q"):
@@ -432,30 +1979,6 @@ def check_mapping(df):
     return df
 
 
-def csv_string_to_list(string, output_type=int):
-    """Pandas converter to convert an array(i32) or array(dbl) in ESP that was written to a CSV file (e.g., '["1"; "2"; "3"]') into a Python list of integers or floats.
-
-    Args:
-        string (str): A string representation of a list of values, where the values are
-                 separated by semicolons (e.g., '[1;2;3]' or '[1.1;2.2;3.3]').
-                 The input may also be an empty string or '[]', in which case
-                 the function returns an empty list.
-        output_type (type, optional): The type to which each element in the list
-                                       should be converted. This can either be `int`
-                                       (default) or `float`.
-
-    Returns:
-        list[Union[int, float]]: A list of values (either integers or floats).
-                                 If the input string is empty or '[]', an empty list
-                                 is returned.
-    """
-    return (
-        list(map(output_type, string.strip("[]").replace("'", "").split(";")))
-        if string != "" and string != "[]"
-        else []
-    )
-
-
 def base64_string_to_opencv(frame):
     """Converts a base64 encoded image (string) to an OpenCV frame.
 